@@ -0,0 +1,275 @@
+# app/bulk_import.py
+"""
+ورود گروهی سفارش‌ها و aliasها از manifest (CSV یا JSONL).
+
+ستون‌ها/کلیدها: order_code (الزامی)، alias_code، carrier، status (همه اختیاری).
+- فایل سطربه‌سطر خوانده می‌شود و در chunkهای IMPORT_CHUNK_SIZE تایی پردازش می‌شود
+  (حافظه مستقل از اندازه‌ی فایل)
+- هر chunk: یک SELECT برای موجودها + INSERT ... ON CONFLICT DO NOTHING (executemany) و یک commit
+- alias موجودی که به سفارش دیگری اشاره می‌کند تغییر نمی‌کند و به‌عنوان conflict گزارش می‌شود
+- status اگر داده شود روی سفارش (جدید یا موجود) ست می‌شود؛ سفارش‌های جدید و تغییر وضعیت‌ها
+  در تاریخچه (StatusEvent، source=import) و شمارش وضعیت‌ها ثبت می‌شوند
+- آیتم‌های باز صف بررسی (app/review.py) که یکی از کدها/aliasهای جدید را خوانده بودند وصل می‌شوند
+
+CLI:
+    python -m app.bulk_import manifest.csv [--format csv|jsonl] [--chunk-size 1000]
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, update
+from sqlmodel import Session, select
+
+from .deps import engine, init_db, settings
+from .live import live_hub
+from .models import Order, OrderAlias, OrderStatus
+from .order_cache import order_cache
+from .orders import VALID_STATUSES
+from .review import resolve_pending_reviews
+from .status_log import ensure_status_counts, record_status_changes
+
+# (شماره‌ی سطر، order_code، alias_code، carrier، status)
+ImportRow = Tuple[int, str, Optional[str], Optional[str], Optional[str]]
+
+
+def _clean(v) -> Optional[str]:
+    v = (str(v) if v is not None else "").strip()
+    return v or None
+
+
+def _iter_records(text: IO[str], fmt: str) -> Iterator[Tuple[int, Optional[dict]]]:
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for rec in reader:
+            yield reader.line_num, rec
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            rec = None
+        yield line_no, rec if isinstance(rec, dict) else None
+
+
+def iter_rows(text: IO[str], fmt: str, errors: List[dict]) -> Iterator[ImportRow]:
+    """
+    سطرهای نامعتبر به errors اضافه می‌شوند و yield نمی‌شوند.
+    """
+    for line_no, rec in _iter_records(text, fmt):
+        if rec is None:
+            errors.append({"line": line_no, "error": "invalid JSON object"})
+            continue
+        oc = (_clean(rec.get("order_code")) or "").upper()
+        ac = (_clean(rec.get("alias_code")) or "").upper() or None
+        status = _clean(rec.get("status"))
+        if not oc:
+            errors.append({"line": line_no, "error": "order_code required"})
+        elif status is not None and status not in VALID_STATUSES:
+            errors.append({"line": line_no, "error": f"invalid status {status}"})
+        else:
+            yield line_no, oc, ac, _clean(rec.get("carrier")), status
+
+
+def _chunks(rows: Iterable[ImportRow], size: int) -> Iterator[List[ImportRow]]:
+    chunk: List[ImportRow] = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_ignore(session: Session, model, rows: List[dict], key: str) -> Set[str]:
+    """
+    کلیدهای ردیف‌هایی که واقعاً درج شدند (RETURNING)؛ ردیفی که هم‌زمان توسط import یا
+    درخواست دیگری درج شده بود رد می‌شود و در خروجی نیست.
+    """
+    if not rows:
+        return set()
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # بقیه‌ی دیتابیس‌ها: SELECT قبلی موجودها را حذف کرده؛ رقابت هم‌زمان به IntegrityError می‌رسد
+        session.execute(insert(model), rows)
+        return {r[key] for r in rows}
+    col = getattr(model, key)
+    stmt = dialect_insert(model).on_conflict_do_nothing(index_elements=[key]).returning(col)
+    return set(session.execute(stmt, rows).scalars())
+
+
+class ImportReport:
+    def __init__(self, max_conflicts: int):
+        self.max_conflicts = max_conflicts
+        self.rows = 0
+        self.orders_created = 0
+        self.aliases_created = 0
+        self.aliases_existing = 0      # همان نگاشت از قبل بود
+        self.statuses_set = 0
+        self.reviews_resolved = 0
+        self.conflict_count = 0
+        self.conflicts: List[dict] = []
+        self.errors: List[dict] = []
+        self.started = time.monotonic()
+
+    def conflict(self, line_no: int, alias_code: str, order_code: str, existing: str) -> None:
+        self.conflict_count += 1
+        if len(self.conflicts) < self.max_conflicts:
+            self.conflicts.append({"line": line_no, "alias_code": alias_code,
+                                   "order_code": order_code, "existing_order_code": existing})
+
+    def as_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "ok": True,
+            "rows": self.rows,
+            "orders_created": self.orders_created,
+            "aliases_created": self.aliases_created,
+            "aliases_existing": self.aliases_existing,
+            "statuses_set": self.statuses_set,
+            "reviews_resolved": self.reviews_resolved,
+            "conflict_count": self.conflict_count,
+            "conflicts": self.conflicts,
+            "error_count": len(self.errors),
+            "errors": self.errors[:self.max_conflicts],
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(self.rows / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def _import_chunk(session: Session, chunk: List[ImportRow], report: ImportReport) -> None:
+    now = datetime.utcnow()
+
+    # ---------- سفارش‌ها ----------
+    codes = {oc for _, oc, _, _, _ in chunk}
+    existing = set(session.exec(select(Order.code).where(Order.code.in_(codes))))
+    # فقط سفارش‌هایی که واقعاً درج شدند شمرده و در تاریخچه ثبت می‌شوند
+    new_codes = _insert_ignore(session, Order, [
+        {"code": c, "status": OrderStatus.NOT_ARRIVED_DXB, "created_at": now, "updated_at": now}
+        for c in sorted(codes - existing)
+    ], "code")
+    report.orders_created += len(new_codes)
+    record_status_changes(session, ((c, None, OrderStatus.NOT_ARRIVED_DXB) for c in new_codes), "import", now)
+
+    # آخرین status هر سفارش در این chunk برنده است
+    statuses: Dict[str, str] = {oc: st for _, oc, _, _, st in chunk if st}
+    by_status: Dict[str, List[str]] = {}
+    for oc, st in statuses.items():
+        by_status.setdefault(st, []).append(oc)
+    old = dict(session.exec(select(Order.code, Order.status).where(Order.code.in_(statuses))).all()) if statuses else {}
+    for st, ocs in by_status.items():
+        session.execute(
+            update(Order).where(Order.code.in_(ocs)).values(status=st, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    record_status_changes(session, ((oc, old[oc], st) for oc, st in statuses.items() if oc in old), "import", now)
+    report.statuses_set += len(statuses)
+
+    # ---------- aliasها ----------
+    wanted: Dict[str, Tuple[int, str, Optional[str]]] = {}
+    for line_no, oc, ac, carrier, _ in chunk:
+        if not ac:
+            continue
+        prev = wanted.get(ac)
+        if prev is not None and prev[1] != oc:
+            report.conflict(line_no, ac, oc, prev[1])
+            continue
+        wanted.setdefault(ac, (line_no, oc, carrier))
+
+    current = dict(session.exec(
+        select(OrderAlias.alias_code, OrderAlias.order_code).where(OrderAlias.alias_code.in_(wanted))
+    ).all()) if wanted else {}
+    new_aliases = []
+    for ac, (line_no, oc, carrier) in wanted.items():
+        if ac not in current:
+            new_aliases.append({"order_code": oc, "alias_code": ac, "carrier": carrier, "created_at": now})
+        elif current[ac] == oc:
+            report.aliases_existing += 1
+        else:
+            report.conflict(line_no, ac, oc, current[ac])
+    inserted = _insert_ignore(session, OrderAlias, new_aliases, "alias_code")
+    raced = [a for a in new_aliases if a["alias_code"] not in inserted]
+    if raced:
+        # هم‌زمان درج شده: مثل alias موجود (همان سفارش) یا conflict
+        current = dict(session.exec(
+            select(OrderAlias.alias_code, OrderAlias.order_code)
+            .where(OrderAlias.alias_code.in_([a["alias_code"] for a in raced]))
+        ).all())
+        for a in raced:
+            if current.get(a["alias_code"]) == a["order_code"]:
+                report.aliases_existing += 1
+            else:
+                report.conflict(wanted[a["alias_code"]][0], a["alias_code"], a["order_code"],
+                                current.get(a["alias_code"], ""))
+        new_aliases = [a for a in new_aliases if a["alias_code"] in inserted]
+    report.aliases_created += len(new_aliases)
+
+    # عکس‌های صف بررسی که یکی از کدهای جدید را خوانده بودند
+    report.reviews_resolved += len(resolve_pending_reviews(
+        session, {**{c: c for c in new_codes}, **{a["alias_code"]: a["order_code"] for a in new_aliases}}
+    ))
+
+    session.commit()
+    # INSERT/UPDATE مستقیم از رویدادهای ORM رد نمی‌شود
+    order_cache.invalidate_orders(new_codes | statuses.keys())
+    for a in new_aliases:
+        order_cache.invalidate_key(a["alias_code"])
+    for st, ocs in by_status.items():
+        live_hub.publish_statuses(ocs, st)
+
+
+def import_manifest(fileobj: IO, fmt: str, chunk_size: Optional[int] = None) -> dict:
+    """
+    fileobj: فایل باینری یا متنی. fmt: "csv" یا "jsonl".
+    """
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("format must be csv or jsonl")
+    text = fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    report = ImportReport(settings.IMPORT_MAX_REPORTED)
+    size = max(1, chunk_size or settings.IMPORT_CHUNK_SIZE)
+    with Session(engine) as session:
+        for chunk in _chunks(iter_rows(text, fmt, report.errors), size):
+            report.rows += len(chunk)
+            _import_chunk(session, chunk, report)
+    return report.as_dict()
+
+
+def guess_format(filename: Optional[str]) -> str:
+    name = (filename or "").lower()
+    return "jsonl" if name.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.bulk_import", description="Import orders/aliases from CSV or JSONL")
+    parser.add_argument("path", help="manifest file ('-' for stdin)")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--chunk-size", type=int)
+    args = parser.parse_args(argv)
+
+    init_db()
+    ensure_status_counts(engine)
+    fmt = args.format or guess_format(args.path)
+    if args.path == "-":
+        report = import_manifest(sys.stdin.buffer, fmt, args.chunk_size)
+    else:
+        with open(args.path, "rb") as f:
+            report = import_manifest(f, fmt, args.chunk_size)
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
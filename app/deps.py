@@ -1,16 +1,95 @@
 from pathlib import Path
-from typing import Dict, Any
+from typing import List
 
 from pydantic_settings import BaseSettings
+from sqlalchemy import event, inspect
 from sqlmodel import SQLModel, Session, create_engine
 
 
 class Settings(BaseSettings):
     # قابل تنظیم با Env یا .env
     DATABASE_URL: str = "sqlite:///./app.db"
+    DATABASE_READ_URL: str = ""             # اختیاری: replica فقط‌خواندنی (برای غیر SQLite)
+    DB_READ_POOL_SIZE: int = 8              # اتصال‌های pool خواننده
+
+    # پروفایل SQLite (روی هر اتصال)
+    SQLITE_WAL: bool = True                 # journal_mode=WAL + synchronous=NORMAL
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000      # انتظار برای قفل به‌جای "database is locked"
+    SQLITE_CACHE_SIZE_KB: int = 65536       # cache_size هر اتصال
+    SQLITE_MMAP_BYTES: int = 268435456      # mmap_size (256MB)
     UPLOAD_DIR: str = "./app/static/uploads"
     BASE_URL: str = ""  # اختیاری
 
+    # کش نتیجه‌ی OCR (کلید: هش محتوای عکس)
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_LRU_SIZE: int = 1024          # اندازه‌ی لایه‌ی حافظه
+    OCR_CACHE_TTL_DAYS: int = 30            # انقضای ردیف‌های جدول
+    OCR_CACHE_MAX_ROWS: int = 100_000       # سقف ردیف‌های جدول
+    OCR_CACHE_PHASH: bool = False           # تطبیق عکس‌های تقریباً تکراری با perceptual hash
+    OCR_CACHE_PHASH_DISTANCE: int = 4       # حداکثر فاصله‌ی همینگ dHash
+    OCR_CACHE_HIT_FLUSH_SECONDS: float = 60.0   # فاصله‌ی نوشتن شمارش hitها در جدول
+
+    # صف OCR پس‌زمینه
+    INGEST_ASYNC_DEFAULT: bool = False      # اگر True، endpointهای ingest بدون درخواست هم job می‌سازند
+    JOB_WORKERS: int = 2                    # تعداد workerهای هم‌زمان صف
+    JOB_LEASE_SECONDS: float = 60.0         # job در حال اجرای worker مرده بعد از این مدت دوباره claim می‌شود
+
+    # مسیر موازی /upload-many/stream
+    UPLOAD_CPU_WORKERS: int = 0             # اندازه‌ی process pool پیش‌پردازش (0 = تعداد هسته‌ها)
+    UPLOAD_VISION_CONCURRENCY: int = 8      # سقف درخواست‌های هم‌زمان Vision
+    UPLOAD_PREP_CHUNK: int = 4              # تعداد variant ساخته‌شده در هر نوبت process pool
+
+    # کش جست‌وجوی سفارش (کد/alias → snapshot سفارش) برای /track و /u/{code}
+    ORDER_CACHE_SIZE: int = 50_000
+    ORDER_CACHE_TTL_SECONDS: float = 15.0          # سقف کهنگی بین workerها
+    ORDER_CACHE_NEGATIVE_TTL_SECONDS: float = 5.0  # برای NOT_FOUND
+
+    # دریافت فایل‌های آپلودی (app/uploads.py)
+    UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024            # سقف هر فایل
+    UPLOAD_MAX_REQUEST_BYTES: int = 200 * 1024 * 1024   # سقف کل بدنه‌ی multipart (حین دریافت شمرده می‌شود)
+    UPLOAD_MAX_PIXELS: int = 50_000_000
+    UPLOAD_ALLOWED_TYPES: List[str] = ["jpeg", "png", "webp"]
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    UPLOAD_IO_WORKERS: int = 4                          # thread pool جدا برای نوشتن/derivative
+
+    # derivativeهای عکس (app/storage.py)
+    IMAGE_WIDTHS: List[int] = [480, 960, 1440]   # عرض‌های WebP/JPEG برای srcset
+    IMAGE_THUMB_SIZE: int = 160
+    IMAGE_WEBP_QUALITY: int = 75
+    IMAGE_JPEG_QUALITY: int = 80
+
+    # کش HTTP پاسخ‌های پیگیری (CDN / reverse proxy)
+    TRACK_MAX_AGE: int = 30                  # ثانیه؛ وضعیت سفارش چند بار در عمرش عوض می‌شود
+    TRACK_NOT_FOUND_MAX_AGE: int = 5
+    TRACK_STALE_WHILE_REVALIDATE: int = 30
+
+    # مانیتورینگ (/metrics)
+    SLOW_REQUEST_SECONDS: float = 0.0       # > 0: لاگ درخواست‌های کندتر با ریز زمان مراحل
+
+    # POST /track/batch
+    TRACK_BATCH_MAX: int = 500              # سقف کد در هر درخواست
+
+    # ورود گروهی manifest (/admin/import و python -m app.bulk_import)
+    IMPORT_CHUNK_SIZE: int = 1000           # سطر در هر INSERT/commit
+    IMPORT_MAX_REPORTED: int = 1000         # سقف conflict/خطای گزارش‌شده در پاسخ
+
+    # تطبیق فازی کد OCR با کدها/aliasها (app/fuzzy_index.py)
+    FUZZY_MATCH_ENABLED: bool = True
+    FUZZY_MAX_DISTANCE: int = 0             # اعمال خودکار؛ 0: فقط O/0، I/1، S/5، ... (۱ به کدهای همسایه می‌چسبد)
+    FUZZY_CANDIDATE_DISTANCE: int = 1       # تطبیق‌های تا این فاصله فقط candidates صف بررسی
+    FUZZY_MIN_LENGTH: int = 8               # کدهای کوتاه‌تر فازی تطبیق داده نمی‌شوند
+    FUZZY_REFRESH_SECONDS: float = 2.0      # حداقل فاصله‌ی خواندن ردیف‌های جدید
+
+    # پیگیری زنده (/track/stream و /track/ws، app/live.py)
+    LIVE_ENABLED: bool = True
+    LIVE_POLL_SECONDS: float = 2.0          # کشف تغییرات workerهای دیگر (0 = فقط همین پروسه)
+    LIVE_KEEPALIVE_SECONDS: float = 20.0
+    LIVE_MAX_SUBSCRIBERS: int = 10_000      # در هر worker
+
+    # نقش worker
+    TRACKING_ONLY: bool = False             # فقط صفحات/API عمومی خواندنی (بدون OCR/آپلود/ادمین)
+    OCR_EAGER_LOAD: bool = False            # True: OpenCV/Vision در startup لود شود، نه اولین ingest
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -18,19 +97,92 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-# تنظیمات مخصوص SQLite برای عدم خطای Thread
-connect_args: Dict[str, Any] = {}
-if settings.DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
 
-engine = create_engine(settings.DATABASE_URL, echo=False, connect_args=connect_args)
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)
+
+
+def _sqlite_pragmas(read_only: bool):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if settings.SQLITE_WAL and not read_only:
+            # WAL: خواننده‌ها نویسنده را بلاک نمی‌کنند (ماندگار روی فایل دیتابیس)
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cur.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+        cur.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_BYTES)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+    return on_connect
+
+
+def _make_engine(url: str, read_only: bool = False, **kw):
+    if not _is_sqlite(url):
+        return create_engine(url, echo=False, **kw)
+    # تنظیمات مخصوص SQLite برای عدم خطای Thread
+    eng = create_engine(url, echo=False, connect_args={"check_same_thread": False}, **kw)
+    if not _is_sqlite_memory(url):
+        event.listen(eng, "connect", _sqlite_pragmas(read_only))
+    return eng
+
+
+# نویسنده: همه‌ی تغییرات (و Session(engine)های jobها/کش)
+engine = _make_engine(settings.DATABASE_URL)
+
+# خواننده: pool جدا برای endpointهای فقط‌خواندنی (SQLite: اتصال query_only روی همان فایل،
+# Postgres و ...: DATABASE_READ_URL برای replica). SQLite درون‌حافظه‌ای همان engine است.
+if settings.DATABASE_READ_URL:
+    read_engine = _make_engine(settings.DATABASE_READ_URL, read_only=True, pool_size=settings.DB_READ_POOL_SIZE)
+elif _is_sqlite(settings.DATABASE_URL) and not _is_sqlite_memory(settings.DATABASE_URL):
+    read_engine = _make_engine(settings.DATABASE_URL, read_only=True, pool_size=settings.DB_READ_POOL_SIZE)
+else:
+    read_engine = engine
 
 
 def init_db():
     SQLModel.metadata.create_all(engine)
+    # create_all روی جدول موجود ستون و ایندکس جدید نمی‌سازد (ستون‌های nullable با ALTER اضافه می‌شوند)
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in existing and col.nullable:
+                    conn.exec_driver_sql(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(engine.dialect)}'
+                    )
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
     Path(settings.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
 
 
+def begin_write(session: Session) -> None:
+    """
+    قفل نوشتن را قبل از خواندن ردیف‌هایی که قرار است تغییر کنند می‌گیرد (read-then-write اتمیک).
+    SQLite: FOR UPDATE نادیده گرفته می‌شود و pysqlite تراکنش را فقط قبل از اولین DML باز می‌کند،
+    پس اگر تراکنش نوشتن هنوز باز نیست BEGIN IMMEDIATE (با busy_timeout منتظر نویسنده‌ی دیگر).
+    بقیه‌ی دیتابیس‌ها: کاری نمی‌کند (SELECT ... FOR UPDATE کافی است).
+    """
+    conn = session.connection()
+    if conn.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+def get_read_session():
+    """
+    برای endpointهای فقط‌خواندنی (/track، /u/{code}، ...)؛ نوشتن در آن خطا می‌دهد.
+    """
+    with Session(read_engine) as session:
+        yield session
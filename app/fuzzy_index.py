@@ -0,0 +1,210 @@
+# app/fuzzy_index.py
+"""
+ایندکس فازی کدها و aliasها برای خطاهای رایج OCR (O/0، I/1، S/5، رقم جاافتاده یا اضافه).
+
+- کلید: کد نرمال‌شده با جدول اشتباه‌های OCR (CONFUSIONS)؛ مقدار: کد سفارش
+- جست‌وجو: اول خود کلید نرمال‌شده، بعد همه‌ی رشته‌های با فاصله‌ی ویرایشی ۱ (جایگزینی،
+  حذف، درج، جابه‌جایی دو حرف مجاور) که از خود کد ساخته و در dict چک می‌شوند؛ بدون
+  پیمایش جدول‌ها و مستقل از تعداد کدها. فاصله‌ی ۲ همین را دو مرحله‌ای انجام می‌دهد (کندتر)
+- اعمال خودکار فقط تا FUZZY_MAX_DISTANCE (پیش‌فرض 0: فقط O/0، I/1، S/5، ...) و فقط تطبیق یکتا؛
+  کدهای حامل پشت‌سرهم‌اند (…123 و …124) و فاصله‌ی ۱ معمولاً سفارش مشتری دیگری است. تطبیق‌های
+  دورتر تا FUZZY_CANDIDATE_DISTANCE فقط به‌عنوان candidates به صف بررسی می‌روند
+- بارگذاری در startup در thread پس‌زمینه؛ ردیف‌های جدید (id بزرگ‌تر از آخرین id خوانده‌شده)
+  حداکثر هر FUZZY_REFRESH_SECONDS اضافه می‌شوند، پس نوشتن‌های Core، import و workerهای دیگر هم دیده می‌شوند
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from .deps import settings
+from .metrics import fuzzy_lookups
+from .models import Order, OrderAlias
+
+log = logging.getLogger(__name__)
+
+# حرف → رقمی که OCR معمولاً با آن اشتباه می‌گیرد (هر دو طرف نرمال می‌شوند)
+CONFUSIONS = {"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2", "G": "6"}
+_TABLE = str.maketrans(CONFUSIONS)
+ALPHABET = "".join(c for c in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ" if c not in CONFUSIONS)
+
+LOAD_CHUNK = 50_000
+
+
+def normalize(code: str) -> str:
+    return "".join(c for c in (code or "").upper() if c.isalnum()).translate(_TABLE)
+
+
+def edits1(key: str) -> Set[str]:
+    splits = [(key[:i], key[i:]) for i in range(len(key) + 1)]
+    out = {a + b[1:] for a, b in splits if b}
+    out |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    out |= {a + c + b[1:] for a, b in splits if b for c in ALPHABET if c != b[0]}
+    out |= {a + c + b for a, b in splits for c in ALPHABET}
+    out.discard(key)
+    return out
+
+
+@dataclass
+class FuzzyMatch:
+    order_code: Optional[str]          # None: مبهم
+    distance: int                      # 0 = فقط نرمال‌سازی حروف
+    candidates: List[str] = field(default_factory=list)
+
+    @property
+    def unique(self) -> bool:
+        return self.order_code is not None
+
+    @property
+    def auto_apply(self) -> bool:
+        """
+        یکتا و در فاصله‌ی مجاز اعمال خودکار (FUZZY_MAX_DISTANCE)؛ بقیه فقط پیشنهاد بررسی‌اند.
+        """
+        return self.unique and self.distance <= settings.FUZZY_MAX_DISTANCE
+
+
+class FuzzyCodeIndex:
+    def __init__(self):
+        # کلید نرمال‌شده → کد سفارش، یا tuple چند سفارش اگر دو کد مختلف یک کلید شوند
+        self._keys: Dict[str, Union[str, Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_order_id = 0
+        self._last_alias_id = 0
+        self._refreshed_at = 0.0
+        self.ready = threading.Event()
+        self.load_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, code: str, order_code: str) -> None:
+        key = normalize(code)
+        if not key:
+            return
+        with self._lock:
+            cur = self._keys.get(key)
+            if cur is None:
+                self._keys[key] = order_code
+            elif isinstance(cur, str):
+                if cur != order_code:
+                    self._keys[key] = (cur, order_code)
+            elif order_code not in cur:
+                self._keys[key] = cur + (order_code,)
+
+    def refresh(self, engine: Engine, blocking: bool = True) -> int:
+        """
+        ردیف‌های Order/OrderAlias با id جدیدتر از آخرین بارگذاری را اضافه می‌کند.
+        blocking=False: اگر thread دیگری در حال refresh است، بدون انتظار 0 برمی‌گرداند.
+        """
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            n = 0
+            with engine.connect() as conn:
+                for table, cols, attr in (
+                    (Order, (Order.id, Order.code, Order.code.label("order_code")), "_last_order_id"),
+                    (OrderAlias, (OrderAlias.id, OrderAlias.alias_code, OrderAlias.order_code), "_last_alias_id"),
+                ):
+                    while True:
+                        rows = conn.execute(
+                            select(*cols).where(table.id > getattr(self, attr)).order_by(table.id).limit(LOAD_CHUNK)
+                        ).all()
+                        for _, code, order_code in rows:
+                            self.add(code, order_code)
+                        if rows:
+                            setattr(self, attr, rows[-1][0])
+                        n += len(rows)
+                        if len(rows) < LOAD_CHUNK:
+                            break
+            self._refreshed_at = time.monotonic()
+            return n
+        finally:
+            self._refresh_lock.release()
+
+    def load(self, engine: Engine) -> None:
+        t0 = time.perf_counter()
+        try:
+            n = self.refresh(engine)
+        except Exception:
+            log.exception("fuzzy index load failed")
+            return
+        self.load_seconds = time.perf_counter() - t0
+        self.ready.set()
+        log.info("fuzzy index: %d codes/aliases, %d keys in %.2fs", n, len(self._keys), self.load_seconds)
+
+    def maybe_refresh(self, engine: Engine) -> None:
+        if time.monotonic() - self._refreshed_at < settings.FUZZY_REFRESH_SECONDS:
+            return
+        try:
+            self.refresh(engine, blocking=False)
+        except Exception:
+            log.exception("fuzzy index refresh failed")
+
+    def _orders_at(self, keys: Iterable[str]) -> Set[str]:
+        found: Set[str] = set()
+        for k in keys:
+            v = self._keys.get(k)
+            if v is None:
+                continue
+            if isinstance(v, str):
+                found.add(v)
+            else:
+                found.update(v)
+        return found
+
+    def match(self, code: str, max_distance: Optional[int] = None) -> Optional[FuzzyMatch]:
+        """
+        نزدیک‌ترین سفارش(ها) به code تا max_distance (پیش‌فرض بیشترِ FUZZY_MAX_DISTANCE و
+        FUZZY_CANDIDATE_DISTANCE). None = چیزی در این فاصله نیست.
+        """
+        key = normalize(code)
+        if len(key) < settings.FUZZY_MIN_LENGTH:
+            return None
+        if max_distance is None:
+            max_distance = max(settings.FUZZY_MAX_DISTANCE, settings.FUZZY_CANDIDATE_DISTANCE)
+        level = {key}
+        seen = set(level)
+        for distance in range(max_distance + 1):
+            if distance:
+                level = {e for k in level for e in edits1(k)} - seen
+                seen |= level
+            found = self._orders_at(level)
+            if found:
+                if len(found) == 1:
+                    order_code = next(iter(found))
+                    return FuzzyMatch(order_code=order_code, distance=distance, candidates=[order_code])
+                return FuzzyMatch(order_code=None, distance=distance, candidates=sorted(found)[:10])
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        return {"ready": self.ready.is_set(), "keys": len(self._keys),
+                "load_seconds": round(self.load_seconds, 3)}
+
+
+fuzzy_index = FuzzyCodeIndex()
+
+
+def start_fuzzy_index(engine: Engine) -> None:
+    """
+    بارگذاری اولیه در پس‌زمینه تا startup worker منتظر خواندن همه‌ی جدول‌ها نماند.
+    """
+    if settings.FUZZY_MATCH_ENABLED:
+        threading.Thread(target=fuzzy_index.load, args=(engine,), name="fuzzy-index", daemon=True).start()
+
+
+def fuzzy_resolve(code: str, engine: Engine) -> Optional[FuzzyMatch]:
+    """
+    نقطه‌ی ورود ingest: قبل از آماده شدن ایندکس None برمی‌گرداند (بررسی دستی مثل قبل).
+    """
+    if not settings.FUZZY_MATCH_ENABLED or not fuzzy_index.ready.is_set():
+        fuzzy_lookups.inc(result="disabled" if not settings.FUZZY_MATCH_ENABLED else "not_ready")
+        return None
+    fuzzy_index.maybe_refresh(engine)
+    m = fuzzy_index.match(code)
+    fuzzy_lookups.inc(result="none" if m is None else ("ambiguous" if not m.unique else f"distance_{m.distance}"))
+    return m
@@ -0,0 +1,105 @@
+# app/http_cache.py
+"""
+کش HTTP برای مسیرهای پیگیری (/track و /u/{code}) و عکس‌های آپلودی.
+
+- ETag قوی از (کد جست‌وجو، کد سفارش، وضعیت، عکس، updated_at) + نوع نمایش و نسخه‌ی آن
+  (template و تنظیماتی که خروجی صفحه را عوض می‌کنند)
+- Last-Modified از updated_at
+- If-None-Match / If-Modified-Since → 304 بدون ساخت پاسخ یا رندر template
+- عکس‌های آپلودی (و derivativeهایشان) با هش محتوا نام‌گذاری می‌شوند (app/storage.py) و
+  محتوای هر URL هرگز عوض نمی‌شود → immutable
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+from .deps import settings
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _template_version(name: str) -> str:
+    # تغییر template در deploy جدید باید ETag صفحه را هم عوض کند (در همه‌ی workerها یکسان)
+    try:
+        st = os.stat(os.path.join("app/templates", name))
+    except OSError:
+        return ""
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def _page_version() -> str:
+    # تنظیماتی که HTML صفحه را عوض می‌کنند (اسکریپت زنده، srcset) هم جزو نسخه‌اند
+    live = "live" if settings.LIVE_ENABLED else "static"
+    widths = ",".join(str(w) for w in sorted(set(settings.IMAGE_WIDTHS)))
+    return f"{_template_version('track.html')}|{live}|{widths}"
+
+
+_VERSIONS = {"page": _page_version(), "json": "1"}
+
+
+def make_etag(kind: str, code: str, order) -> str:
+    parts = [kind, _VERSIONS.get(kind, ""), code]
+    if order is not None:
+        parts += [order.code, order.status, order.image_path or "", order.updated_at.isoformat()]
+    return '"' + hashlib.sha1("|".join(parts).encode()).hexdigest()[:32] + '"'
+
+
+def _http_date(dt: datetime) -> str:
+    # updated_at به‌صورت UTC بدون tz ذخیره می‌شود
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def validators(kind: str, code: str, order) -> Dict[str, str]:
+    """
+    هدرهای ETag / Last-Modified / Cache-Control برای پاسخ پیگیری.
+    """
+    max_age = settings.TRACK_MAX_AGE if order is not None else settings.TRACK_NOT_FOUND_MAX_AGE
+    headers = {
+        "ETag": make_etag(kind, code, order),
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={settings.TRACK_STALE_WHILE_REVALIDATE}",
+    }
+    if order is not None:
+        headers["Last-Modified"] = _http_date(order.updated_at)
+    return headers
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # مقایسه‌ی ضعیف طبق RFC 9110 برای If-None-Match
+    tags = [t.strip() for t in header.split(",")]
+    return any(t.removeprefix("W/") == etag for t in tags)
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, headers["ETag"])
+    ims = request.headers.get("if-modified-since")
+    lm = headers.get("Last-Modified")
+    if ims and lm:
+        try:
+            return parsedate_to_datetime(lm) <= parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles با Cache-Control طولانی؛ فقط برای مسیرهایی که محتوای هر URL ثابت است.
+    """
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
@@ -0,0 +1,108 @@
+# app/ingest.py
+"""
+منطق مشترک ورود عکس: تعیین کد (hinted -> نام فایل -> OCR)
+و اعمال روی سفارش (ذخیره‌ی فایل در app/uploads.py). هم endpointها و هم صف کارهای پس‌زمینه از آن استفاده می‌کنند.
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import re
+
+from sqlmodel import Session, select
+
+from .deps import read_engine
+from .fuzzy_index import fuzzy_resolve
+from .metrics import record_ingest, stage
+from .ocr_cache import detect_code_cached
+from .ocr_result import OcrResult
+from .models import Order
+from .orders import coerce_status, resolve_order_by_any_code
+from .review import enqueue_review
+from .status_log import status_source
+
+CODE_NOT_FOUND = "CODE_NOT_FOUND"
+OCR_UNAVAILABLE = "OCR_UNAVAILABLE"     # Vision خطا/timeout/سهمیه داشت؛ عکس کامل بررسی نشد
+ALIAS_NOT_MAPPED = "ALIAS_NOT_MAPPED"
+
+
+# حدس کد از نام فایل (فقط JTE/AJA یا عدد 10..16 رقمی)
+CODE_REGEXES = [
+    re.compile(r"^([A-Za-z0-9\-]{6,})"),
+    re.compile(r"^([A-Za-z0-9\-]+)__"),
+    re.compile(r"\b(JTE[A-Za-z0-9]{6,}|AJA[A-Za-z0-9]{6,})\b", re.I),
+    re.compile(r"\b\d{10,16}\b"),
+]
+def guess_code_from_filename(filename: str) -> Optional[str]:
+    name = Path(filename).stem
+    for rx in CODE_REGEXES:
+        m = rx.search(name)
+        if m:
+            return m.group(1).upper()
+    return None
+
+
+def determine_code(filename: str, dest: str, hinted_code: Optional[str] = None,
+                   content_hash: Optional[str] = None) -> OcrResult:
+    """
+    تعیین کد: hinted -> filename -> OCR
+    engine نتیجه منبع کد را نشان می‌دهد (hint / filename / cache / tesseract / vision).
+    content_hash (حساب‌شده حین آپلود) کلید کش OCR است.
+    """
+    hinted = (hinted_code or "").strip().upper()
+    if hinted:
+        return OcrResult(code=hinted, engine="hint")
+    guessed = guess_code_from_filename(filename or "")
+    if guessed:
+        return OcrResult(code=guessed, engine="filename")
+    with stage("ocr"):
+        return detect_code_cached(dest, content_hash)
+
+
+def apply_code(session: Session, code: Optional[str], rel_path: str, status: Optional[str],
+               engine: Optional[str] = None, filename: Optional[str] = None,
+               ocr_error: Optional[str] = None) -> dict:
+    """
+    سفارش را (مستقیم یا از طریق نگاشت) پیدا و عکس/وضعیت را روی آن ست می‌کند.
+    commit با صدا زننده است. خروجی در صورت شکست شامل reason و review_id (صف بررسی) است.
+    ocr_error (OcrResult.error): بدون کد، reason به‌جای CODE_NOT_FOUND می‌شود OCR_UNAVAILABLE.
+    """
+    if not code and ocr_error:
+        r = {"ok": False, "needs_review": True, "image": rel_path, "reason": OCR_UNAVAILABLE, "ocr_error": ocr_error}
+    else:
+        r = _apply_code(session, code, rel_path, status)
+    if engine:
+        r["engine"] = engine
+    if r.get("needs_review"):
+        r["review_id"] = enqueue_review(session, r, filename, status).id
+    record_ingest(r)
+    return r
+
+
+def _apply_code(session: Session, code: Optional[str], rel_path: str, status: Optional[str]) -> dict:
+    if not code:
+        return {"ok": False, "needs_review": True, "image": rel_path, "reason": CODE_NOT_FOUND}
+
+    o = resolve_order_by_any_code(code, session)
+    fuzzy = None
+    if not o:
+        # خطای OCR (O/0، I/1): فقط تطبیق یکتا در فاصله‌ی FUZZY_MAX_DISTANCE خودکار اعمال می‌شود؛
+        # نزدیک‌ترها (رقم جاافتاده/متفاوت، احتمالاً سفارش همسایه) فقط candidates صف بررسی‌اند
+        with stage("fuzzy_match"):
+            fuzzy = fuzzy_resolve(code, read_engine)
+        if fuzzy is not None and fuzzy.auto_apply:
+            o = session.exec(select(Order).where(Order.code == fuzzy.order_code)).first()
+    if not o:
+        r = {"ok": False, "needs_review": True, "image": rel_path, "detected_code": code, "reason": ALIAS_NOT_MAPPED}
+        if fuzzy is not None and fuzzy.candidates:
+            r["candidates"] = fuzzy.candidates
+        return r
+
+    status_source(session, "ingest")
+    o.image_path = rel_path
+    o.status = coerce_status(status)
+    o.updated_at = datetime.utcnow()
+    session.add(o)
+    r = {"ok": True, "code": o.code, "status": o.status, "image": rel_path}
+    if fuzzy is not None:
+        r.update(detected_code=code, fuzzy_distance=fuzzy.distance)
+    return r
@@ -0,0 +1,210 @@
+# app/jobs.py
+"""
+صف OCR پس‌زمینه: فایل‌ها ذخیره و job در دیتابیس ثبت می‌شود، endpoint فوراً
+شناسه‌ی job را برمی‌گرداند و worker pool داخل پروسه آیتم‌ها را پردازش می‌کند.
+
+چند worker (پروسه) روی یک دیتابیس: هر job قبل از اجرا با یک UPDATE شرطی claim می‌شود
+(QUEUED، یا RUNNING با heartbeat کهنه‌تر از JOB_LEASE_SECONDS) و فقط برنده اجرایش می‌کند.
+sweeper هر پروسه lease jobهای خودش را تمدید و jobهای بی‌صاحب (از جمله jobهای ناتمام
+اجرای قبلی) را claim می‌کند؛ worker که lease را از دست داده با اولین commit متوقف می‌شود.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+
+from .deps import engine, settings
+from .ingest import apply_code, determine_code
+from .models import JobState, OcrJob, OcrJobItem
+
+log = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_sweeper_stop = threading.Event()
+_submitted: Set[str] = set()            # jobهای صف‌شده در همین پروسه (برای submit نکردن دوباره)
+_submitted_lock = threading.Lock()
+
+# شناسه‌ی این پروسه به‌عنوان صاحب lease
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# هر فایل: (نام اصلی، مسیر روی دیسک، مسیر عمومی، کد hinted، هش محتوا)
+JobFile = Tuple[str, str, str, Optional[str], Optional[str]]
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix="ocr-job")
+    return _executor
+
+
+def create_job(session: Session, kind: str, files: List[JobFile], status: Optional[str]) -> OcrJob:
+    job = OcrJob(id=uuid.uuid4().hex, kind=kind, status=status, total=len(files))
+    session.add(job)
+    for filename, dest, image, hinted, content_hash in files:
+        session.add(OcrJobItem(job_id=job.id, filename=filename, dest=dest, image=image,
+                               hinted_code=hinted, content_hash=content_hash))
+    session.commit(); session.refresh(job)
+    _submit(job.id)
+    return job
+
+
+def _submit(job_id: str) -> None:
+    with _submitted_lock:
+        if job_id in _submitted:
+            return
+        _submitted.add(job_id)
+    _pool().submit(_run_job, job_id)
+
+
+def _lease_expired() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+
+def _claimable():
+    return or_(
+        OcrJob.state == JobState.QUEUED,
+        and_(OcrJob.state == JobState.RUNNING,
+             or_(OcrJob.heartbeat_at.is_(None), OcrJob.heartbeat_at < _lease_expired())),
+    )
+
+
+def _claim(session: Session, job_id: str) -> bool:
+    """
+    UPDATE شرطی اتمیک: فقط یک پروسه job را از QUEUED (یا RUNNING با lease منقضی) برمی‌دارد.
+    """
+    res = session.execute(
+        update(OcrJob).where(OcrJob.id == job_id, _claimable())
+        .values(state=JobState.RUNNING, owner=_OWNER, heartbeat_at=datetime.utcnow())
+    )
+    session.commit()
+    return res.rowcount == 1
+
+
+def _still_owner(session: Session, job_id: str) -> bool:
+    """
+    heartbeat داخل تراکنش آیتم: اگر پروسه‌ی دیگری job را گرفته، rowcount صفر است.
+    """
+    res = session.execute(
+        update(OcrJob).where(OcrJob.id == job_id, OcrJob.owner == _OWNER)
+        .values(heartbeat_at=datetime.utcnow())
+    )
+    return res.rowcount == 1
+
+
+def _run_job(job_id: str) -> None:
+    try:
+        with Session(engine) as session:
+            if not _claim(session, job_id):
+                return
+            job = session.get(OcrJob, job_id)
+
+            items = session.exec(
+                select(OcrJobItem)
+                .where(OcrJobItem.job_id == job_id, OcrJobItem.state != JobState.DONE)
+                .order_by(OcrJobItem.id)
+            ).all()
+            for item in items:
+                try:
+                    ocr = determine_code(item.filename, item.dest, item.hinted_code, item.content_hash)
+                    result = apply_code(session, ocr.code, item.image, job.status, ocr.engine, item.filename, ocr.error)
+                except Exception as e:
+                    session.rollback()
+                    result = {"ok": False, "error": str(e)}
+                item.result = json.dumps(result, ensure_ascii=False)
+                item.state = JobState.DONE
+                item.updated_at = datetime.utcnow()
+                job.done += 1
+                session.add(item); session.add(job)
+                if not _still_owner(session, job_id):
+                    # lease منقضی شد و پروسه‌ی دیگری ادامه می‌دهد
+                    session.rollback()
+                    log.warning("OCR job %s lost its lease", job_id)
+                    return
+                # هر آیتم جدا commit می‌شود تا پیشرفت دیده شود و بعد از ری‌استارت تکرار نشود
+                session.commit()
+
+            job.state = JobState.DONE
+            job.finished_at = datetime.utcnow()
+            session.add(job)
+            if _still_owner(session, job_id):
+                session.commit()
+    except Exception:
+        log.exception("OCR job %s failed", job_id)
+    finally:
+        with _submitted_lock:
+            _submitted.discard(job_id)
+
+
+def resume_pending_jobs() -> int:
+    """
+    lease jobهای در حال اجرای همین پروسه تمدید و jobهای بی‌صاحب (QUEUED یا RUNNING با lease
+    منقضی، مثلاً ناتمام از اجرای قبلی) صف می‌شوند؛ claim واقعی در _run_job است.
+    """
+    with Session(engine) as session:
+        session.execute(
+            update(OcrJob).where(OcrJob.owner == _OWNER, OcrJob.state == JobState.RUNNING)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        session.commit()
+        ids = session.exec(select(OcrJob.id).where(_claimable())).all()
+    for job_id in ids:
+        _submit(job_id)
+    return len(ids)
+
+
+def start_jobs() -> None:
+    """
+    در startup: sweeper پس‌زمینه که هر JOB_LEASE_SECONDS/3 ثانیه resume_pending_jobs را اجرا می‌کند.
+    """
+    def sweep():
+        while True:
+            try:
+                resume_pending_jobs()
+            except Exception:
+                log.exception("OCR job sweep failed")
+            if _sweeper_stop.wait(max(1.0, settings.JOB_LEASE_SECONDS / 3)):
+                return
+
+    _sweeper_stop.clear()
+    threading.Thread(target=sweep, name="ocr-job-sweeper", daemon=True).start()
+
+
+def shutdown_jobs() -> None:
+    global _executor
+    _sweeper_stop.set()
+    if _executor is not None:
+        # آیتم‌های باقی‌مانده در دیتابیس QUEUED می‌مانند و در startup بعدی ادامه می‌یابند
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def job_status(session: Session, job_id: str) -> Optional[dict]:
+    job = session.get(OcrJob, job_id)
+    if job is None:
+        return None
+    items = session.exec(
+        select(OcrJobItem).where(OcrJobItem.job_id == job_id).order_by(OcrJobItem.id)
+    ).all()
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "state": job.state,
+        "total": job.total,
+        "done": job.done,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "items": [
+            {"file": it.filename, "image": it.image, "state": it.state,
+             "result": json.loads(it.result) if it.result else None}
+            for it in items
+        ],
+    }
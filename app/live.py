@@ -0,0 +1,221 @@
+# app/live.py
+"""
+ارسال زنده‌ی تغییر وضعیت سفارش به مشتری‌ها (SSE در /track/stream و WebSocket در /track/ws).
+
+- pub/sub داخل پروسه: هر اتصال یک asyncio.Queue زیر کد سفارش (alias هنگام subscribe
+  به کد سفارش تبدیل می‌شود)؛ اتصال بیکار فقط یک coroutine منتظر است، بدون درخواست و کوئری
+- منبع رویدادها: هر commit ORM که Order را تغییر دهد (set-status، ingest، manual-attach،
+  صف بررسی) خودکار منتشر می‌شود؛ UPDATEهای Core (bulk-update-status، import) خودشان publish_statuses را صدا می‌زنند
+- بین workerها (و workerهای TRACKING_ONLY): اگر مشترکی باشد، هر LIVE_POLL_SECONDS یک کوئری
+  IN روی کدهای مشترک‌شده‌ی همین worker تغییرات بقیه را پیدا می‌کند
+- فقط تغییر واقعی (status یا عکس) ارسال می‌شود؛ صف هر اتصال کوچک است و رویداد قدیمی دور ریخته می‌شود
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session as OrmSession
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from .deps import read_engine, settings
+from .models import Order
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 8
+POLL_CHUNK = 500
+
+
+def _event(code: str, status: str, image: Optional[str], updated_at) -> dict:
+    if isinstance(updated_at, datetime):
+        updated_at = updated_at.isoformat()
+    return {"code": code, "status": status, "image": image, "updated_at": updated_at}
+
+
+class LiveHub:
+    def __init__(self):
+        # کد سفارش → صف اتصال‌های مشترک
+        self._subs: Dict[str, Set[asyncio.Queue]] = {}
+        # کد سفارش → (status، image) آخرین وضعیت ارسال‌شده
+        self._last: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._poller: Optional[asyncio.Task] = None
+        self.published = 0
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(qs) for qs in self._subs.values())
+
+    def subscribe(self, snapshot) -> asyncio.Queue:
+        """
+        در event loop صدا زده می‌شود. snapshot: وضعیت فعلی سفارش (OrderSnapshot).
+        """
+        if self.subscribers >= settings.LIVE_MAX_SUBSCRIBERS:
+            raise OverflowError("too many live subscribers")
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subs.setdefault(snapshot.code, set()).add(q)
+        self._last.setdefault(snapshot.code, (snapshot.status, snapshot.image_path))
+        if settings.LIVE_POLL_SECONDS > 0 and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.create_task(self._poll_loop())
+        return q
+
+    def unsubscribe(self, code: str, q: asyncio.Queue) -> None:
+        qs = self._subs.get(code)
+        if qs is None:
+            return
+        qs.discard(q)
+        if not qs:
+            del self._subs[code]
+            self._last.pop(code, None)
+
+    # ---------- انتشار (از هر thread) ----------
+    def publish(self, events: Iterable[dict]) -> None:
+        if not self._subs or self._loop is None:
+            return
+        events = [e for e in events if e["code"] in self._subs]
+        if events:
+            try:
+                self._loop.call_soon_threadsafe(self._dispatch, events)
+            except RuntimeError:    # loop بسته شده (shutdown)
+                pass
+
+    def publish_statuses(self, codes: Iterable[str], status: str) -> None:
+        """
+        برای UPDATEهای Core که فقط status را عوض می‌کنند (عکس همان قبلی می‌ماند).
+        """
+        if not self._subs:
+            return
+        now = datetime.utcnow()
+        self.publish(_event(c, status, None, now) for c in codes if c in self._subs)
+
+    def _dispatch(self, events: List[dict]) -> None:
+        for e in events:
+            code = e["code"]
+            qs = self._subs.get(code)
+            if not qs:
+                continue
+            prev = self._last.get(code)
+            if e["image"] is None and prev is not None:
+                e = {**e, "image": prev[1]}
+            state = (e["status"], e["image"])
+            if state == prev:
+                continue
+            self._last[code] = state
+            self.published += 1
+            for q in qs:
+                if q.full():
+                    q.get_nowait()      # مشتری کند: فقط آخرین وضعیت مهم است
+                q.put_nowait(e)
+
+    # ---------- تغییرات workerهای دیگر ----------
+    async def _poll_loop(self) -> None:
+        while self._subs:
+            await asyncio.sleep(settings.LIVE_POLL_SECONDS)
+            codes = list(self._subs)
+            try:
+                events = await run_in_threadpool(_load_states, codes)
+            except Exception:
+                log.exception("live poll failed")
+                continue
+            self._dispatch(events)
+
+    def stats(self) -> Dict[str, object]:
+        return {"orders": len(self._subs), "subscribers": self.subscribers, "published": self.published}
+
+
+def _load_states(codes: List[str]) -> List[dict]:
+    out = []
+    with read_engine.connect() as conn:
+        for start in range(0, len(codes), POLL_CHUNK):
+            rows = conn.execute(
+                select(Order.code, Order.status, Order.image_path, Order.updated_at)
+                .where(Order.code.in_(codes[start:start + POLL_CHUNK]))
+            )
+            out += [_event(*r) for r in rows]
+    return out
+
+
+live_hub = LiveHub()
+
+
+# ---------- قالب پیام‌ها ----------
+def sse_message(data: dict, event_name: str = "status") -> str:
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(snapshot, is_disconnected):
+    """
+    وضعیت فعلی، بعد هر تغییر؛ هر LIVE_KEEPALIVE_SECONDS یک comment تا proxy اتصال را نبندد.
+    """
+    q = live_hub.subscribe(snapshot)
+    try:
+        yield "retry: 5000\n" + sse_message(_event(snapshot.code, snapshot.status, snapshot.image_path, snapshot.updated_at))
+        while True:
+            try:
+                e = await asyncio.wait_for(q.get(), settings.LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": ping\n\n"
+                continue
+            yield sse_message(e)
+    finally:
+        live_hub.unsubscribe(snapshot.code, q)
+
+
+async def ws_stream(websocket: WebSocket, snapshot) -> None:
+    """
+    همان رویدادهای SSE به‌صورت پیام JSON؛ پیام‌های ورودی کلاینت نادیده گرفته می‌شوند.
+    """
+    q = live_hub.subscribe(snapshot)
+    recv = asyncio.ensure_future(websocket.receive())
+    # get تا گرفتن رویداد زنده می‌ماند (لغو آن بعد از برداشتن از صف رویداد را گم می‌کند)
+    get = asyncio.ensure_future(q.get())
+    try:
+        await websocket.send_json(_event(snapshot.code, snapshot.status, snapshot.image_path, snapshot.updated_at))
+        while True:
+            done, _ = await asyncio.wait({get, recv}, return_when=asyncio.FIRST_COMPLETED)
+            if recv in done:
+                if recv.result()["type"] == "websocket.disconnect":
+                    return
+                recv = asyncio.ensure_future(websocket.receive())
+            if get in done:
+                await websocket.send_json(get.result())
+                get = asyncio.ensure_future(q.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        recv.cancel()
+        get.cancel()
+        live_hub.unsubscribe(snapshot.code, q)
+
+
+# ---------- انتشار خودکار بعد از commit ORM ----------
+_PENDING = "live_pending"
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_orders(session, flush_context):
+    if not live_hub._subs:
+        return
+    pending = session.info.setdefault(_PENDING, {})
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Order) and obj.code in live_hub._subs:
+            pending[obj.code] = _event(obj.code, obj.status, obj.image_path, obj.updated_at)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_committed(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        live_hub.publish(pending.values())
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(_PENDING, None)
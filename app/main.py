@@ -1,62 +1,76 @@
 # app/main.py
-from datetime import datetime, date
-from pathlib import Path
-from typing import List, Optional
-import uuid, shutil, re
+import csv
+from datetime import datetime, date, timezone
+from typing import List, Optional, Union
 
-from fastapi import FastAPI, Depends, Form, HTTPException, Request, UploadFile, File
+from fastapi import APIRouter, FastAPI, Depends, Form, HTTPException, Request, UploadFile, File, WebSocket
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from sqlmodel import select, Session
-
-from .deps import init_db, get_session
-from .models import Order, OrderStatus, OrderAlias
-from .ocr_google import detect_code_from_image  # OCR گوگل (Lazy-init در خود فایل)
+from starlette.concurrency import run_in_threadpool
+
+from .deps import begin_write, engine, init_db, get_read_session, get_session, read_engine, settings
+from .models import Order, OrderStatus, OrderAlias, ReviewItem, ReviewState, StatusEvent
+from .ocr_cache import detect_codes_cached, ocr_cache
+from .orders import (
+    VALID_STATUSES, bulk_set_status, coerce_status, count_in_range, list_orders, resolve_order_by_any_code,
+)
+from .status_log import ensure_status_counts, rebuild_status_counts, status_counts, status_source
+from .order_cache import lookup_order_snapshot, lookup_order_snapshots, order_cache  # کش خواندن؛ بعد از هر commit خودکار invalidate می‌شود
+from .metrics import MetricsMiddleware, render as render_metrics
+from .http_cache import ImmutableStaticFiles, is_not_modified, not_modified_response, validators
+from .storage import image_variants
+from .bulk_import import guess_format, import_manifest
+from .fuzzy_index import fuzzy_index, start_fuzzy_index
+from .live import live_hub, sse_stream, ws_stream
+from .review import attach_review_item, resolve_pending_reviews, review_item_dict
+from .ingest import CODE_NOT_FOUND, OCR_UNAVAILABLE, apply_code, determine_code, guess_code_from_filename
+from .uploads import MaxUploadRequestSize, SavedUpload, UploadError, received_image, received_images, shutdown_upload_io
+from .jobs import create_job, job_status, shutdown_jobs, start_jobs
+from .parallel_ingest import shutdown_cpu_pool, stream_upload_results
 
 app = FastAPI(title="Order Tracker")
+# endpointهای اپراتور/ادمین (آپلود، OCR، ویرایش)؛ در TRACKING_ONLY ثبت نمی‌شوند
+operator_api = APIRouter()
+if not settings.TRACKING_ONLY:
+    app.add_middleware(MaxUploadRequestSize, max_bytes=settings.UPLOAD_MAX_REQUEST_BYTES)
+    app.add_middleware(MetricsMiddleware)   # بیرونی‌ترین: زمان کل هر درخواست (/metrics فقط اینجا)
+# عکس‌های آپلودی با هش محتوا نام‌گذاری می‌شوند (عکس‌های قدیمی: uuid)؛ محتوای هر URL ثابت → کش immutable؛ باید قبل از /static mount شود
+app.mount("/static/uploads", ImmutableStaticFiles(directory="app/static/uploads", check_dir=False), name="uploads")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
-
-
-# ---------- Helpers ----------
-def resolve_order_by_any_code(code: str, session: Session) -> Optional[Order]:
-    """
-    تلاش می‌کند با خودِ کد یا از طریق alias سفارش را بیابد.
-    """
-    code = (code or "").strip().upper()
-    if not code:
-        return None
-    o = session.exec(select(Order).where(Order.code == code)).first()
-    if o:
-        return o
-    al = session.exec(select(OrderAlias).where(OrderAlias.alias_code == code)).first()
-    if al:
-        return session.exec(select(Order).where(Order.code == al.order_code)).first()
-    return None
-
-
-# حدس کد از نام فایل (فقط JTE/AJA یا عدد 10..16 رقمی)
-CODE_REGEXES = [
-    re.compile(r"^([A-Za-z0-9\-]{6,})"),
-    re.compile(r"^([A-Za-z0-9\-]+)__"),
-    re.compile(r"\b(JTE[A-Za-z0-9]{6,}|AJA[A-Za-z0-9]{6,})\b", re.I),
-    re.compile(r"\b\d{10,16}\b"),
-]
-def guess_code_from_filename(filename: str) -> Optional[str]:
-    name = Path(filename).stem
-    for rx in CODE_REGEXES:
-        m = rx.search(name)
-        if m:
-            return m.group(1).upper()
-    return None
+templates.env.globals["image_variants"] = image_variants   # srcset از derivativeهای storage
 
 
 # ---------- Lifecycle ----------
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if settings.TRACKING_ONLY:
+        return
+    # شمارش وضعیت‌ها روی دیتابیس موجود (فقط بار اول یک GROUP BY)
+    ensure_status_counts(engine)
+    if settings.OCR_EAGER_LOAD:
+        # کلاینت Vision یک‌بار در هر worker ساخته و بین درخواست‌ها reuse می‌شود؛
+        # بدون این، OpenCV/Vision با اولین ingest لود می‌شوند
+        from .ocr_google import warm_vision_client
+        warm_vision_client()
+    # ایندکس فازی کدها/aliasها (پس‌زمینه) برای تطبیق خطاهای OCR
+    start_fuzzy_index(read_engine)
+    # jobهای OCR ناتمام از اجرای قبلی یا workerهای مرده (claim با lease)
+    start_jobs()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if settings.TRACKING_ONLY:
+        return
+    shutdown_jobs()
+    shutdown_cpu_pool()
+    shutdown_upload_io()
+    ocr_cache.flush_hits()
 
 
 # ---------- Public pages ----------
@@ -70,24 +84,84 @@ def track_query(code: str):
     return RedirectResponse(url=f"/u/{code}", status_code=302)
 
 @app.get("/u/{code}", response_class=HTMLResponse)
-def track_page(code: str, request: Request, session: Session = Depends(get_session)):
+def track_page(code: str, request: Request, session: Session = Depends(get_read_session)):
     code = (code or "").strip().upper()
-    o = resolve_order_by_any_code(code, session)
-    return templates.TemplateResponse("track.html", {"request": request, "order": o, "code": code})
+    o = lookup_order_snapshot(code, session)
+    headers = validators("page", code, o)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    return templates.TemplateResponse("track.html", {"request": request, "order": o, "code": code,
+                                                     "live": settings.LIVE_ENABLED}, headers=headers)
 
 
 # ---------- Public JSON ----------
-@app.get("/track")
-def track_json(code: str, session: Session = Depends(get_session)):
-    code = (code or "").strip().upper()
-    o = resolve_order_by_any_code(code, session)
+def _track_result(code: str, o) -> dict:
     if not o:
         return {"code": code, "status": "NOT_FOUND", "message": "سفارش با این کد یافت نشد."}
     return {"code": o.code, "status": o.status, "image": o.image_path}
 
+@app.get("/track")
+def track_json(code: str, request: Request, session: Session = Depends(get_read_session)):
+    code = (code or "").strip().upper()
+    o = lookup_order_snapshot(code, session)
+    headers = validators("json", code, o)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    return JSONResponse(_track_result(code, o), headers=headers)
+
+class TrackBatchPayload(BaseModel):
+    codes: List[str]
+
+@app.post("/track/batch")
+def track_batch(payload: TrackBatchPayload, session: Session = Depends(get_read_session)):
+    """
+    چند کد (مستقیم یا alias) در یک درخواست؛ هر نتیجه هم‌شکل /track و به ترتیب ورودی.
+    query ها برای کل batch ثابت است (نه یکی به ازای هر کد).
+    """
+    codes = [(c or "").strip().upper() for c in payload.codes]
+    if len(codes) > settings.TRACK_BATCH_MAX:
+        raise HTTPException(400, f"At most {settings.TRACK_BATCH_MAX} codes per request")
+    snaps = lookup_order_snapshots(codes, session)
+    return {"results": [{"query": c, **_track_result(c, snaps.get(c))} for c in codes]}
+
+
+# ---------- Live status (SSE / WebSocket) ----------
+def _live_snapshot(code: str):
+    if not settings.LIVE_ENABLED:
+        return None
+    # بدون Depends: session نباید در تمام عمر اتصال باز بماند
+    with Session(read_engine) as session:
+        return lookup_order_snapshot((code or "").strip().upper(), session)
+
+@app.get("/track/stream")
+def track_stream(code: str, request: Request):
+    """
+    Server-Sent Events: اول وضعیت فعلی، بعد هر تغییر status/عکس (event: status).
+    code می‌تواند alias باشد؛ رویدادها با کد سفارش می‌آیند.
+    """
+    o = _live_snapshot(code)
+    if not o:
+        raise HTTPException(404, "Order not found")
+    if live_hub.subscribers >= settings.LIVE_MAX_SUBSCRIBERS:
+        raise HTTPException(503, "Too many live subscribers", headers={"Retry-After": "30"})
+    return StreamingResponse(sse_stream(o, request.is_disconnected), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/track/ws")
+async def track_ws(websocket: WebSocket, code: str):
+    o = await run_in_threadpool(_live_snapshot, code)
+    if not o:
+        await websocket.close(code=4404)
+        return
+    if live_hub.subscribers >= settings.LIVE_MAX_SUBSCRIBERS:
+        await websocket.close(code=1013)    # try again later
+        return
+    await websocket.accept()
+    await ws_stream(websocket, o)
+
 
 # ---------- Orders (admin/operator) ----------
-@app.post("/orders")
+@operator_api.post("/orders")
 def create_order(code: str = Form(...), session: Session = Depends(get_session)):
     code = (code or "").strip().upper()
     if not code:
@@ -96,67 +170,138 @@ def create_order(code: str = Form(...), session: Session = Depends(get_session))
     if exists:
         raise HTTPException(400, "Order already exists")
     o = Order(code=code, status=OrderStatus.NOT_ARRIVED_DXB)
-    session.add(o); session.commit(); session.refresh(o)
-    return {"ok": True, "code": o.code, "status": o.status}
+    session.add(o); session.flush()
+    # عکس‌های صف بررسی که همین کد را خوانده بودند
+    resolved = resolve_pending_reviews(session, {code: code})
+    session.commit(); session.refresh(o)
+    return {"ok": True, "code": o.code, "status": o.status, "resolved_reviews": resolved}
 
 class SetStatusPayload(BaseModel):
     new_status: str
 
-@app.post("/orders/{code}/set-status")
+@operator_api.post("/orders/{code}/set-status")
 def set_status(code: str, payload: SetStatusPayload, session: Session = Depends(get_session)):
     code = (code or "").strip().upper()
-    valid = {
-        OrderStatus.NOT_ARRIVED_DXB,
-        OrderStatus.ARRIVED_DXB,
-        OrderStatus.IN_TRANSIT_IR,
-        OrderStatus.ARRIVED_TEH,
-    }
-    if payload.new_status not in valid:
+    if payload.new_status not in VALID_STATUSES:
         raise HTTPException(400, "Invalid status")
     o = resolve_order_by_any_code(code, session)
     if not o:
         raise HTTPException(404, "Order not found")
+    status_source(session, "set_status")
     o.status = payload.new_status
     o.updated_at = datetime.utcnow()
     session.add(o); session.commit()
     return {"ok": True, "code": o.code, "status": o.status}
 
 
+# ---------- Order listing & status history (admin) ----------
+def _utc_naive(dt: Optional[datetime]) -> Optional[datetime]:
+    # زمان‌ها در دیتابیس UTC بدون timezone ذخیره می‌شوند
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+@operator_api.get("/admin/orders")
+def admin_list_orders(
+    status: Optional[str] = None,
+    updated_from: Optional[datetime] = None,    # شامل
+    updated_to: Optional[datetime] = None,      # ناشامل
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    session: Session = Depends(get_read_session),
+):
+    """
+    جدیدترین تغییر اول؛ صفحه‌ی بعد با cursor=next_cursor (keyset روی ایندکس status+updated_at+id، بدون OFFSET).
+    """
+    if status and status not in VALID_STATUSES:
+        raise HTTPException(400, "Invalid status")
+    try:
+        orders, next_cursor = list_orders(session, status, _utc_naive(updated_from), _utc_naive(updated_to),
+                                          max(1, min(limit, 500)), cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    return {
+        "items": [{"code": o.code, "status": o.status, "image": o.image_path,
+                   "created_at": o.created_at, "updated_at": o.updated_at} for o in orders],
+        "next_cursor": next_cursor,
+    }
+
+@operator_api.get("/admin/orders/counts")
+def admin_order_counts(session: Session = Depends(get_read_session)):
+    """
+    از جدول شمارش نگه‌داشته‌شده (StatusCount)، نه COUNT(*) روی سفارش‌ها.
+    """
+    counts = {st: 0 for st in VALID_STATUSES}
+    counts.update(status_counts(session))
+    return {"counts": counts, "total": sum(counts.values())}
+
+@operator_api.post("/admin/orders/counts/rebuild")
+def admin_rebuild_order_counts(session: Session = Depends(get_session)):
+    """
+    شمارش‌ها از نو با GROUP BY روی سفارش‌ها (اصلاح انحراف)؛ اختلاف با مقدار قبلی هم برمی‌گردد.
+    """
+    begin_write(session)        # اختلاف نسبت به همان وضعیتی که جایگزین می‌شود
+    before = status_counts(session)
+    counts = rebuild_status_counts(session)
+    session.commit()
+    drift = {st: counts.get(st, 0) - before.get(st, 0) for st in set(before) | set(counts)
+             if counts.get(st, 0) != before.get(st, 0)}
+    return {"counts": counts, "total": sum(counts.values()), "drift": drift}
+
+@operator_api.get("/admin/orders/{code}/history")
+def admin_order_history(
+    code: str,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    session: Session = Depends(get_read_session),
+):
+    """
+    تغییرات وضعیت سفارش (کد یا alias)، جدیدترین اول؛ صفحه‌ی بعد با before_id=next_before_id.
+    """
+    o = resolve_order_by_any_code(code, session)
+    if not o:
+        raise HTTPException(404, "Order not found")
+    limit = max(1, min(limit, 200))
+    q = select(StatusEvent).where(StatusEvent.order_code == o.code)
+    if before_id:
+        q = q.where(StatusEvent.id < before_id)
+    events = session.exec(q.order_by(StatusEvent.id.desc()).limit(limit + 1)).all()
+    more = len(events) > limit
+    events = events[:limit]
+    return {
+        "code": o.code, "status": o.status,
+        "events": [{"id": e.id, "old_status": e.old_status, "new_status": e.new_status,
+                    "source": e.source, "created_at": e.created_at} for e in events],
+        "next_before_id": events[-1].id if more else None,
+    }
+
+
 # ---------- Manual attach (operator form & API) ----------
-@app.get("/manual", response_class=HTMLResponse)
+@operator_api.get("/manual", response_class=HTMLResponse)
 def manual_form(request: Request):
     return templates.TemplateResponse("manual.html", {"request": request})
 
-@app.post("/manual-attach")
+@operator_api.post("/manual-attach")
 def manual_attach(
     code: str = Form(...),
     status: str = Form(OrderStatus.ARRIVED_DXB),
-    image: UploadFile = File(...),
+    saved: SavedUpload = Depends(received_image),
     session: Session = Depends(get_session)
 ):
     code = (code or "").strip().upper()
-
-    # ذخیره فایل
-    ext = Path(image.filename).suffix.lower() or ".jpg"
-    fname = f"{uuid.uuid4().hex}{ext}"
-    dest = Path("app/static/uploads") / fname
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    with dest.open("wb") as f:
-        shutil.copyfileobj(image.file, f)
-    rel_path = f"/static/uploads/{fname}"
+    rel_path = saved.url
 
     # یافتن/ساخت سفارش
     o = resolve_order_by_any_code(code, session)
     if not o:
         o = Order(code=code)
         session.add(o); session.flush()
+        resolve_pending_reviews(session, {code: code})
 
-    # به‌روزرسانی
+    # به‌روزرسانی (عکس همین درخواست بعد از آیتم‌های صف بررسی)
+    status_source(session, "manual")
     o.image_path = rel_path
-    o.status = status if status in (
-        OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB,
-        OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH
-    ) else OrderStatus.ARRIVED_DXB
+    o.status = coerce_status(status)
     o.updated_at = datetime.utcnow()
     session.add(o); session.commit()
 
@@ -169,7 +314,7 @@ class AliasPayload(BaseModel):
     alias_code: str     # کد روی بسته/اینویس/حامل
     carrier: Optional[str] = None
 
-@app.post("/admin/aliases")
+@operator_api.post("/admin/aliases")
 def create_alias(payload: AliasPayload, session: Session = Depends(get_session)):
     oc = (payload.order_code or "").strip().upper()
     ac = (payload.alias_code or "").strip().upper()
@@ -177,19 +322,105 @@ def create_alias(payload: AliasPayload, session: Session = Depends(get_session))
         raise HTTPException(400, "order_code and alias_code are required")
 
     # اطمینان از وجود سفارش
+    new_codes = {}
     o = session.exec(select(Order).where(Order.code == oc)).first()
     if not o:
         o = Order(code=oc)
         session.add(o); session.flush()
+        new_codes[oc] = oc
 
     # اگر alias از قبل ثبت شده بود
     existed = session.exec(select(OrderAlias).where(OrderAlias.alias_code == ac)).first()
     if existed:
-        return {"ok": True, "order_code": existed.order_code, "alias_code": existed.alias_code, "carrier": existed.carrier}
+        resolved = resolve_pending_reviews(session, new_codes)
+        session.commit()
+        return {"ok": True, "order_code": existed.order_code, "alias_code": existed.alias_code, "carrier": existed.carrier,
+                "resolved_reviews": resolved}
 
     al = OrderAlias(order_code=oc, alias_code=ac, carrier=payload.carrier)
-    session.add(al); session.commit(); session.refresh(al)
-    return {"ok": True, "order_code": al.order_code, "alias_code": al.alias_code, "carrier": al.carrier}
+    session.add(al); session.flush()
+    # عکس‌های صف بررسی که همین alias را خوانده بودند، بدون OCR دوباره
+    resolved = resolve_pending_reviews(session, {**new_codes, ac: oc})
+    session.commit(); session.refresh(al)
+    return {"ok": True, "order_code": al.order_code, "alias_code": al.alias_code, "carrier": al.carrier,
+            "resolved_reviews": resolved}
+
+
+# ---------- Review queue (operator) ----------
+@operator_api.get("/admin/review")
+def list_review(
+    state: str = ReviewState.PENDING,
+    reason: Optional[str] = None,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    session: Session = Depends(get_read_session),
+):
+    """
+    جدیدترین اول؛ صفحه‌ی بعد با before_id=next_before_id (keyset روی ایندکس state+id).
+    """
+    limit = max(1, min(limit, 200))
+    q = select(ReviewItem).where(ReviewItem.state == state)
+    if reason:
+        q = q.where(ReviewItem.reason == reason)
+    if before_id:
+        q = q.where(ReviewItem.id < before_id)
+    items = session.exec(q.order_by(ReviewItem.id.desc()).limit(limit + 1)).all()
+    more = len(items) > limit
+    items = items[:limit]
+    return {"items": [review_item_dict(i) for i in items], "next_before_id": items[-1].id if more else None}
+
+class ReviewResolvePayload(BaseModel):
+    order_code: str                 # کد سفارش یا alias
+    add_alias: bool = True          # detected_code به‌عنوان alias همین سفارش ثبت شود
+
+def _open_review_item(session: Session, item_id: int) -> ReviewItem:
+    item = session.get(ReviewItem, item_id)
+    if item is None:
+        raise HTTPException(404, "Review item not found")
+    if item.state != ReviewState.PENDING:
+        raise HTTPException(409, f"Review item already {item.state}")
+    return item
+
+@operator_api.post("/admin/review/{item_id}/resolve")
+def resolve_review(item_id: int, payload: ReviewResolvePayload, session: Session = Depends(get_session)):
+    item = _open_review_item(session, item_id)
+    o = resolve_order_by_any_code(payload.order_code, session)
+    if not o:
+        raise HTTPException(404, "Order not found")
+    resolved = []
+    if payload.add_alias and item.detected_code and not resolve_order_by_any_code(item.detected_code, session):
+        session.add(OrderAlias(order_code=o.code, alias_code=item.detected_code)); session.flush()
+        # آیتم‌های دیگری که همین کد را خوانده بودند
+        resolved = [i for i in resolve_pending_reviews(session, {item.detected_code: o.code}) if i != item.id]
+    # عکس همین آیتم آخر از همه روی سفارش
+    attach_review_item(session, item, o)
+    session.commit(); session.refresh(o)
+    return {"ok": True, "code": o.code, "status": o.status, "image": o.image_path,
+            "resolved_reviews": [item.id] + resolved}
+
+@operator_api.post("/admin/review/{item_id}/dismiss")
+def dismiss_review(item_id: int, session: Session = Depends(get_session)):
+    item = _open_review_item(session, item_id)
+    item.state = ReviewState.DISMISSED
+    item.resolved_at = datetime.utcnow()
+    session.add(item); session.commit()
+    return {"ok": True, "id": item.id, "state": item.state}
+
+
+# ---------- Bulk import (admin) ----------
+@operator_api.post("/admin/import")
+def bulk_import(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),      # csv | jsonl (پیش‌فرض از پسوند فایل)
+    chunk_size: Optional[int] = Form(None),
+):
+    """
+    manifest سفارش/alias (CSV یا JSONL) را سطربه‌سطر upsert می‌کند؛ گزارش rows/sec و conflictها.
+    """
+    try:
+        return import_manifest(file.file, format or guess_format(file.filename), chunk_size)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(400, f"Invalid manifest: {e}")
 
 
 # ---------- Bulk status update (admin) ----------
@@ -198,16 +429,14 @@ class BulkUpdatePayload(BaseModel):
     end_date: date                   # "YYYY-MM-DD"
     new_status: str                  # یکی از مقادیر OrderStatus
     exclude_codes: Optional[List[str]] = None
+    dry_run: bool = False            # فقط شمارش، بدون تغییر
 
-@app.post("/admin/bulk-update-status")
-def bulk_update_status(payload: BulkUpdatePayload, session: Session = Depends(get_session)):
-    valid = {
-        OrderStatus.NOT_ARRIVED_DXB,
-        OrderStatus.ARRIVED_DXB,
-        OrderStatus.IN_TRANSIT_IR,
-        OrderStatus.ARRIVED_TEH,
-    }
-    if payload.new_status not in valid:
+@operator_api.post("/admin/bulk-update-status")
+def bulk_update_status(payload: BulkUpdatePayload, download: bool = False, session: Session = Depends(get_session)):
+    """
+    download=true: لیست کامل کدهای تغییرکرده به صورت text/plain (هر خط یک کد) استریم می‌شود.
+    """
+    if payload.new_status not in VALID_STATUSES:
         raise HTTPException(400, "Invalid status")
 
     excludes = set([c.strip().upper() for c in (payload.exclude_codes or []) if c and c.strip()])
@@ -215,162 +444,203 @@ def bulk_update_status(payload: BulkUpdatePayload, session: Session = Depends(ge
     start_dt = datetime.combine(payload.start_date, datetime.min.time())
     end_dt   = datetime.combine(payload.end_date,   datetime.max.time())
 
-    orders = session.exec(
-        select(Order).where(Order.created_at >= start_dt, Order.created_at <= end_dt)
-    ).all()
-
-    updated = 0
-    affected_codes = []
-    for o in orders:
-        if o.code in excludes:
-            continue
-        o.status = payload.new_status
-        o.updated_at = datetime.utcnow()
-        session.add(o)
-        updated += 1
-        affected_codes.append(o.code)
+    if payload.dry_run:
+        by_status = count_in_range(session, start_dt, end_dt, excludes)
+        return {"ok": True, "dry_run": True, "would_update_count": sum(by_status.values()),
+                "current_status_counts": by_status, "new_status": payload.new_status}
 
+    affected_codes = bulk_set_status(session, start_dt, end_dt, excludes, payload.new_status)
     session.commit()
-    return {"ok": True, "updated_count": updated, "new_status": payload.new_status, "affected_codes": affected_codes[:100]}
+    # UPDATE مستقیم از رویدادهای ORM رد نمی‌شود؛ کش خواندن را خودمان پاک می‌کنیم
+    if len(affected_codes) > 1000:
+        order_cache.clear()
+    else:
+        order_cache.invalidate_orders(affected_codes)
+    # مشترک‌های زنده‌ی همین worker (بقیه با poll خودشان)
+    live_hub.publish_statuses(affected_codes, payload.new_status)
+
+    updated = len(affected_codes)
+    if download:
+        return StreamingResponse(
+            (f"{c}\n" for c in affected_codes), media_type="text/plain; charset=utf-8",
+            headers={"X-Updated-Count": str(updated),
+                     "Content-Disposition": 'attachment; filename="affected_codes.txt"'},
+        )
+    return {"ok": True, "updated_count": updated, "new_status": payload.new_status,
+            "affected_codes": affected_codes[:100], "affected_codes_truncated": updated > 100}
+
+
+# ---------- OCR stats (admin) ----------
+@operator_api.get("/admin/ocr-stats")
+def ocr_stats_json():
+    from .ocr_google import ocr_stats
+    return {**ocr_stats(), "cache": ocr_cache.stats(), "fuzzy_index": fuzzy_index.stats(), "live": live_hub.stats()}
+
+
+@operator_api.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    فرمت متنی Prometheus: زمان مراحل و endpointها، نتیجه‌ی OCR/ingest، تعداد کوئری‌ها.
+    روی workerهای TRACKING_ONLY (در دسترس عموم) ثبت نمی‌شود.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ---------- Background OCR jobs ----------
+def _queue_job(session: Session, kind: str, files, status: Optional[str]):
+    job = create_job(session, kind, files, status)
+    return JSONResponse(status_code=202, content={
+        "ok": True, "job_id": job.id, "total": job.total, "status_url": f"/jobs/{job.id}",
+    })
+
+@operator_api.get("/jobs/{job_id}")
+def get_job(job_id: str, session: Session = Depends(get_read_session)):
+    info = job_status(session, job_id)
+    if info is None:
+        raise HTTPException(404, "Job not found")
+    return info
 
 
 # ---------- Ingest by coworker (OCR fallback) ----------
-@app.post("/ingest-image")
+@operator_api.post("/ingest-image")
 def ingest_image(
-    image: UploadFile = File(...),
+    saved: SavedUpload = Depends(received_image),   # فایل قبل از اجرای endpoint ذخیره شده
     hinted_code: Optional[str] = Form(None),
     status: Optional[str] = Form(None),
+    async_job: Optional[bool] = Form(None),
     session: Session = Depends(get_session)
 ):
-    # ذخیره فایل
-    ext = Path(image.filename).suffix.lower() or ".jpg"
-    fname = f"{uuid.uuid4().hex}{ext}"
-    dest = Path("app/static/uploads") / fname
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    with dest.open("wb") as f:
-        shutil.copyfileobj(image.file, f)
-    rel_path = f"/static/uploads/{fname}"
+    # حالت پس‌زمینه: فقط job ثبت می‌شود
+    if settings.INGEST_ASYNC_DEFAULT if async_job is None else async_job:
+        return _queue_job(session, "ingest-image", [(saved.filename, saved.dest, saved.url, hinted_code, saved.content_hash)], status)
 
     # تعیین کد: hinted -> filename -> OCR
-    code = (hinted_code or "").strip().upper() or guess_code_from_filename(image.filename)
-    if not code:
-        code = detect_code_from_image(str(dest))
-
-    if not code:
-        return {"ok": False, "needs_review": True, "image": rel_path, "message": "کد پیدا نشد یا تعریف نشده است."}
-
-    # پیدا کردن سفارش: مستقیم یا از طریق نگاشت
-    o = resolve_order_by_any_code(code, session)
-    if not o:
-        return {
-            "ok": False, "needs_review": True, "image": rel_path,
-            "detected_code": code, "message": "نگاشت برای این کد تعریف نشده. ابتدا /admin/aliases را ثبت کنید."
-        }
-
-    # به‌روزرسانی سفارش
-    o.image_path = rel_path
-    o.status = status if status in (
-        OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB,
-        OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH
-    ) else OrderStatus.ARRIVED_DXB
-    o.updated_at = datetime.utcnow()
-    session.add(o); session.commit()
-
-    return {"ok": True, "code": o.code, "status": o.status, "image": rel_path}
+    ocr = determine_code(saved.filename, saved.dest, hinted_code, saved.content_hash)
+
+    # پیدا کردن سفارش: مستقیم یا از طریق نگاشت و به‌روزرسانی
+    r = apply_code(session, ocr.code, saved.url, status, ocr.engine, saved.filename, ocr.error)
+    session.commit()    # سفارش به‌روز شده یا آیتم صف بررسی ثبت شده
+    if r["ok"]:
+        return r
+    if r["reason"] == OCR_UNAVAILABLE:
+        r["message"] = "سرویس OCR در دسترس نبود؛ عکس در صف بررسی ثبت شد."
+    elif r["reason"] == CODE_NOT_FOUND:
+        r["message"] = "کد پیدا نشد یا تعریف نشده است."
+    else:
+        r["message"] = "نگاشت برای این کد تعریف نشده. با ثبت /admin/aliases عکس خودکار از صف بررسی وصل می‌شود."
+    return r
 
 
 # ---------- Operator page & uploads ----------
-@app.get("/upload", response_class=HTMLResponse)
+@operator_api.get("/upload", response_class=HTMLResponse)
 def upload_form(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
 
-@app.post("/upload-one")
+@operator_api.post("/upload-one")
 def upload_one(
-    image: UploadFile = File(...),
+    saved: SavedUpload = Depends(received_image),
     hinted_code: Optional[str] = Form(None),
     status: Optional[str] = Form(None),
+    async_job: Optional[bool] = Form(None),
     session: Session = Depends(get_session),
 ):
-    # ذخیره فایل
-    ext = Path(image.filename).suffix.lower() or ".jpg"
-    fname = f"{uuid.uuid4().hex}{ext}"
-    dest = Path("app/static/uploads") / fname
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    with dest.open("wb") as f:
-        shutil.copyfileobj(image.file, f)
-    rel_path = f"/static/uploads/{fname}"
+    if settings.INGEST_ASYNC_DEFAULT if async_job is None else async_job:
+        return _queue_job(session, "upload-one", [(saved.filename, saved.dest, saved.url, hinted_code, saved.content_hash)], status)
 
     # 1) hinted یا نام فایل → 2) OCR
-    code = (hinted_code or "").strip().upper() or guess_code_from_filename(image.filename)
-    if not code:
-        code = detect_code_from_image(str(dest))
-
-    if not code:
-        return {"ok": False, "needs_review": True, "image": rel_path, "message": "کدی یافت نشد."}
-
-    o = resolve_order_by_any_code(code, session)
-    if not o:
-        return {"ok": False, "needs_review": True, "image": rel_path, "detected_code": code, "message": "نگاشت/سفارش برای این کد تعریف نشده."}
-
-    o.image_path = rel_path
-    o.status = status if status in (
-        OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB,
-        OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH
-    ) else OrderStatus.ARRIVED_DXB
-    o.updated_at = datetime.utcnow()
-    session.add(o); session.commit()
-
-    return {"ok": True, "code": o.code, "status": o.status, "image": rel_path}
+    ocr = determine_code(saved.filename, saved.dest, hinted_code, saved.content_hash)
+
+    r = apply_code(session, ocr.code, saved.url, status, ocr.engine, saved.filename, ocr.error)
+    session.commit()    # سفارش به‌روز شده یا آیتم صف بررسی ثبت شده
+    if r["ok"]:
+        return r
+    if r["reason"] == OCR_UNAVAILABLE:
+        r["message"] = "سرویس OCR در دسترس نبود (در صف بررسی ثبت شد)."
+    elif r["reason"] == CODE_NOT_FOUND:
+        r["message"] = "کدی یافت نشد."
+    else:
+        r["message"] = "نگاشت/سفارش برای این کد تعریف نشده (در صف بررسی ثبت شد)."
+    return r
+
+
+def _upload_items(uploads: List[Union[SavedUpload, UploadError]]) -> List[dict]:
+    """
+    فایل‌های ذخیره‌شده (یا خطای هر فایل) + حدس کد از نام فایل.
+    """
+    items = []
+    for u in uploads:
+        if isinstance(u, UploadError):
+            items.append({"file": u.filename, "error": u.error})
+            continue
+        code = guess_code_from_filename(u.filename)
+        items.append({"file": u.filename, "dest": u.dest, "image": u.url, "hash": u.content_hash,
+                      "code": code, "engine": "filename" if code else None})
+    return items
 
 
-@app.post("/upload-many")
+@operator_api.post("/upload-many")
 def upload_many(
-    images: List[UploadFile] = File(...),
+    uploads: List[Union[SavedUpload, UploadError]] = Depends(received_images),
     default_status: str = Form("ARRIVED_DXB"),
+    async_job: Optional[bool] = Form(None),
     session: Session = Depends(get_session),
 ):
+    # 1) فایل‌ها (در dependency ذخیره شده‌اند) و حدس کد از نام فایل
+    items = _upload_items(uploads)
+
+    if settings.INGEST_ASYNC_DEFAULT if async_job is None else async_job:
+        files = [(it["file"], it["dest"], it["image"], None, it["hash"]) for it in items if "error" not in it]
+        return _queue_job(session, "upload-many", files, default_status)
+
+    # 2) OCR برای فایل‌هایی که کدشان از نام فایل درنیامد
+    need_ocr = [it for it in items if "error" not in it and not it["code"]]
+    from .ocr_google import OCR_BACKEND
+    if OCR_BACKEND == "batch":
+        detected = detect_codes_cached([it["dest"] for it in need_ocr], content_hashes=[it["hash"] for it in need_ocr])
+        for it, r in zip(need_ocr, detected):
+            it["code"], it["engine"], it["ocr_error"] = r.code, r.engine, r.error
+    else:
+        for it in need_ocr:
+            try:
+                r = determine_code(it["file"], it["dest"], content_hash=it["hash"])
+                it["code"], it["engine"], it["ocr_error"] = r.code, r.engine, r.error
+            except Exception as e:
+                it["error"] = str(e)
+
+    # 3) یافتن سفارش و به‌روزرسانی
     results = []
-    for img in images:
+    for it in items:
+        if "error" in it:
+            results.append({"file": it["file"], "ok": False, "error": it["error"]})
+            continue
         try:
-            ext = Path(img.filename).suffix.lower() or ".jpg"
-            fname = f"{uuid.uuid4().hex}{ext}"
-            dest = Path("app/static/uploads") / fname
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            with dest.open("wb") as f:
-                shutil.copyfileobj(img.file, f)
-            rel_path = f"/static/uploads/{fname}"
-
-            # 1) نام فایل → 2) OCR
-            code = guess_code_from_filename(img.filename)
-            if not code:
-                code = detect_code_from_image(str(dest))
-
-            if not code:
-                results.append({"file": img.filename, "ok": False, "needs_review": True, "image": rel_path, "reason": "CODE_NOT_FOUND"})
-                continue
-
-            o = resolve_order_by_any_code(code, session)
-            if not o:
-                results.append({"file": img.filename, "ok": False, "needs_review": True, "image": rel_path, "detected_code": code, "reason": "ALIAS_NOT_MAPPED"})
-                continue
-
-            o.image_path = rel_path
-            o.status = default_status if default_status in (
-                OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB,
-                OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH
-            ) else OrderStatus.ARRIVED_DXB
-            o.updated_at = datetime.utcnow()
-            session.add(o)
-            results.append({"file": img.filename, "ok": True, "code": o.code, "status": o.status, "image": rel_path})
+            results.append({"file": it["file"], **apply_code(session, it["code"], it["image"], default_status, it["engine"], it["file"], it.get("ocr_error"))})
         except Exception as e:
-            results.append({"file": getattr(img, 'filename', '?'), "ok": False, "error": str(e)})
+            results.append({"file": it["file"], "ok": False, "error": str(e)})
     session.commit()
     return {
         "summary": {
-            "total": len(images),
+            "total": len(items),
             "succeeded": sum(1 for r in results if r.get("ok")),
             "needs_review": sum(1 for r in results if r.get("needs_review")),
         },
         "results": results
     }
+
+
+@operator_api.post("/upload-many/stream")
+async def upload_many_stream(
+    uploads: List[Union[SavedUpload, UploadError]] = Depends(received_images),
+    default_status: str = Form("ARRIVED_DXB"),
+):
+    """
+    نسخه‌ی موازی upload-many: نتیجه‌ی هر فایل به‌محض آماده شدن (NDJSON)،
+    خط آخر summary. هر فایل در تراکنش کوتاه خودش commit می‌شود.
+    """
+    items = _upload_items(uploads)
+    return StreamingResponse(stream_upload_results(items, default_status), media_type="application/x-ndjson")
+
+
+if not settings.TRACKING_ONLY:
+    app.include_router(operator_api)
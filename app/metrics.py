@@ -0,0 +1,246 @@
+# app/metrics.py
+"""
+اندازه‌گیری داخلی و خروجی Prometheus (بدون وابستگی اضافه).
+
+- هیستوگرام زمان هر مرحله‌ی pipeline (ذخیره‌ی فایل، load، پیش‌پردازش، Vision، resolve، commit)
+- هیستوگرام زمان و تعداد کوئری هر endpoint (بر اساس الگوی route، نه مسیر خام)
+- شمارنده‌ی نتیجه‌ی OCR (موتور، تعداد variant) و نتیجه‌ی ingest (OK / CODE_NOT_FOUND / OCR_UNAVAILABLE / ALIAS_NOT_MAPPED)
+- شمارنده‌ی تلاش‌های Vision از governor (ok / retry / failed / circuit_open / deadline / rate_limited)
+- اگر SLOW_REQUEST_SECONDS > 0، درخواست کندتر از آن با ریز زمان مراحل لاگ می‌شود
+
+context هر درخواست در contextvar است و به threadpool (endpointهای sync) هم می‌رسد؛
+مراحلی که بیرون از درخواست اجرا می‌شوند (jobها، process pool) فقط در هیستوگرام‌ها ثبت می‌شوند.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession
+
+from .deps import settings
+
+log = logging.getLogger("app.slow_requests")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return self._header(self.name)
+
+    def _header(self, name: str) -> List[str]:
+        return [f"# HELP {name} {self.help}", f"# TYPE {name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def render(self) -> List[str]:
+        name = f"{self.name}_total"
+        lines = self._header(name)
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # برچسب‌ها → (شمار هر bucket، جمع، تعداد)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        k = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(k)
+            if v is None:
+                v = self._values[k] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        les = [f'le="{b}"' for b in self.buckets] + ['le="+Inf"']
+        for k, (counts, total, n) in items:
+            acc = 0
+            for le, c in zip(les, counts + [0]):
+                acc += c
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, le)} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, k)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, k)} {n}")
+        return lines
+
+
+_REGISTRY: List[_Metric] = []
+
+http_duration = Histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+http_queries = Histogram("http_request_db_queries", "DB queries per request", ("route",), COUNT_BUCKETS)
+stage_duration = Histogram("pipeline_stage_duration_seconds", "Ingest/OCR pipeline stage latency", ("stage",))
+db_queries = Counter("db_queries", "SQL statements executed")
+ocr_detections = Counter("ocr_detections", "OCR results by engine (none = no code)", ("engine",))
+ocr_variants = Histogram("ocr_variants_tried", "Variants tried per OCR result", ("engine",), COUNT_BUCKETS)
+ingest_results = Counter("ingest_results", "Ingest outcome per image", ("result", "engine"))
+fuzzy_lookups = Counter("fuzzy_lookups", "Fuzzy code/alias lookups after an exact miss", ("result",))
+vision_calls = Counter("vision_calls", "Vision RPC attempts through the governor", ("result",))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _REGISTRY:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+# ---------- context هر درخواست ----------
+_request: ContextVar[Optional[dict]] = ContextVar("metrics_request", default=None)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    stage_duration.observe(seconds, stage=name)
+    ctx = _request.get()
+    if ctx is not None:
+        with ctx["lock"]:
+            ctx["stages"][name] = ctx["stages"].get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - t0)
+
+
+def record_ocr(result) -> None:
+    engine = result.engine if result.code else ("unavailable" if result.error else "none")
+    ocr_detections.inc(engine=engine or "none")
+    ocr_variants.observe(result.variants_tried, engine=engine or "none")
+
+
+def record_ingest(result: dict) -> None:
+    ingest_results.inc(result="OK" if result.get("ok") else result.get("reason", "ERROR"),
+                       engine=result.get("engine") or "")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    db_queries.inc()
+    ctx = _request.get()
+    if ctx is not None:
+        with ctx["lock"]:
+            ctx["queries"] += 1
+
+
+@event.listens_for(OrmSession, "before_commit")
+def _commit_started(session):
+    session.info["metrics_commit_t0"] = time.perf_counter()
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _commit_finished(session):
+    t0 = session.info.pop("metrics_commit_t0", None)
+    if t0 is not None:
+        observe_stage("db_commit", time.perf_counter() - t0)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _commit_aborted(session):
+    session.info.pop("metrics_commit_t0", None)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    # Mountها (static) route ندارند؛ root_path همان مسیر mount است
+    if scope.get("endpoint") is not None:
+        return scope.get("root_path") or "mount"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    middleware خام ASGI: زمان و تعداد کوئری هر درخواست + لاگ درخواست کند.
+    زمان تا پایان ارسال بدنه حساب می‌شود (برای پاسخ‌های استریم هم).
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        ctx = {"stages": {}, "queries": 0, "lock": threading.Lock()}
+        token = _request.set(ctx)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _request.reset(token)
+            route = _route_label(scope)
+            http_duration.observe(elapsed, method=scope["method"], route=route, status=str(status[0]))
+            http_queries.observe(ctx["queries"], route=route)
+            if 0 < settings.SLOW_REQUEST_SECONDS <= elapsed:
+                log.warning("slow request %s", json.dumps({
+                    "method": scope["method"], "path": scope["path"], "route": route, "status": status[0],
+                    "seconds": round(elapsed, 4), "queries": ctx["queries"],
+                    "stages": {k: round(v, 4) for k, v in ctx["stages"].items()},
+                }, ensure_ascii=False))
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from typing import Optional
 from datetime import datetime
@@ -9,6 +10,14 @@ class OrderStatus:
     ARRIVED_TEH     = "ARRIVED_TEH"       # رسیده به انبار تهران (به‌زودی ارسال می‌شود)
 
 class Order(SQLModel, table=True):
+    __table_args__ = (
+        # برای bulk-update-status (بازه‌ی created_at) و شمارش بر اساس وضعیت
+        Index("ix_order_created_at_status", "created_at", "status"),
+        # فهرست ادمین (/admin/orders): صفحه‌بندی keyset روی (updated_at, id)، با یا بدون فیلتر وضعیت
+        Index("ix_order_status_updated_at_id", "status", "updated_at", "id"),
+        Index("ix_order_updated_at_id", "updated_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     code: str = Field(index=True, unique=True)          # کد مشتری (که کاربر سرچ می‌کند)
     status: str = Field(default=OrderStatus.NOT_ARRIVED_DXB)
@@ -22,3 +31,93 @@ class OrderAlias(SQLModel, table=True):
     alias_code: str = Field(index=True, unique=True)    # کد روی بسته/اینویس/حامل
     carrier: Optional[str] = None                       # مثلا INVOICE / J&T / AJEX (اختیاری)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class OcrCacheEntry(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True, unique=True)  # sha256 محتوای فایل
+    phash: Optional[str] = Field(default=None, index=True)  # dHash برای عکس‌های تقریباً تکراری
+    code: str                                           # کد کشف‌شده
+    variant: Optional[str] = None                       # variant برنده (filter:angle)
+    hits: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_hit_at: datetime = Field(default_factory=datetime.utcnow)
+
+class JobState:
+    QUEUED  = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE    = "DONE"
+
+class OcrJob(SQLModel, table=True):
+    id: str = Field(primary_key=True)                   # uuid hex
+    kind: str                                           # ingest-image / upload-one / upload-many
+    state: str = Field(default=JobState.QUEUED, index=True)
+    status: Optional[str] = None                        # وضعیتی که روی سفارش‌ها ست می‌شود
+    total: int = 0
+    done: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    owner: Optional[str] = None                         # پروسه‌ای که job را claim کرده (jobs._OWNER)
+    heartbeat_at: Optional[datetime] = None             # تمدید lease؛ RUNNING با heartbeat کهنه دوباره claim می‌شود
+
+class OcrJobItem(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: str = Field(index=True)
+    filename: str
+    dest: str                                           # مسیر فایل روی دیسک
+    image: str                                          # مسیر عمومی (/static/uploads/...)
+    hinted_code: Optional[str] = None
+    content_hash: Optional[str] = None                  # sha256 فایل (کلید کش OCR)
+    state: str = Field(default=JobState.QUEUED)
+    result: Optional[str] = None                        # JSON نتیجه
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ReviewState:
+    PENDING   = "PENDING"
+    RESOLVED  = "RESOLVED"      # خودکار (alias/سفارش جدید) یا دستی
+    DISMISSED = "DISMISSED"
+
+class ReviewItem(SQLModel, table=True):
+    """
+    عکس ingest‌شده‌ای که به سفارشی وصل نشد (needs_review).
+    """
+    __table_args__ = (
+        # صف هر state به ترتیب id (صفحه‌بندی keyset)
+        Index("ix_reviewitem_state_id", "state", "id"),
+        # تطبیق خودکار آیتم‌های باز با کد/alias جدید
+        Index("ix_reviewitem_detected_code_state", "detected_code", "state"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    image: str = Field(index=True)                      # مسیر عمومی عکس (هر عکس حداکثر یک آیتم باز)
+    filename: Optional[str] = None
+    detected_code: Optional[str] = None                 # کد خوانده‌شده با حروف بزرگ (در CODE_NOT_FOUND خالی)
+    reason: str                                         # CODE_NOT_FOUND / OCR_UNAVAILABLE / ALIAS_NOT_MAPPED
+    engine: Optional[str] = None
+    status: Optional[str] = None                        # وضعیتی که بعد از تطبیق روی سفارش ست می‌شود
+    state: str = Field(default=ReviewState.PENDING)
+    order_code: Optional[str] = None                    # سفارشی که آیتم به آن وصل شد
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    resolved_at: Optional[datetime] = None
+
+class StatusEvent(SQLModel, table=True):
+    """
+    تاریخچه‌ی append-only وضعیت سفارش؛ در همان تراکنش تغییر نوشته می‌شود (app/status_log.py).
+    """
+    __table_args__ = (
+        # تاریخچه‌ی هر سفارش به ترتیب id (صفحه‌بندی keyset)
+        Index("ix_statusevent_order_code_id", "order_code", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    order_code: str
+    old_status: Optional[str] = None                    # None: سفارش تازه ساخته شده
+    new_status: str
+    source: str                                         # create / set_status / manual / ingest / review / bulk / import
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class StatusCount(SQLModel, table=True):
+    """
+    تعداد سفارش‌های هر وضعیت، هم‌زمان با هر تغییر به‌روز می‌شود (به‌جای COUNT(*) روی order).
+    """
+    status: str = Field(primary_key=True)
+    orders: int = 0
@@ -0,0 +1,268 @@
+# app/ocr_cache.py
+"""
+کش نتیجه‌ی OCR با کلید هش محتوای عکس.
+
+دو لایه: LRU در حافظه (جلو) و جدول OcrCacheEntry در دیتابیس (ماندگار).
+در صورت hit، کد و variant برنده بدون OpenCV/Vision برمی‌گردد (موتورهای OCR فقط
+در اولین miss import می‌شوند).
+فقط نتیجه‌های موفق کش می‌شوند تا خطای موقت Vision ماندگار نشود.
+شمارش hit (hits / last_hit_at) در حافظه جمع و هر OCR_CACHE_HIT_FLUSH_SECONDS یک‌جا نوشته
+می‌شود؛ hit کش هیچ UPDATE/commit جداگانه‌ای ندارد.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .deps import engine, settings
+from .metrics import record_ocr
+from .models import OcrCacheEntry
+from .ocr_result import OcrResult
+from .storage import file_sha256
+
+
+def image_dhash(path: str) -> Optional[str]:
+    """
+    dHash شصت‌وچهار بیتی (hex) برای تشخیص عکس‌های تقریباً تکراری.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (64, 64))  # برای JPEG دیکد سریع با اندازه‌ی کوچک
+            small = img.convert("L").resize((9, 8), Image.BILINEAR)
+    except Exception:
+        return None
+    px = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+# مقدار LRU: (code, variant, phash, stored_at)
+_Entry = Tuple[str, Optional[str], Optional[str], datetime]
+
+
+class OcrResultCache:
+    def __init__(self, size: int, ttl: timedelta, max_rows: int):
+        self.size = size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lru: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._pending_hits: Dict[str, Tuple[int, datetime]] = {}    # content_hash ردیف → (تعداد، آخرین hit)
+        self._flushed_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- لایه‌ی حافظه ----------
+    def _lru_get(self, content_hash: str, phash: Optional[str]) -> Optional[Tuple[str, _Entry]]:
+        now = datetime.utcnow()
+        with self._lock:
+            e = self._lru.get(content_hash)
+            if e is not None:
+                if now - e[3] <= self.ttl:
+                    self._lru.move_to_end(content_hash)
+                    return content_hash, e
+                del self._lru[content_hash]
+            if phash is None:
+                return None
+            # عکس تقریباً تکراری
+            for key, e in reversed(self._lru.items()):
+                if e[2] and now - e[3] <= self.ttl and _hamming(e[2], phash) <= settings.OCR_CACHE_PHASH_DISTANCE:
+                    return key, e
+        return None
+
+    def _lru_put(self, content_hash: str, entry: _Entry) -> None:
+        with self._lock:
+            self._lru[content_hash] = entry
+            self._lru.move_to_end(content_hash)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    # ---------- لایه‌ی دیتابیس ----------
+    def _db_get(self, content_hash: str, phash: Optional[str]) -> Optional[Tuple[str, _Entry]]:
+        cutoff = datetime.utcnow() - self.ttl
+        with Session(engine) as session:
+            row = session.exec(
+                select(OcrCacheEntry).where(OcrCacheEntry.content_hash == content_hash)
+            ).first()
+            if row is None and phash is not None:
+                row = session.exec(
+                    select(OcrCacheEntry).where(OcrCacheEntry.phash == phash)
+                ).first()
+            if row is None or row.last_hit_at < cutoff:
+                return None
+            return row.content_hash, (row.code, row.variant, row.phash, datetime.utcnow())
+
+    def _db_put(self, content_hash: str, entry: _Entry) -> None:
+        code, variant, phash, _ = entry
+        with Session(engine) as session:
+            try:
+                session.add(OcrCacheEntry(content_hash=content_hash, phash=phash, code=code, variant=variant))
+                session.commit()
+            except IntegrityError:
+                # همزمان توسط درخواست دیگری ثبت شده
+                session.rollback()
+                return
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._prune(session)
+
+    def _record_hit(self, content_hash: str) -> None:
+        with self._lock:
+            n, _ = self._pending_hits.get(content_hash, (0, None))
+            self._pending_hits[content_hash] = (n + 1, datetime.utcnow())
+            due = time.monotonic() - self._flushed_at >= settings.OCR_CACHE_HIT_FLUSH_SECONDS
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self) -> None:
+        """
+        hitهای جمع‌شده با یک UPDATE (executemany) در یک تراکنش: hits += n و last_hit_at.
+        """
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        table = OcrCacheEntry.__table__
+        stmt = (
+            update(table)
+            .where(table.c.content_hash == bindparam("h"))
+            .values(hits=table.c.hits + bindparam("n"),
+                    last_hit_at=case((table.c.last_hit_at < bindparam("t"), bindparam("t")),
+                                     else_=table.c.last_hit_at))
+        )
+        try:
+            with engine.begin() as conn:
+                conn.execute(stmt, [{"h": h, "n": n, "t": t} for h, (n, t) in pending.items()])
+        except Exception:
+            pass        # آمار است؛ از دست رفتن یک دور مهم نیست
+
+    def _prune(self, session: Session) -> None:
+        """
+        حذف ردیف‌های منقضی و سپس قدیمی‌ترین‌ها تا سقف max_rows.
+        """
+        cutoff = datetime.utcnow() - self.ttl
+        session.exec(delete(OcrCacheEntry).where(OcrCacheEntry.last_hit_at < cutoff))
+        total = session.exec(select(func.count()).select_from(OcrCacheEntry)).one()
+        extra = total - self.max_rows
+        if extra > 0:
+            oldest = select(OcrCacheEntry.id).order_by(OcrCacheEntry.last_hit_at).limit(extra)
+            session.exec(delete(OcrCacheEntry).where(OcrCacheEntry.id.in_(oldest)))
+        session.commit()
+
+    # ---------- API ----------
+    def get(self, content_hash: str, phash: Optional[str] = None) -> Optional[OcrResult]:
+        found = self._lru_get(content_hash, phash)
+        if found is None:
+            found = self._db_get(content_hash, phash)
+            if found is not None:
+                self._lru_put(content_hash, found[1])
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        key, e = found
+        self._record_hit(key)
+        return OcrResult(code=e[0], variant=e[1], engine="cache")
+
+    def put(self, content_hash: str, result: OcrResult, phash: Optional[str] = None) -> None:
+        if not result.code:
+            return
+        entry = (result.code, result.variant, phash, datetime.utcnow())
+        self._lru_put(content_hash, entry)
+        self._db_put(content_hash, entry)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "lru_size": len(self._lru),
+                "pending_hit_rows": len(self._pending_hits)}
+
+
+ocr_cache = OcrResultCache(
+    size=settings.OCR_CACHE_LRU_SIZE,
+    ttl=timedelta(days=settings.OCR_CACHE_TTL_DAYS),
+    max_rows=settings.OCR_CACHE_MAX_ROWS,
+)
+
+
+def cache_keys(path: str, content_hash: Optional[str]) -> Tuple[str, Optional[str]]:
+    phash = image_dhash(path) if settings.OCR_CACHE_PHASH else None
+    return content_hash or file_sha256(path), phash
+
+
+def detect_code_cached(image_path: str, content_hash: Optional[str] = None) -> OcrResult:
+    """
+    detect_code_cascade (موتورهای OCR) با کش جلوی آن. content_hash اگر از قبل حساب شده بود پاس داده شود.
+    """
+    from .ocr_engines import detect_code_cascade   # OpenCV/NumPy: import تنبل
+
+    if not settings.OCR_CACHE_ENABLED:
+        result = detect_code_cascade(image_path)
+        record_ocr(result)
+        return result
+    try:
+        key, phash = cache_keys(image_path, content_hash)
+    except OSError:
+        return OcrResult()
+    hit = ocr_cache.get(key, phash)
+    if hit is not None:
+        record_ocr(hit)
+        return hit
+    result = detect_code_cascade(image_path)
+    ocr_cache.put(key, result, phash)
+    record_ocr(result)
+    return result
+
+
+def detect_codes_cached(image_paths: List[str], batch_size: Optional[int] = None,
+                        content_hashes: Optional[List[Optional[str]]] = None) -> List[OcrResult]:
+    """
+    نسخه‌ی دسته‌ای: فقط فایل‌هایی که در کش نیستند به detect_codes_cascade_batch می‌روند.
+    """
+    from .ocr_engines import detect_codes_cascade_batch
+
+    if not settings.OCR_CACHE_ENABLED:
+        results = detect_codes_cascade_batch(image_paths, batch_size)
+        for r in results:
+            record_ocr(r)
+        return results
+
+    results: List[Optional[OcrResult]] = [None] * len(image_paths)
+    misses: List[Tuple[int, str, Optional[str]]] = []
+    hashes = content_hashes or [None] * len(image_paths)
+    for i, (path, content_hash) in enumerate(zip(image_paths, hashes)):
+        try:
+            key, phash = cache_keys(path, content_hash)
+        except OSError:
+            results[i] = OcrResult()
+            continue
+        hit = ocr_cache.get(key, phash)
+        if hit is not None:
+            results[i] = hit
+        else:
+            misses.append((i, key, phash))
+
+    detected = detect_codes_cascade_batch([image_paths[i] for i, _, _ in misses], batch_size)
+    for (i, key, phash), r in zip(misses, detected):
+        ocr_cache.put(key, r, phash)
+        results[i] = r
+    results = [r or OcrResult() for r in results]
+    for r in results:
+        record_ocr(r)
+    return results
@@ -0,0 +1,265 @@
+# app/ocr_engines.py
+"""
+موتورهای OCR قابل تعویض و سیاست cascade.
+
+ترتیب موتورها با OCR_ENGINES تعیین می‌شود (پیش‌فرض: barcode,tesseract,vision).
+اول بارکد/QR روی عکس کوچک‌شده خوانده می‌شود (چند میلی‌ثانیه CPU)، بعد
+موتور محلی (Tesseract) فقط روی چند variant ارزان امتحان می‌شود و
+فقط اگر _pick_code چیزی پیدا نکرد سراغ Google Vision می‌رویم.
+"""
+from __future__ import annotations
+
+import io
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .ocr_google import (
+    OcrResult, VariantKey, _load_image, _orient_keys, _pick_code, _prepare_base, _preprocess_variants,
+    _resized, _stat_key, _vision_client, _vision_ocr, collect_variant_results, detect_codes_batch_detail,
+    record_variant_result, variant_order,
+)
+from .vision_governor import VisionUnavailable, vision_budget
+
+# فیلترهای ارزان (بدون bilateralFilter) برای موتور محلی
+CHEAP_FILTERS = ("adaptive", "contrast", "invert")
+OCR_LOCAL_VARIANTS = int(os.getenv("OCR_LOCAL_VARIANTS", "4"))
+
+
+class OcrEngine:
+    name = "base"
+    local = False                        # بدون شبکه/هزینه‌ی API
+
+    def available(self) -> bool:
+        raise NotImplementedError
+
+    def variant_keys(self) -> List[VariantKey]:
+        return variant_order(self.name)
+
+    def ocr(self, pil_img: Image.Image) -> str:
+        raise NotImplementedError
+
+    def detect(self, original: Image.Image, cache: Dict[str, object]) -> OcrResult:
+        """
+        پیش‌فرض: variantها را به ترتیب OCR می‌کند تا اولین کد معتبر.
+        cache خروجی فیلترها را بین موتورها مشترک نگه می‌دارد.
+        """
+        tried = 0
+        for key, v in _preprocess_variants(original, self.variant_keys(), cache):
+            tried += 1
+            try:
+                text = self.ocr(v)
+            except VisionUnavailable as e:
+                return OcrResult(variants_tried=tried, error=e.reason)
+            hit = self.hit(key, text, tried)
+            if hit is not None:
+                return hit
+        return OcrResult(variants_tried=tried)
+
+    def hit(self, key: VariantKey, text: str, tried: int) -> Optional[OcrResult]:
+        """
+        متن OCR یک variant: تلاش (و موفقیت) variant در آمار همین موتور ثبت و اگر کد معتبر داشت
+        نتیجه برگردانده می‌شود.
+        """
+        code = _pick_code(text)
+        record_variant_result(key, code is not None, self.name)
+        if not code:
+            return None
+        return OcrResult(code=code, variant=_stat_key(key), variants_tried=tried, engine=self.name)
+
+
+class BarcodeEngine(OcrEngine):
+    """
+    بارکد 1D و QR با دیتکتورهای خود OpenCV. لیبل‌های J&T و AJEX همان
+    شماره‌ی رهگیری را در بارکد دارند؛ payload با همان regexهای _pick_code اعتبارسنجی می‌شود.
+    """
+    name = "barcode"
+    local = True
+
+    def __init__(self):
+        # دیتکتورهای OpenCV thread-safe نیستند؛ برای هر thread جدا
+        self._local = threading.local()
+
+    def available(self) -> bool:
+        return True
+
+    def _detectors(self):
+        if not hasattr(self._local, "qr"):
+            self._local.qr = cv2.QRCodeDetector()
+            self._local.bar = cv2.barcode.BarcodeDetector() if hasattr(cv2, "barcode") else None
+        return self._local.qr, self._local.bar
+
+    def decode(self, mat: np.ndarray) -> List[str]:
+        gray = cv2.cvtColor(mat, cv2.COLOR_BGR2GRAY) if mat.ndim == 3 else mat
+        qr, bar = self._detectors()
+        payloads: List[str] = []
+        if bar is not None:
+            try:
+                ok, infos, _types, _pts = bar.detectAndDecodeMulti(gray)
+                if ok:
+                    payloads.extend(i for i in infos if i)
+            except cv2.error:
+                pass
+        try:
+            ok, infos, _pts, _straight = qr.detectAndDecodeMulti(gray)
+            if ok:
+                payloads.extend(i for i in infos if i)
+        except cv2.error:
+            pass
+        return payloads
+
+    def detect(self, original: Image.Image, cache: Dict[str, object]) -> OcrResult:
+        # روی عکس کوچک‌شده‌ی کامل (بدون برش لیبل) تا بارکدهای کنار لیبل هم دیده شوند
+        for payload in self.decode(_resized(original, cache)):
+            code = _pick_code(payload)
+            if code:
+                return OcrResult(code=code, variant=self.name, variants_tried=1, engine=self.name)
+        return OcrResult(variants_tried=1)
+
+
+class TesseractEngine(OcrEngine):
+    """
+    Tesseract محلی (باینری tesseract-ocr که در Dockerfile نصب است) از طریق stdin/stdout.
+    """
+    name = "tesseract"
+    local = True
+
+    def __init__(self, cmd: Optional[str] = None, args: Optional[str] = None, timeout: float = 20.0):
+        self.cmd = cmd or os.getenv("TESSERACT_CMD", "tesseract")
+        # psm 11: متن پراکنده (مناسب لیبل بسته)
+        self.args = shlex.split(args or os.getenv("OCR_TESSERACT_ARGS", "-l eng --psm 11"))
+        self.timeout = timeout
+
+    def available(self) -> bool:
+        return shutil.which(self.cmd) is not None
+
+    def variant_keys(self) -> List[VariantKey]:
+        return [k for k in variant_order(self.name) if k[0] in CHEAP_FILTERS][:OCR_LOCAL_VARIANTS]
+
+    def ocr(self, pil_img: Image.Image) -> str:
+        buf = io.BytesIO()
+        pil_img.save(buf, format="PNG")
+        try:
+            proc = subprocess.run(
+                [self.cmd, "stdin", "stdout", *self.args],
+                input=buf.getvalue(), capture_output=True, timeout=self.timeout,
+            )
+        except Exception:
+            return ""
+        if proc.returncode != 0:
+            return ""
+        return proc.stdout.decode("utf-8", errors="ignore")
+
+
+class VisionEngine(OcrEngine):
+    name = "vision"
+
+    def available(self) -> bool:
+        return _vision_client() is not None
+
+    def ocr(self, pil_img: Image.Image) -> str:
+        client = _vision_client()
+        return _vision_ocr(client, pil_img) if client is not None else ""
+
+    def detect(self, original: Image.Image, cache: Dict[str, object]) -> OcrResult:
+        # ساعت بودجه از اولین variant Vision؛ زمان barcode/Tesseract از deadline کم نمی‌شود
+        with vision_budget():
+            return super().detect(original, cache)
+
+    def prepared_keys(self, prepared: Dict[str, object]) -> List[VariantKey]:
+        """
+        ترتیب variantها برای عکس پایه‌ی آماده (detect_code_local_prepared)، با جهت متن همان عکس.
+        """
+        return _orient_keys(self.variant_keys(), prepared["_horizontal"])
+
+
+ENGINES: Dict[str, OcrEngine] = {e.name: e for e in (BarcodeEngine(), TesseractEngine(), VisionEngine())}
+
+
+def configured_engines() -> List[OcrEngine]:
+    names = [n.strip() for n in os.getenv("OCR_ENGINES", "barcode,tesseract,vision").split(",") if n.strip()]
+    return [ENGINES[n] for n in names if n in ENGINES]
+
+
+def _run_engines(original: Image.Image, engines: List[OcrEngine],
+                 cache: Optional[Dict[str, object]] = None) -> OcrResult:
+    cache = cache if cache is not None else {}      # خروجی فیلترها بین موتورها مشترک است
+    tried = 0
+    for engine in engines:
+        if not engine.available():
+            continue
+        r = engine.detect(original, cache)
+        tried += r.variants_tried
+        if r.code or r.error:
+            r.variants_tried = tried
+            return r
+    return OcrResult(variants_tried=tried)
+
+
+def detect_code_cascade(image_path: str) -> OcrResult:
+    """
+    موتورها را به ترتیب OCR_ENGINES امتحان می‌کند؛ engine نتیجه نشان می‌دهد کدام جواب داد.
+    """
+    try:
+        original = _load_image(image_path)
+    except Exception:
+        return OcrResult()
+    return _run_engines(original, configured_engines())
+
+
+def detect_code_local(image_path: str) -> OcrResult:
+    """
+    فقط موتورهای محلی (برای اجرا در process pool یا حالت کاملاً آفلاین).
+    """
+    try:
+        original = _load_image(image_path)
+    except Exception:
+        return OcrResult()
+    return _run_engines(original, [e for e in configured_engines() if e.local])
+
+
+def detect_code_local_prepared(
+    image_path: str, prepare: bool,
+) -> Tuple[OcrResult, Optional[Dict[str, object]], List[Tuple[str, VariantKey, bool]]]:
+    """
+    مثل detect_code_local برای process pool مسیر موازی آپلود: عکس یک‌بار لود می‌شود و اگر
+    کدی پیدا نشد و prepare، عکس پایه‌ی آماده (resize + برش لیبل + جهت متن) هم برمی‌گردد تا
+    variantهای Vision با render_prepared بدون لود و تحلیل layout دوباره ساخته شوند.
+    سومی: نتیجه‌ی variantهای موتورهای محلی که parent با record_variant_result ثبت می‌کند.
+    """
+    try:
+        original = _load_image(image_path)
+    except Exception:
+        return OcrResult(), None, []
+    cache: Dict[str, object] = {}
+    with collect_variant_results() as outcomes:
+        r = _run_engines(original, [e for e in configured_engines() if e.local], cache)
+    if r.code or not prepare:
+        return r, None, outcomes
+    _prepare_base(original, cache)
+    return r, {"_base": cache["_base"], "_horizontal": cache["_horizontal"]}, outcomes
+
+
+def detect_codes_cascade_batch(image_paths: List[str], batch_size: Optional[int] = None) -> List[OcrResult]:
+    """
+    نسخه‌ی دسته‌ای: اول موتور محلی برای هر فایل، بعد باقی‌مانده‌ها در batchهای Vision.
+    """
+    engines = configured_engines()
+    results = [OcrResult() for _ in image_paths]
+    if any(e.local for e in engines):
+        results = [detect_code_local(p) for p in image_paths]
+    if ENGINES["vision"] not in engines:
+        return results
+
+    rest = [i for i, r in enumerate(results) if not r.code]
+    for i, r in zip(rest, detect_codes_batch_detail([image_paths[i] for i in rest], batch_size)):
+        r.variants_tried += results[i].variants_tried
+        results[i] = r
+    return results
@@ -4,7 +4,14 @@ from __future__ import annotations
 import os
 import io
 import re
-from typing import Iterable, List, Optional
+import ast
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Pillow
 from PIL import Image, ImageOps, ImageFilter
@@ -13,6 +20,10 @@ from PIL import Image, ImageOps, ImageFilter
 import cv2
 import numpy as np
 
+from .metrics import observe_stage, stage
+from .ocr_result import OcrResult
+from .vision_governor import TRANSIENT_CODES, TransientVisionError, VisionUnavailable, vision_budget, vision_governor
+
 
 # ========= تنظیمات Regex برای کدها =========
 # اولویت: JTE*  ->  AJA*  ->  عدد 12..20 رقمی (اینویس‌نامبر)
@@ -22,9 +33,10 @@ RX_INVOICE_NUM = re.compile(r"\b\d{12,20}\b")
 
 
 def _load_image(path: str) -> Image.Image:
-    img = Image.open(path)
-    # به RGB (و خروج از حالت CMYK/P) برای سازگاری با Vision
-    return img.convert("RGB")
+    with stage("load_image"):
+        img = Image.open(path)
+        # به RGB (و خروج از حالت CMYK/P) برای سازگاری با Vision
+        return img.convert("RGB")
 
 
 def _to_cv(img: Image.Image) -> np.ndarray:
@@ -46,103 +58,607 @@ def _resize_max_side(mat: np.ndarray, max_side: int = 1800) -> np.ndarray:
     return cv2.resize(mat, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
 
 
-def _preprocess_variants(img: Image.Image) -> List[Image.Image]:
+# ========= ناحیه‌ی لیبل و جهت متن =========
+OCR_LABEL_CROP = os.getenv("OCR_LABEL_CROP", "1") == "1"
+# reorder: زاویه‌های محتمل اول | drop: فقط زاویه‌های محتمل | off: مثل قبل
+OCR_ORIENTATION = os.getenv("OCR_ORIENTATION", "reorder")
+
+
+def _analyze_layout(mat: np.ndarray) -> Tuple[Optional[Tuple[int, int, int, int]], Optional[bool]]:
+    """
+    ناحیه‌ی متن (لیبل) و جهت خطوط را با کانتورهای گرادیان مورفولوژیک تخمین می‌زند.
+    خروجی: (x0, y0, x1, y1) یا None اگر برش سودی ندارد، و افقی بودن متن (None = نامعلوم).
     """
-    چند نسخه‌ی پیش‌پردازش تولید می‌کند تا شانس OCR بالا برود.
+    gray = cv2.cvtColor(mat, cv2.COLOR_BGR2GRAY) if mat.ndim == 3 else mat
+    h, w = gray.shape[:2]
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, bw = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    # فقط اجزای هم‌اندازه‌ی حروف بمانند؛ لبه‌ی لیبل، نوار چسب و خطوط بلند حذف شوند
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(bw, connectivity=8)
+    max_char = 0.06 * max(h, w)
+    cw, ch = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    thin_line = (np.minimum(cw, ch) <= 3) & (np.maximum(cw, ch) >= 12)
+    keep = (cw <= max_char) & (ch <= max_char) & ~thin_line
+    keep[0] = False  # پس‌زمینه
+    bw = np.where(keep[labels], 255, 0).astype(np.uint8)
+
+    # حروف یک خط را به هم بچسبان؛ یک‌بار افقی و یک‌بار عمودی برای تشخیص جهت
+    k = max(9, max(h, w) // 60)
+    horiz = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (k, 3)))
+    vert = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (3, k)))
+
+    min_area = 0.0005 * h * w
+
+    def text_boxes(mask: np.ndarray, horizontal: bool):
+        # RETR_LIST: خطوط متن داخل قاب لیبل هم دیده شوند، نه فقط لبه‌ی بیرونی لیبل
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        out = []
+        for c in contours:
+            x, y, bw_, bh = cv2.boundingRect(c)
+            if bw_ * bh < min_area or bw_ > 0.95 * w or bh > 0.95 * h:
+                continue
+            long_, short = (bw_, bh) if horizontal else (bh, bw_)
+            # خط متن: کشیده و باریک (قاب لیبل/نوار چسب حذف می‌شود)
+            if long_ >= 2.0 * short and short <= 0.08 * max(h, w):
+                out.append((x, y, x + bw_, y + bh))
+        return out
+
+    hb, vb = text_boxes(horiz, True), text_boxes(vert, False)
+    h_area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in hb)
+    v_area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in vb)
+    horizontal: Optional[bool] = None
+    if h_area > 1.5 * v_area:
+        horizontal = True
+    elif v_area > 1.5 * h_area:
+        horizontal = False
+
+    boxes = hb if horizontal is not False else vb
+    if not boxes:
+        return None, horizontal
+    pad = int(0.04 * max(h, w))
+    x0 = max(0, min(b[0] for b in boxes) - pad)
+    y0 = max(0, min(b[1] for b in boxes) - pad)
+    x1 = min(w, max(b[2] for b in boxes) + pad)
+    y1 = min(h, max(b[3] for b in boxes) + pad)
+    # برش خیلی بزرگ سودی ندارد، برش خیلی کوچک احتمالاً اشتباه است
+    ratio = (x1 - x0) * (y1 - y0) / float(h * w)
+    if ratio > 0.85 or ratio < 0.03:
+        return None, horizontal
+    return (x0, y0, x1, y1), horizontal
+
+
+def _resized(img: Image.Image, cache: Dict[str, object]) -> np.ndarray:
+    if "_resized" not in cache:
+        # نسخه‌ی پایه (resize بزرگ)
+        cache["_resized"] = _resize_max_side(_to_cv(img), max_side=1800)
+    return cache["_resized"]
+
+
+def _prepare_base(img: Image.Image, cache: Dict[str, object]) -> np.ndarray:
     """
-    variants: List[Image.Image] = []
+    عکس پایه‌ی variantها: resize + برش ناحیه‌ی لیبل. جهت متن یک‌بار
+    تخمین زده و در cache["_horizontal"] نگه داشته می‌شود.
+    """
+    if "_base" not in cache:
+        t0 = time.perf_counter()
+        base = _resized(img, cache)
+        box, horizontal = _analyze_layout(base) if (OCR_LABEL_CROP or OCR_ORIENTATION != "off") else (None, None)
+        if OCR_LABEL_CROP and box is not None:
+            x0, y0, x1, y1 = box
+            base = base[y0:y1, x0:x1]
+        cache["_base"] = base
+        cache["_horizontal"] = horizontal
+        _record_prep("layout", time.perf_counter() - t0)
+    return cache["_base"]
+
+
+def _orient_keys(keys: List["VariantKey"], horizontal: Optional[bool]) -> List["VariantKey"]:
+    """
+    متن افقی → 0/180 محتمل‌اند، عمودی → 90/270. بقیه آخر می‌روند (یا حذف می‌شوند).
+    ترتیب آماری داخل هر گروه حفظ می‌شود.
+    """
+    if horizontal is None or OCR_ORIENTATION == "off":
+        return keys
+    likely = (0, 180) if horizontal else (90, 270)
+    first = [k for k in keys if k[1] in likely]
+    if OCR_ORIENTATION == "drop":
+        return first
+    return first + [k for k in keys if k[1] not in likely]
 
-    # 1) نسخه‌ی پایه (resize بزرگ)
-    base_cv = _resize_max_side(_to_cv(img), max_side=1800)
 
-    # 2) حذف نویز + شارپ ملایم
-    den = cv2.bilateralFilter(base_cv, d=9, sigmaColor=75, sigmaSpace=75)
-    den_pil = _to_pil(den).filter(ImageFilter.UnsharpMask(radius=2, percent=120))
-    variants.append(den_pil)
+# کلید هر variant = (فیلتر، زاویه). ترتیب پیش‌فرض همان ترتیب قدیمی است.
+FILTERS = ("denoise", "adaptive", "contrast", "invert")
+ANGLES = (0, 90, 180, 270)
+VariantKey = Tuple[str, int]
 
-    # 3) grayscale + CLAHE + باینری تطبیقی
-    gray = cv2.cvtColor(base_cv, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(gray)
-    adapt = cv2.adaptiveThreshold(
-        clahe, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 35, 11
-    )
-    adapt_bgr = cv2.cvtColor(adapt, cv2.COLOR_GRAY2BGR)
-    variants.append(_to_pil(adapt_bgr))
+# آمار variantها (چند بار امتحان شد / چند بار کد داد) برای مرتب‌سازی تطبیقی، جدا برای هر موتور.
+# شمارنده‌ها در حافظه جمع و هر STATS_FLUSH_SECONDS با merge (زیر قفل فایل) روی دیسک نوشته
+# می‌شوند تا پروسه‌های هم‌زمان (workerها، process pool) به‌روزرسانی هم را از دست ندهند.
+STATS_PATH = os.getenv("OCR_VARIANT_STATS_PATH", "./ocr_variant_stats.json")
+STATS_FLUSH_SECONDS = float(os.getenv("OCR_VARIANT_STATS_FLUSH_SECONDS", "30"))
+_stats_lock = threading.Lock()
+_variant_stats: Optional[Dict[str, Dict[str, int]]] = None     # آخرین نسخه‌ی دیسک + pending
+_pending_stats: Dict[str, Dict[str, int]] = {}                   # هنوز روی دیسک نرفته
+_stats_loaded_at = 0.0
+# داخل collect_variant_results (process pool): نتیجه‌ها به‌جای حافظه‌ی child جمع می‌شوند
+_collected: ContextVar[Optional[List[Tuple[str, VariantKey, bool]]]] = ContextVar("variant_results", default=None)
 
-    # 4) افزایش کنتراست (Pillow) + شارپ
-    hi = ImageOps.autocontrast(_to_pil(base_cv), cutoff=2)
-    hi = hi.filter(ImageFilter.UnsharpMask(radius=1.4, percent=140))
-    variants.append(hi)
 
-    # 5) معکوس (گاهی متن تیره روی روشن بهتر می‌شود)
-    inv = ImageOps.invert(ImageOps.grayscale(_to_pil(base_cv))).convert("RGB")
-    variants.append(inv)
+def _stat_key(key: VariantKey) -> str:
+    return f"{key[0]}:{key[1]}"
 
-    # برای هر نسخه، چرخش‌های 0/90/180/270 هم تولید می‌کنیم
-    final: List[Image.Image] = []
-    for v in variants:
-        for angle in (0, 90, 180, 270):
-            final.append(v.rotate(angle, expand=True))
-    return final
 
+def _engine_stat_key(engine: str, key: VariantKey) -> str:
+    return f"{engine}:{_stat_key(key)}"
 
-def _vision_client():
+
+def _read_stats_file() -> Dict[str, Dict[str, int]]:
+    """
+    {"vision:denoise:0": {"s": موفقیت، "a": تلاش}}؛ فرمت قدیمی (فقط تعداد موفقیت) با a = s و
+    کلیدهای قدیمی بدون موتور ("denoise:0") به‌عنوان آمار Vision خوانده می‌شوند.
+    """
+    try:
+        with open(STATS_PATH, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except Exception:
+        return {}
+    out: Dict[str, Dict[str, int]] = {}
+    for k, v in raw.items():
+        if k.count(":") == 1:
+            k = f"vision:{k}"
+        if isinstance(v, dict):
+            out[k] = {"s": int(v.get("s", 0)), "a": int(v.get("a", 0))}
+        else:
+            out[k] = {"s": int(v), "a": int(v)}
+    return out
+
+
+def _merged(base: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    out = {k: dict(v) for k, v in base.items()}
+    for k, d in _pending_stats.items():
+        cur = out.setdefault(k, {"s": 0, "a": 0})
+        cur["s"] += d["s"]
+        cur["a"] += d["a"]
+    return out
+
+
+def _load_stats() -> Dict[str, Dict[str, int]]:
+    """
+    نمای فعلی آمار (دیسک + pending این پروسه). با _stats_lock صدا زده شود.
+    """
+    global _variant_stats, _stats_loaded_at
+    if _variant_stats is None:
+        _variant_stats = _merged(_read_stats_file())
+        _stats_loaded_at = time.monotonic()
+    return _variant_stats
+
+
+@contextmanager
+def _stats_file_lock() -> Iterator[None]:
+    # قفل بین پروسه‌ها (در ویندوز fcntl نیست؛ آنجا فقط os.replace اتمیک)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{STATS_PATH}.lock", "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def flush_variant_stats() -> None:
+    """
+    شمارنده‌های pending را با نسخه‌ی فعلی دیسک merge و اتمیک ذخیره می‌کند؛ آمار پروسه‌های
+    دیگر هم هم‌زمان خوانده می‌شود. بدون pending فقط دوباره از دیسک خوانده می‌شود.
+    """
+    global _variant_stats, _stats_loaded_at
+    with _stats_lock:
+        try:
+            if not _pending_stats:
+                _variant_stats = _read_stats_file()
+            else:
+                with _stats_file_lock():
+                    merged = _merged(_read_stats_file())
+                    tmp = f"{STATS_PATH}.{os.getpid()}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(merged, f)
+                    os.replace(tmp, STATS_PATH)
+                _pending_stats.clear()
+                _variant_stats = merged
+        except Exception:
+            pass        # دفعه‌ی بعد دوباره؛ pending از دست نمی‌رود
+        _stats_loaded_at = time.monotonic()
+
+
+def _maybe_flush() -> None:
+    if time.monotonic() - _stats_loaded_at >= STATS_FLUSH_SECONDS:
+        flush_variant_stats()
+
+
+atexit.register(flush_variant_stats)
+
+
+def record_variant_result(key: VariantKey, success: bool, engine: str = "vision") -> None:
+    """
+    نتیجه‌ی OCR یک variant با موتور engine (کد داد یا نه) در حافظه؛ روی دیسک با flush دوره‌ای.
+    """
+    collected = _collected.get()
+    if collected is not None:
+        collected.append((engine, key, success))
+        return
+    sk = _engine_stat_key(engine, key)
+    with _stats_lock:
+        stats = _load_stats()
+        for d in (_pending_stats.setdefault(sk, {"s": 0, "a": 0}), stats.setdefault(sk, {"s": 0, "a": 0})):
+            d["a"] += 1
+            d["s"] += int(success)
+    _maybe_flush()
+
+
+@contextmanager
+def collect_variant_results() -> Iterator[List[Tuple[str, VariantKey, bool]]]:
+    """
+    برای کد اجراشده در process pool: timer و atexit در childهای spawn قابل اتکا نیستند، پس
+    record_variant_result داخل این بلوک فقط (engine, key, success) را جمع می‌کند و صدا زننده
+    لیست را به parent برمی‌گرداند تا همان‌جا با record_variant_result ثبت شود.
+    """
+    out: List[Tuple[str, VariantKey, bool]] = []
+    token = _collected.set(out)
+    try:
+        yield out
+    finally:
+        _collected.reset(token)
+
+
+def variant_order(engine: str = "vision") -> List[VariantKey]:
+    """
+    ترتیب امتحان variantها برای engine بر اساس نرخ موفقیت هموارشده (s+1)/(a+2): variantی که بارها
+    امتحان شده و جواب نداده عقب می‌رود و variant کم‌تجربه با 0.5 شروع می‌کند؛ در تساوی ترتیب پیش‌فرض.
+    """
+    _maybe_flush()
+    keys = [(f, a) for f in FILTERS for a in ANGLES]
+    with _stats_lock:
+        stats = {k: dict(v) for k, v in _load_stats().items()}
+
+    def rate(k: VariantKey) -> float:
+        st = stats.get(_engine_stat_key(engine, k), {"s": 0, "a": 0})
+        return (st["s"] + 1) / (st["a"] + 2)
+
+    # sorted پایدار است، پس در تساوی ترتیب پیش‌فرض حفظ می‌شود
+    return sorted(keys, key=lambda k: -rate(k))
+
+
+def _apply_filter(name: str, base_cv: np.ndarray) -> Image.Image:
+    if name == "denoise":
+        # حذف نویز + شارپ ملایم
+        den = cv2.bilateralFilter(base_cv, d=9, sigmaColor=75, sigmaSpace=75)
+        return _to_pil(den).filter(ImageFilter.UnsharpMask(radius=2, percent=120))
+
+    if name == "adaptive":
+        # grayscale + CLAHE + باینری تطبیقی
+        gray = cv2.cvtColor(base_cv, cv2.COLOR_BGR2GRAY)
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(gray)
+        adapt = cv2.adaptiveThreshold(
+            clahe, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 35, 11
+        )
+        return _to_pil(cv2.cvtColor(adapt, cv2.COLOR_GRAY2BGR))
+
+    if name == "contrast":
+        # افزایش کنتراست (Pillow) + شارپ
+        hi = ImageOps.autocontrast(_to_pil(base_cv), cutoff=2)
+        return hi.filter(ImageFilter.UnsharpMask(radius=1.4, percent=140))
+
+    if name == "invert":
+        # معکوس (گاهی متن تیره روی روشن بهتر می‌شود)
+        return ImageOps.invert(ImageOps.grayscale(_to_pil(base_cv))).convert("RGB")
+
+    raise ValueError(f"unknown filter: {name}")
+
+
+def _preprocess_variants(
+    img: Optional[Image.Image],
+    order: Optional[Iterable[VariantKey]] = None,
+    cache: Optional[Dict[str, object]] = None,
+) -> Iterator[Tuple[VariantKey, Image.Image]]:
+    """
+    نسخه‌های پیش‌پردازش را به‌صورت تنبل (generator) تولید می‌کند:
+    هر variant فقط وقتی ساخته می‌شود که قبلی جواب نداده باشد.
+    خروجی فیلترها کش می‌شود تا چرخش‌های یک فیلتر دوباره حساب نشوند؛
+    با پاس دادن cache مشترک، چند مرحله (مثلاً چند موتور OCR) روی یک عکس هم از آن استفاده می‌کنند.
+    img فقط وقتی لازم است که cache عکس پایه (_base) را نداشته باشد.
+    """
+    filtered: Dict[str, object] = cache if cache is not None else {}
+    keys = list(order if order is not None else variant_order())
+    if not keys:
+        return
+
+    base = _prepare_base(img, filtered)
+    for key in _orient_keys(keys, filtered["_horizontal"]):
+        name, angle = key
+        if name not in filtered:
+            t0 = time.perf_counter()
+            filtered[name] = _apply_filter(name, base)
+            _record_prep(name, time.perf_counter() - t0)
+        yield key, filtered[name].rotate(angle, expand=True)
+
+
+def _parse_credentials(creds_json: str):
+    """
+    GOOGLE_CREDENTIALS_JSON می‌تواند متن JSON یا مسیر فایل باشد.
+    (به‌جای eval: اول json، بعد literal_eval برای مقادیر قدیمی به شکل dict پایتونی)
+    """
+    from google.oauth2.service_account import Credentials
+
+    if os.path.isfile(creds_json):
+        return Credentials.from_service_account_file(creds_json)
+    try:
+        info = json.loads(creds_json)
+    except ValueError:
+        info = ast.literal_eval(creds_json)
+    return Credentials.from_service_account_info(info)
+
+
+def _build_vision_client():
     """
     اگر کرِدنتیال گوگل نبود یا کتابخانه نصب نبود، None برمی‌گرداند.
+    با OCR_VISION_STUB=1 کلاینت جعلی محلی (vision_stub) برمی‌گردد.
     """
+    if os.getenv("OCR_VISION_STUB") == "1":
+        from .vision_stub import FakeVisionClient
+        return FakeVisionClient.from_env()
+
     creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
     if not creds_json:
         return None
 
     try:
-        from google.oauth2.service_account import Credentials
         from google.cloud import vision
     except Exception:
         return None
 
     try:
-        creds = Credentials.from_service_account_info(eval(creds_json))
-        client = vision.ImageAnnotatorClient(credentials=creds)
-        return client
+        return vision.ImageAnnotatorClient(credentials=_parse_credentials(creds_json))
     except Exception:
-        # اگر JSON با eval مشکل داشت، تلاش با from_service_account_file
-        try:
-            if os.path.isfile(creds_json):
-                from google.oauth2.service_account import Credentials
-                from google.cloud import vision
+        return None
+
+
+class VisionClientManager:
+    """
+    یک کلاینت Vision برای کل پروسه (هر worker). در startup ساخته می‌شود،
+    بین درخواست‌ها reuse می‌شود و فقط بعد از چند خطای پشت‌سرهم دوباره ساخته می‌شود.
+    """
+
+    def __init__(self, max_failures: int = 3):
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._client = None
+        self._consecutive_failures = 0
+        self.builds = 0
+        self.reuses = 0
+        self.failures = 0
+        self.last_init_seconds = 0.0
+        self.total_init_seconds = 0.0
+
+    def get(self):
+        with self._lock:
+            if self._client is not None:
+                self.reuses += 1
+                return self._client
+            t0 = time.perf_counter()
+            self._client = _build_vision_client()
+            elapsed = time.perf_counter() - t0
+            if self._client is not None:
+                self.builds += 1
+                self.last_init_seconds = elapsed
+                self.total_init_seconds += elapsed
+                self._consecutive_failures = 0
+            return self._client
+
+    def report_success(self) -> None:
+        self._consecutive_failures = 0
+
+    def report_failure(self) -> None:
+        """
+        خطای کانال (UNAVAILABLE / اتصال reset؛ نه سهمیه یا timeout). بعد از max_failures خطای پشت‌سرهم، کلاینت کنار گذاشته
+        می‌شود تا get بعدی کانال تازه بسازد.
+        """
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.max_failures:
+                self._client = None
+                self._consecutive_failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self._client is not None and self._consecutive_failures < self.max_failures
+
+    def reset(self) -> None:
+        with self._lock:
+            self._client = None
+            self._consecutive_failures = 0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "ready": self._client is not None,
+            "healthy": self.healthy,
+            "builds": self.builds,
+            "reuses": self.reuses,
+            "failures": self.failures,
+            "last_init_seconds": round(self.last_init_seconds, 4),
+            "total_init_seconds": round(self.total_init_seconds, 4),
+        }
+
+
+vision_clients = VisionClientManager(max_failures=int(os.getenv("OCR_CLIENT_MAX_FAILURES", "3")))
+
+
+def _vision_client():
+    return vision_clients.get()
+
+
+def warm_vision_client() -> bool:
+    """
+    در startup هر worker صدا زده می‌شود (بعد از fork، چون کانال gRPC fork-safe نیست).
+    """
+    return vision_clients.get() is not None
+
+
+# ========= اندازه‌ی آپلود و آمار =========
+OCR_UPLOAD_TARGET_BYTES = int(os.getenv("OCR_UPLOAD_TARGET_BYTES", "300000"))
+OCR_UPLOAD_MIN_SIDE = int(os.getenv("OCR_UPLOAD_MIN_SIDE", "1024"))   # کمتر از این، دقت متن ریز افت می‌کند
+
+_upload_lock = threading.Lock()
+_upload_stats: Dict[str, float] = {"images": 0, "bytes": 0, "rpc_seconds": 0.0, "encode_seconds": 0.0}
+_prep_seconds: Dict[str, float] = {}
+
+
+def _record_prep(name: str, seconds: float) -> None:
+    with _upload_lock:
+        _prep_seconds[name] = _prep_seconds.get(name, 0.0) + seconds
+    observe_stage(f"prep_{name}", seconds)
 
-                creds = Credentials.from_service_account_file(creds_json)
-                client = vision.ImageAnnotatorClient(credentials=creds)
-                return client
-        except Exception:
-            return None
-    return None
+
+def _record_upload(n_images: int, n_bytes: int, rpc_seconds: float) -> None:
+    with _upload_lock:
+        _upload_stats["images"] += n_images
+        _upload_stats["bytes"] += n_bytes
+        _upload_stats["rpc_seconds"] += rpc_seconds
+    observe_stage("vision_rpc", rpc_seconds)
+
+
+def _encode_jpeg(pil_img: Image.Image) -> bytes:
+    """
+    JPEG با کیفیت/اندازه‌ی تطبیقی: اول کیفیت پایین می‌آید، بعد ابعاد،
+    تا حجم به OCR_UPLOAD_TARGET_BYTES برسد (بدون کوچک‌تر شدن از OCR_UPLOAD_MIN_SIDE).
+    variantهای خاکستری تک‌کاناله ذخیره می‌شوند.
+    """
+    t0 = time.perf_counter()
+    img = pil_img
+    if img.mode == "RGB" and _is_grayscale(img):
+        img = img.convert("L")
+
+    content = b""
+    while True:
+        for quality in (90, 80, 70):
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=quality, optimize=True)
+            content = buf.getvalue()
+            if len(content) <= OCR_UPLOAD_TARGET_BYTES:
+                break
+        if len(content) <= OCR_UPLOAD_TARGET_BYTES or max(img.size) * 0.8 < OCR_UPLOAD_MIN_SIDE:
+            break
+        img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.LANCZOS)
+
+    with _upload_lock:
+        _upload_stats["encode_seconds"] += time.perf_counter() - t0
+    return content
+
+
+def _is_grayscale(img: Image.Image) -> bool:
+    small = img.resize((32, 32))
+    r, g, b = small.split()
+    return r.tobytes() == g.tobytes() == b.tobytes()
+
+
+def _check_transient(resp) -> None:
+    """
+    خطای گذرای داخل پاسخ (مثلاً RESOURCE_EXHAUSTED برای یک تصویر) مثل خطای RPC retry شود.
+    """
+    if resp.error.message and getattr(resp.error, "code", 0) in TRANSIENT_CODES:
+        raise TransientVisionError(resp.error.message)
 
 
 def _vision_ocr(client, pil_img: Image.Image) -> str:
     """
-    OCR با Google Vision (full text). اگر خطا بده خالی برمی‌گردد.
+    OCR با Google Vision (full text). خطای دائمی (مثلاً تصویر نامعتبر) متن خالی؛
+    خطای گذرا بعد از retry، breaker باز یا بودجه‌ی تمام‌شده VisionUnavailable (vision_governor).
+    """
+    return _vision_ocr_bytes(client, _encode_jpeg(pil_img))
+
+
+def _vision_ocr_bytes(client, content: bytes) -> str:
+    """
+    مثل _vision_ocr ولی با بایت‌های JPEG آماده (مثلاً ساخته‌شده در process pool).
     """
     try:
         from google.cloud import vision  # type: ignore
     except Exception:
         return ""
 
-    try:
-        buf = io.BytesIO()
-        pil_img.save(buf, format="JPEG", quality=95)
-        content = buf.getvalue()
+    image = vision.Image(content=content)
 
-        image = vision.Image(content=content)
-        resp = client.document_text_detection(image=image)  # برای متن‌های بلاکی بهتر از text_detection
-        if resp.error.message:
-            return ""
+    def rpc(timeout: float):
+        t0 = time.perf_counter()
+        # retry داخلی کتابخانه خاموش: retry و timeout فقط با governor
+        resp = client.document_text_detection(image=image, retry=None, timeout=timeout)  # برای متن‌های بلاکی بهتر از text_detection
+        _record_upload(1, len(content), time.perf_counter() - t0)
+        _check_transient(resp)
+        return resp
 
-        if resp.full_text_annotation and resp.full_text_annotation.text:
-            return resp.full_text_annotation.text
-        return ""
+    try:
+        resp = vision_governor.call(rpc, on_channel_error=vision_clients.report_failure)
+    except VisionUnavailable:
+        raise
     except Exception:
         return ""
+    vision_clients.report_success()
+    if resp.error.message:
+        return ""
+    if resp.full_text_annotation and resp.full_text_annotation.text:
+        return resp.full_text_annotation.text
+    return ""
+
+
+def _vision_batch_ocr(client, pil_imgs: List[Image.Image]) -> List[str]:
+    """
+    چند تصویر را در یک batch_annotate_images می‌فرستد.
+    خروجی هم‌ترتیب ورودی است؛ برای تصویرهای خطادار رشته‌ی خالی.
+    خطای گذرا (حتی برای یک تصویر) کل batch را retry می‌کند و در نهایت VisionUnavailable می‌شود.
+    """
+    if not pil_imgs:
+        return []
+    try:
+        from google.cloud import vision  # type: ignore
+    except Exception:
+        return [""] * len(pil_imgs)
+
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    contents = [_encode_jpeg(im) for im in pil_imgs]
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=c), features=[feature])
+        for c in contents
+    ]
+
+    def rpc(timeout: float):
+        t0 = time.perf_counter()
+        batch = client.batch_annotate_images(requests=requests, retry=None, timeout=timeout)
+        _record_upload(len(contents), sum(len(c) for c in contents), time.perf_counter() - t0)
+        for resp in batch.responses:
+            _check_transient(resp)
+        return batch
+
+    try:
+        batch = vision_governor.call(rpc, on_channel_error=vision_clients.report_failure)
+    except VisionUnavailable:
+        raise
+    except Exception:
+        return [""] * len(pil_imgs)
+    vision_clients.report_success()
+
+    texts: List[str] = []
+    for resp in batch.responses:
+        if resp.error.message or not (resp.full_text_annotation and resp.full_text_annotation.text):
+            texts.append("")
+        else:
+            texts.append(resp.full_text_annotation.text)
+    # اگر تعداد پاسخ‌ها کمتر بود، بقیه خالی
+    texts.extend([""] * (len(pil_imgs) - len(texts)))
+    return texts
 
 
 def _pick_code(text: str) -> Optional[str]:
@@ -172,27 +688,147 @@ def _pick_code(text: str) -> Optional[str]:
     return None
 
 
-def detect_code_from_image(image_path: str) -> Optional[str]:
+def detect_code_detail(image_path: str) -> OcrResult:
     """
-    ورودی: مسیر فایل عکس
-    خروجی: رشته‌ی کد کشف‌شده (مثلاً JTE… یا AJA… یا عدد بلند) یا None
+    مثل detect_code_from_image ولی variant برنده و تعداد variantهای امتحان‌شده را هم برمی‌گرداند.
     """
     try:
         original = _load_image(image_path)
     except Exception:
-        return None
+        return OcrResult()
 
-    variants = _preprocess_variants(original)
     client = _vision_client()
     if client is None:
         # بدون کرِدنتیال/کتابخانه نمی‌توان OCR گرفت
-        return None
+        return OcrResult()
+
+    # از اولین کد معتبر برگرد (variantهای بعدی اصلاً ساخته نمی‌شوند)
+    tried = 0
+    with vision_budget():
+        for key, v in _preprocess_variants(original):
+            tried += 1
+            try:
+                text = _vision_ocr(client, v)
+            except VisionUnavailable as e:
+                # بقیه‌ی variantها هم به همان Vision می‌روند: نتیجه‌ی ناقص، نه «کد نیست»
+                return OcrResult(variants_tried=tried, error=e.reason)
+            code = _pick_code(text)
+            record_variant_result(key, code is not None)
+            if code:
+                return OcrResult(code=code, variant=_stat_key(key), variants_tried=tried, engine="vision")
+
+    return OcrResult(variants_tried=tried)
+
+
+def render_prepared(prepared: Dict[str, object], keys: List[VariantKey]) -> List[Tuple[VariantKey, bytes]]:
+    """
+    variantهای خواسته‌شده را از عکس پایه‌ی آماده (cache با _base و _horizontal) می‌سازد و JPEG
+    می‌کند؛ عکس دوباره لود و resize/layout دوباره حساب نمی‌شود. سطح ماژول است تا در
+    ProcessPoolExecutor قابل pickle باشد (کار CPU-bound پیش‌پردازش).
+    """
+    return [(key, _encode_jpeg(v)) for key, v in _preprocess_variants(None, keys, dict(prepared))]
 
-    # از اولین کد معتبر برگرد
-    for v in variants:
-        text = _vision_ocr(client, v)
-        code = _pick_code(text)
-        if code:
-            return code
 
-    return None
+def detect_code_from_image(image_path: str) -> Optional[str]:
+    """
+    ورودی: مسیر فایل عکس
+    خروجی: رشته‌ی کد کشف‌شده (مثلاً JTE… یا AJA… یا عدد بلند) یا None
+    """
+    return detect_code_detail(image_path).code
+
+
+# ========= حالت batch (گروه‌بندی variantها و فایل‌ها) =========
+OCR_BACKEND = os.getenv("OCR_BACKEND", "single")              # single | batch
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "16"))        # سقف Vision برای هر batch_annotate_images
+OCR_BATCH_VARIANTS_PER_FILE = int(os.getenv("OCR_BATCH_VARIANTS_PER_FILE", "4"))
+
+
+def detect_codes_batch_detail(image_paths: List[str], batch_size: Optional[int] = None) -> List[OcrResult]:
+    """
+    نسخه‌ی دسته‌ای detect_code_from_image برای چند فایل.
+    در هر دور از هر فایلِ حل‌نشده چند variant بعدی (به ترتیب آماری) برداشته می‌شود،
+    در batchهایی با اندازه‌ی batch_size فرستاده می‌شود و پاسخ‌ها به فایل‌ها برمی‌گردند.
+    فایلی که کد گرفت از دورهای بعد کنار می‌رود، پس variantهای بعدی‌اش ساخته نمی‌شوند.
+    خروجی هم‌ترتیب image_paths است.
+    """
+    size = max(1, batch_size or OCR_BATCH_SIZE)
+    results: List[OcrResult] = [OcrResult() for _ in image_paths]
+
+    client = _vision_client()
+    if client is None:
+        return results
+
+    order = variant_order()
+    gens: Dict[int, Iterator[Tuple[VariantKey, Image.Image]]] = {}
+    for i, path in enumerate(image_paths):
+        try:
+            gens[i] = _preprocess_variants(_load_image(path), order)
+        except Exception:
+            continue
+
+    while gens:
+        # تعداد variant از هر فایل در این دور: batch را پر کن ولی تنبلی را حفظ کن
+        per_file = max(1, min(OCR_BATCH_VARIANTS_PER_FILE, size // len(gens)))
+        items: List[Tuple[int, VariantKey, Image.Image]] = []
+        for i in list(gens):
+            for _ in range(per_file):
+                try:
+                    key, v = next(gens[i])
+                except StopIteration:
+                    del gens[i]
+                    break
+                items.append((i, key, v))
+        if not items:
+            break
+
+        texts: List[str] = []
+        try:
+            for start in range(0, len(items), size):
+                chunk = items[start:start + size]
+                with vision_budget():       # بودجه‌ی هر batch (با retryها)
+                    texts.extend(_vision_batch_ocr(client, [v for _, _, v in chunk]))
+        except VisionUnavailable as e:
+            # پاسخ‌های batchهای قبلی این دور هنوز اعمال می‌شوند؛ بقیه‌ی فایل‌ها ناقص می‌مانند
+            for i, _, _ in items[len(texts):]:
+                results[i].error = e.reason
+            items = items[:len(texts)]
+            gens.clear()
+
+        # اولین variant موفق هر فایل (به ترتیب) برنده است
+        for (i, key, _), text in zip(items, texts):
+            if results[i].code is not None:
+                continue
+            results[i].variants_tried += 1
+            code = _pick_code(text)
+            record_variant_result(key, code is not None)
+            if code:
+                results[i] = OcrResult(code=code, variant=_stat_key(key),
+                                       variants_tried=results[i].variants_tried, engine="vision")
+                gens.pop(i, None)
+
+    return results
+
+
+def detect_codes_batch(image_paths: List[str], batch_size: Optional[int] = None) -> List[Optional[str]]:
+    return [r.code for r in detect_codes_batch_detail(image_paths, batch_size)]
+
+
+def ocr_stats() -> Dict[str, object]:
+    """
+    آمار OCR برای مانیتورینگ: وضعیت کلاینت Vision و آمار تلاش/موفقیت variantها.
+    """
+    with _stats_lock:
+        variants = {k: dict(v) for k, v in _load_stats().items()}
+    with _upload_lock:
+        up = dict(_upload_stats)
+        prep = {k: round(v, 4) for k, v in _prep_seconds.items()}
+    n = up["images"] or 1
+    upload = {
+        "images": int(up["images"]),
+        "bytes": int(up["bytes"]),
+        "avg_bytes_per_image": int(up["bytes"] / n),
+        "avg_rpc_seconds_per_image": round(up["rpc_seconds"] / n, 4),
+        "encode_seconds": round(up["encode_seconds"], 4),
+    }
+    return {"vision_client": vision_clients.stats(), "vision_governor": vision_governor.stats(),
+            "variant_stats": variants, "vision_upload": upload, "preprocess_seconds": prep}
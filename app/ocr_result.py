@@ -0,0 +1,16 @@
+# app/ocr_result.py
+"""
+نتیجه‌ی OCR، جدا از ocr_google تا ماژول‌هایی که فقط با نتیجه کار دارند
+(ingest، کش OCR) OpenCV/NumPy را import نکنند.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class OcrResult:
+    code: Optional[str] = None
+    variant: Optional[str] = None      # variant برنده به شکل "filter:angle"
+    variants_tried: int = 0
+    engine: Optional[str] = None       # موتوری که جواب داد (vision / cache / ...)
+    error: Optional[str] = None        # Vision در دسترس نبود (circuit_open / deadline / ...): نتیجه‌ی ناقص، نه «کد نیست»
@@ -0,0 +1,188 @@
+# app/order_cache.py
+"""
+کش داخل پروسه برای جست‌وجوی سفارش با کد یا alias (مسیر پرترافیک /track و /u/{code}).
+
+- مقدار: snapshot فقط‌خواندنی سفارش (یا None برای NOT_FOUND با TTL کوتاه‌تر)
+- invalidation خودکار: هر commit که Order یا OrderAlias را تغییر دهد (از هر endpoint
+  یا job) کلیدهای مربوط را بعد از commit پاک می‌کند. تغییرات Core (بدون ORM) باید
+  خودشان invalidate_order / invalidate_key را صدا بزنند.
+- بین workerها فقط TTL کهنگی را محدود می‌کند.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from .deps import settings
+from .models import Order, OrderAlias
+from .orders import resolve_order_by_any_code, resolve_orders_by_any_codes
+
+
+@dataclass(frozen=True)
+class OrderSnapshot:
+    id: int
+    code: str
+    status: str
+    image_path: Optional[str]
+    updated_at: datetime
+
+    @classmethod
+    def of(cls, o: Order) -> "OrderSnapshot":
+        return cls(id=o.id, code=o.code, status=o.status, image_path=o.image_path, updated_at=o.updated_at)
+
+
+class OrderLookupCache:
+    def __init__(self, size: int, ttl: float, negative_ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key (کد جست‌وجو‌شده) → (snapshot یا None، زمان انقضا)
+        self._data: "OrderedDict[str, Tuple[Optional[OrderSnapshot], float]]" = OrderedDict()
+        # کد سفارش → کلیدهایی که به آن اشاره می‌کنند (برای invalidate)
+        self._by_order: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Optional[OrderSnapshot]]:
+        now = time.monotonic()
+        with self._lock:
+            e = self._data.get(key)
+            if e is None or e[1] < now:
+                if e is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, e[0]
+
+    def put(self, key: str, snap: Optional[OrderSnapshot]) -> None:
+        ttl = self.ttl if snap is not None else self.negative_ttl
+        if ttl <= 0 or self.size <= 0:
+            return
+        with self._lock:
+            self._drop(key)
+            self._data[key] = (snap, time.monotonic() + ttl)
+            if snap is not None:
+                self._by_order.setdefault(snap.code, set()).add(key)
+            while len(self._data) > self.size:
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: str) -> None:
+        e = self._data.pop(key, None)
+        if e is not None and e[0] is not None:
+            keys = self._by_order.get(e[0].code)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_order[e[0].code]
+
+    def invalidate_key(self, key: str) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def invalidate_order(self, order_code: str) -> None:
+        """
+        همه‌ی کلیدهای این سفارش (کد مستقیم و aliasها) + ورودی NOT_FOUND خود کد.
+        """
+        with self._lock:
+            for key in list(self._by_order.get(order_code, ())):
+                self._drop(key)
+            self._drop(order_code)
+
+    def invalidate_orders(self, order_codes: Iterable[str]) -> None:
+        for c in order_codes:
+            self.invalidate_order(c)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._by_order.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+order_cache = OrderLookupCache(
+    size=settings.ORDER_CACHE_SIZE,
+    ttl=settings.ORDER_CACHE_TTL_SECONDS,
+    negative_ttl=settings.ORDER_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+
+def lookup_order_snapshot(code: str, session: Session) -> Optional[OrderSnapshot]:
+    """
+    مثل resolve_order_by_any_code ولی از کش؛ فقط برای مسیرهای خواندنی.
+    """
+    code = (code or "").strip().upper()
+    if not code:
+        return None
+    hit, snap = order_cache.get(code)
+    if hit:
+        return snap
+    o = resolve_order_by_any_code(code, session)
+    snap = OrderSnapshot.of(o) if o else None
+    order_cache.put(code, snap)
+    return snap
+
+
+def lookup_order_snapshots(codes: List[str], session: Session) -> Dict[str, Optional[OrderSnapshot]]:
+    """
+    نسخه‌ی دسته‌ای: از کش، و missها با resolve_orders_by_any_codes (تعداد کوئری ثابت).
+    """
+    out: Dict[str, Optional[OrderSnapshot]] = {}
+    misses: List[str] = []
+    for code in codes:
+        code = (code or "").strip().upper()
+        if not code or code in out:
+            continue
+        hit, snap = order_cache.get(code)
+        out[code] = snap
+        if not hit:
+            misses.append(code)
+    if misses:
+        found = resolve_orders_by_any_codes(misses, session)
+        for code in misses:
+            o = found.get(code)
+            snap = OrderSnapshot.of(o) if o else None
+            order_cache.put(code, snap)
+            out[code] = snap
+    return out
+
+
+# ---------- invalidation بعد از commit ----------
+_PENDING = "order_cache_pending"
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault(_PENDING, (set(), set()))
+    orders, keys = pending
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Order):
+            orders.add(obj.code)
+        elif isinstance(obj, OrderAlias):
+            orders.add(obj.order_code)
+            keys.add(obj.alias_code)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_committed(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        orders, keys = pending
+        order_cache.invalidate_orders(orders)
+        for k in keys:
+            order_cache.invalidate_key(k)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,151 @@
+# app/orders.py
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import case, func, or_, tuple_, update
+from sqlmodel import Session, select
+
+from .deps import begin_write
+from .metrics import stage
+from .models import Order, OrderAlias, OrderStatus
+from .status_log import record_status_changes
+
+# سقف id در هر UPDATE ... WHERE id IN (...) (زیر سقف پارامترهای SQLite)
+_UPDATE_CHUNK = 500
+
+VALID_STATUSES = (
+    OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB,
+    OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH,
+)
+
+
+def coerce_status(status: Optional[str], default: str = OrderStatus.ARRIVED_DXB) -> str:
+    """
+    وضعیت نامعتبر/خالی را به پیش‌فرض برمی‌گرداند.
+    """
+    return status if status in VALID_STATUSES else default
+
+
+def resolve_order_by_any_code(code: str, session: Session) -> Optional[Order]:
+    """
+    تلاش می‌کند با خودِ کد یا از طریق alias سفارش را بیابد (یک کوئری).
+    اگر هم کد مستقیم و هم alias جواب بدهند، کد مستقیم اولویت دارد.
+    """
+    code = (code or "").strip().upper()
+    if not code:
+        return None
+    via_alias = select(OrderAlias.order_code).where(OrderAlias.alias_code == code)
+    with stage("resolve_order"):
+        return session.exec(
+            select(Order)
+            .where(or_(Order.code == code, Order.code.in_(via_alias)))
+            .order_by(case((Order.code == code, 0), else_=1))
+            .limit(1)
+        ).first()
+
+
+def resolve_orders_by_any_codes(codes: List[str], session: Session, chunk: int = 500) -> Dict[str, Order]:
+    """
+    نسخه‌ی دسته‌ای resolve_order_by_any_code: برای هر chunk حداکثر دو کوئری
+    (IN روی Order.code، سپس join از OrderAlias برای باقی‌مانده‌ها). کد مستقیم اولویت دارد.
+    کلید خروجی همان کد نرمال‌شده‌ی ورودی است؛ کدهای پیدا‌نشده در خروجی نیستند.
+    """
+    wanted = list(dict.fromkeys(c.strip().upper() for c in codes if c and c.strip()))
+    found: Dict[str, Order] = {}
+    for start in range(0, len(wanted), chunk):
+        part = wanted[start:start + chunk]
+        for o in session.exec(select(Order).where(Order.code.in_(part))):
+            found[o.code] = o
+        rest = [c for c in part if c not in found]
+        if rest:
+            rows = session.exec(
+                select(OrderAlias.alias_code, Order)
+                .join(Order, Order.code == OrderAlias.order_code)
+                .where(OrderAlias.alias_code.in_(rest))
+            )
+            for alias_code, o in rows:
+                found[alias_code] = o
+    return found
+
+
+def _range_filter(start_dt: datetime, end_dt: datetime, excludes: Set[str]) -> list:
+    where = [Order.created_at >= start_dt, Order.created_at <= end_dt]
+    if excludes:
+        where.append(Order.code.not_in(excludes))
+    return where
+
+
+def count_in_range(session: Session, start_dt: datetime, end_dt: datetime, excludes: Set[str]) -> Dict[str, int]:
+    """
+    تعداد سفارش‌های بازه به تفکیک وضعیت فعلی (برای dry-run؛ از ایندکس created_at,status).
+    """
+    rows = session.exec(
+        select(Order.status, func.count())
+        .where(*_range_filter(start_dt, end_dt, excludes))
+        .group_by(Order.status)
+    ).all()
+    return {status: n for status, n in rows}
+
+
+def bulk_set_status(session: Session, start_dt: datetime, end_dt: datetime,
+                    excludes: Set[str], new_status: str) -> List[str]:
+    """
+    UPDATE مجموعه‌ای روی بازه‌ی created_at (به‌جای لود ORM)؛ کدهای تغییرکرده را برمی‌گرداند.
+    وضعیت قبلی (برای تاریخچه و شمارش‌ها) در همان تراکنش نوشتن و قبل از UPDATE خوانده می‌شود
+    (RETURNING فقط مقدار جدید را دارد) و UPDATE دقیقاً همان ردیف‌ها (با id) را تغییر می‌دهد؛
+    پس تغییر هم‌زمان بین خواندن و نوشتن شمارش‌ها را خراب نمی‌کند. commit با صدا زننده است.
+    """
+    where = _range_filter(start_dt, end_dt, excludes)
+    now = datetime.utcnow()
+    begin_write(session)
+    before = session.execute(select(Order.id, Order.code, Order.status).where(*where).with_for_update()).all()
+    ids = [order_id for order_id, _, _ in before]
+    for i in range(0, len(ids), _UPDATE_CHUNK):
+        session.execute(
+            update(Order).where(Order.id.in_(ids[i:i + _UPDATE_CHUNK]))
+            .values(status=new_status, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    record_status_changes(session, ((code, old, new_status) for _, code, old in before), "bulk", now)
+    return [code for _, code, _ in before]
+
+
+# ---------- فهرست ادمین (keyset) ----------
+def encode_cursor(updated_at: datetime, order_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{order_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    ValueError برای cursor نامعتبر.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, _, order_id = raw.partition("|")
+        return datetime.fromisoformat(ts), int(order_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def list_orders(session: Session, status: Optional[str] = None, updated_from: Optional[datetime] = None,
+                updated_to: Optional[datetime] = None, limit: int = 50,
+                cursor: Optional[str] = None) -> Tuple[List[Order], Optional[str]]:
+    """
+    جدیدترین تغییر اول (updated_at, id نزولی). صفحه‌ی بعد با cursor خروجی؛ هر صفحه فقط
+    یک range scan روی ایندکس (status, updated_at, id) یا (updated_at, id)، بدون OFFSET.
+    """
+    q = select(Order)
+    if status:
+        q = q.where(Order.status == status)
+    if updated_from:
+        q = q.where(Order.updated_at >= updated_from)
+    if updated_to:
+        q = q.where(Order.updated_at < updated_to)
+    if cursor:
+        q = q.where(tuple_(Order.updated_at, Order.id) < tuple_(*decode_cursor(cursor)))
+    rows = session.exec(q.order_by(Order.updated_at.desc(), Order.id.desc()).limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return list(rows), None
+    last = rows[limit - 1]
+    return list(rows[:limit]), encode_cursor(last.updated_at, last.id)
@@ -0,0 +1,173 @@
+# app/parallel_ingest.py
+"""
+مسیر موازی آپلود گروهی:
+- پیش‌پردازش CPU-bound (موتورهای محلی، ساخت variantها + JPEG) در ProcessPoolExecutor به اندازه‌ی هسته‌ها
+- درخواست‌های Vision هم‌زمان با سقف UPLOAD_VISION_CONCURRENCY (و سقف کل worker در vision_governor)
+- نتیجه‌ی هر فایل به‌محض آماده شدن به‌صورت NDJSON استریم می‌شود
+- هر فایل در تراکنش کوتاه خودش (session جدا + commit) در threadpool؛ تراکنش نوشتن هیچ‌وقت
+  روی await باز نمی‌ماند و SQLite برای درخواست‌های دیگر قفل نمی‌شود
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from .deps import engine, settings
+from .ingest import apply_code
+from .metrics import record_ocr, stage
+from .ocr_cache import cache_keys, ocr_cache
+from .ocr_result import OcrResult
+
+_proc_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _cpu_pool() -> ProcessPoolExecutor:
+    global _proc_pool
+    if _proc_pool is None:
+        workers = settings.UPLOAD_CPU_WORKERS or os.cpu_count() or 1
+        # spawn: پروسه‌ی اصلی thread و کانال gRPC دارد و fork امن نیست
+        _proc_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _proc_pool
+
+
+def shutdown_cpu_pool() -> None:
+    global _proc_pool
+    if _proc_pool is not None:
+        _proc_pool.shutdown(wait=False, cancel_futures=True)
+        _proc_pool = None
+
+
+async def _in_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    اجرای fn در process pool. اگر worker مرد (OOM، crash در OpenCV) pool شکسته کنار گذاشته و
+    از نو ساخته می‌شود و همین کار یک‌بار دیگر در یک پروسه‌ی جدا اجرا می‌شود؛ پس فایل خراب
+    فقط خودش شکست می‌خورد و فایل‌هایی که هم‌زمان در همان pool بودند دوباره اجرا می‌شوند.
+    """
+    global _proc_pool
+    loop = asyncio.get_running_loop()
+    pool = _cpu_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # فقط همان pool شکسته؛ pool تازه‌ای که task دیگری ساخته دست نمی‌خورد
+        if _proc_pool is pool:
+            _proc_pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+    isolated = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        return await loop.run_in_executor(isolated, fn, *args)
+    finally:
+        isolated.shutdown(wait=False)
+
+
+async def _detect(dest: str, vision_sem: asyncio.Semaphore, content_hash: Optional[str] = None) -> OcrResult:
+    """
+    OCR یک فایل با همان cascade در ocr_engines: کش → موتورهای محلی در process pool (عکس یک‌بار
+    لود و پایه‌ی variantها همان‌جا آماده می‌شود) → variantهای Vision به‌صورت چند‌تایی از همان
+    پایه در process pool و فراخوانی Vision، تا اولین کد معتبر.
+    """
+    # OpenCV/Vision فقط با اولین OCR لود می‌شوند
+    from .ocr_engines import ENGINES, configured_engines, detect_code_local_prepared
+    from .ocr_google import _vision_client, _vision_ocr_bytes, record_variant_result, render_prepared
+    from .vision_governor import VisionUnavailable, vision_budget
+
+    key = phash = None
+    if settings.OCR_CACHE_ENABLED:
+        key, phash = await run_in_threadpool(cache_keys, dest, content_hash)
+        hit = await run_in_threadpool(ocr_cache.get, key, phash)
+        if hit is not None:
+            return hit
+
+    vision = ENGINES["vision"]
+    client = _vision_client() if vision in configured_engines() else None
+    result, prepared, outcomes = await _in_pool(detect_code_local_prepared, dest, client is not None)
+    # آمار variantهای Tesseract در parent ثبت می‌شود (child آن را flush نمی‌کند)
+    for engine_name, vkey, ok in outcomes:
+        record_variant_result(vkey, ok, engine_name)
+    if prepared is not None:
+        keys = vision.prepared_keys(prepared)
+        chunk = max(1, settings.UPLOAD_PREP_CHUNK)
+        tried = result.variants_tried
+        # بودجه در contextvar است و با run_in_threadpool به thread فراخوانی Vision می‌رسد
+        with vision_budget():
+            for start in range(0, len(keys), chunk):
+                for vkey, content in await _in_pool(render_prepared, prepared, keys[start:start + chunk]):
+                    tried += 1
+                    try:
+                        async with vision_sem:
+                            text = await run_in_threadpool(_vision_ocr_bytes, client, content)
+                    except VisionUnavailable as e:
+                        result = OcrResult(variants_tried=tried, error=e.reason)
+                        break
+                    hit = vision.hit(vkey, text, tried)
+                    if hit is not None:
+                        result = hit
+                        break
+                if result.code or result.error:
+                    break
+            else:
+                result.variants_tried = tried
+
+    if key is not None:
+        await run_in_threadpool(ocr_cache.put, key, result, phash)
+    return result
+
+
+async def stream_upload_results(items: List[dict], status: Optional[str]) -> AsyncIterator[str]:
+    """
+    items: خروجی مرحله‌ی ذخیره (file, dest, image, code یا error).
+    هر خط NDJSON نتیجه‌ی یک فایل است؛ خط آخر summary.
+    """
+    vision_sem = asyncio.Semaphore(max(1, settings.UPLOAD_VISION_CONCURRENCY))
+
+    async def run(it: dict) -> dict:
+        if "error" not in it and not it["code"]:
+            try:
+                with stage("ocr"):
+                    r = await _detect(it["dest"], vision_sem, it.get("hash"))
+                record_ocr(r)
+                it["code"], it["engine"], it["ocr_error"] = r.code, r.engine, r.error
+            except Exception as e:
+                it["error"] = str(e)
+        return it
+
+    tasks = [asyncio.create_task(run(it)) for it in items]
+    results = []
+    try:
+        for fut in asyncio.as_completed(tasks):
+            it = await fut
+            if "error" in it:
+                r = {"file": it["file"], "ok": False, "error": it["error"]}
+            else:
+                try:
+                    r = {"file": it["file"], **await run_in_threadpool(_apply_one, it, status)}
+                except Exception as e:
+                    r = {"file": it["file"], "ok": False, "error": str(e)}
+            results.append(r)
+            yield json.dumps(r, ensure_ascii=False) + "\n"
+
+        summary = {
+            "total": len(items),
+            "succeeded": sum(1 for r in results if r.get("ok")),
+            "needs_review": sum(1 for r in results if r.get("needs_review")),
+        }
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+def _apply_one(it: dict, status: Optional[str]) -> dict:
+    """
+    اعمال نتیجه‌ی یک فایل در تراکنش کوتاه خودش (داخل threadpool، بدون await در میانه).
+    """
+    with Session(engine) as session:
+        r = apply_code(session, it["code"], it["image"], status, it["engine"], it["file"], it.get("ocr_error"))
+        session.commit()
+    return r
@@ -0,0 +1,89 @@
+# app/review.py
+"""
+صف ماندگار needs-review: عکس‌هایی که ingest آن‌ها به سفارشی نرسید در ReviewItem ثبت می‌شوند.
+
+- هر عکس (مسیر content-addressed) حداکثر یک آیتم PENDING دارد؛ آپلود دوباره همان را به‌روز می‌کند
+- وقتی کد یا alias جدیدی ثبت می‌شود (create_order، create_alias، manual-attach، import)
+  آیتم‌های PENDING با دقیقاً همان detected_code (کدها همه با حروف بزرگ ذخیره می‌شوند) بدون OCR دوباره به سفارش وصل می‌شوند؛
+  تطبیق fuzzy (O/0، I/1) اینجا نیست چون بدون بررسی یکتایی ممکن است عکس را به سفارش اشتباه بدهد
+- commit همیشه با صدا زننده است
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, select
+
+from .models import Order, ReviewItem, ReviewState
+from .orders import coerce_status
+from .status_log import status_source
+
+
+def enqueue_review(session: Session, result: dict, filename: Optional[str] = None,
+                   status: Optional[str] = None) -> ReviewItem:
+    """
+    result: خروجی ناموفق apply_code (image، reason، detected_code).
+    """
+    code = result.get("detected_code")
+    item = session.exec(
+        select(ReviewItem).where(ReviewItem.image == result["image"], ReviewItem.state == ReviewState.PENDING)
+    ).first()
+    if item is None:
+        item = ReviewItem(image=result["image"], reason=result["reason"])
+    item.filename = filename or item.filename
+    item.reason = result["reason"]
+    item.detected_code = code
+    item.engine = result.get("engine")
+    item.status = status
+    session.add(item); session.flush()
+    return item
+
+
+def resolve_pending_reviews(session: Session, codes: Dict[str, str]) -> List[int]:
+    """
+    codes: کد یا alias تازه ثبت‌شده → کد سفارش.
+    آیتم‌های PENDING که detected_code آن‌ها دقیقاً یکی از کدهاست به سفارش وصل می‌شوند
+    (عکس و وضعیت روی سفارش ست می‌شود؛ اگر چند آیتم به یک سفارش برسند، جدیدترین عکس).
+    خروجی: id آیتم‌های حل‌شده.
+    """
+    keys = [c for c, oc in codes.items() if c and oc]
+    if not keys:
+        return []
+
+    items = session.exec(
+        select(ReviewItem)
+        .where(ReviewItem.state == ReviewState.PENDING, ReviewItem.detected_code.in_(keys))
+        .order_by(ReviewItem.id)
+    ).all()
+    if not items:
+        return []
+    orders = {o.code: o for o in session.exec(select(Order).where(Order.code.in_({codes[i.detected_code] for i in items})))}
+    now = datetime.utcnow()
+    resolved = []
+    for item in items:
+        o = orders.get(codes[item.detected_code])
+        if o is None:
+            continue
+        attach_review_item(session, item, o, now)
+        resolved.append(item.id)
+    return resolved
+
+
+def attach_review_item(session: Session, item: ReviewItem, order: Order, now: Optional[datetime] = None) -> None:
+    now = now or datetime.utcnow()
+    status_source(session, "review")
+    order.image_path = item.image
+    order.status = coerce_status(item.status)
+    order.updated_at = now
+    item.state = ReviewState.RESOLVED
+    item.order_code = order.code
+    item.resolved_at = now
+    session.add(order); session.add(item)
+
+
+def review_item_dict(item: ReviewItem) -> dict:
+    return {
+        "id": item.id, "image": item.image, "filename": item.filename,
+        "detected_code": item.detected_code, "reason": item.reason, "engine": item.engine,
+        "status": item.status, "state": item.state, "order_code": item.order_code,
+        "created_at": item.created_at, "resolved_at": item.resolved_at,
+    }
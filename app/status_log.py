@@ -0,0 +1,176 @@
+# app/status_log.py
+"""
+تاریخچه‌ی وضعیت سفارش‌ها (StatusEvent) و شمارش نگه‌داشته‌شده‌ی هر وضعیت (StatusCount).
+
+- هر تغییر status و هر سفارش جدید یک ردیف StatusEvent در همان تراکنش تغییر
+- StatusCount با INSERT ... ON CONFLICT DO UPDATE orders = orders + delta در همان تراکنش؛ /admin/orders/counts
+  بدون COUNT(*) روی جدول سفارش‌ها جواب می‌دهد
+- تغییرات ORM (set-status، manual-attach، ingest، صف بررسی، ساخت سفارش) خودکار در after_flush
+  ثبت می‌شوند؛ UPDATE/INSERTهای Core (bulk-update-status، import) خودشان record_status_changes را صدا می‌زنند
+- source رویداد ORM با status_source روی session تعیین می‌شود (سفارش جدید ORM همیشه create)
+- اولین اجرا روی دیتابیس موجود: ensure_status_counts شمارش‌ها را یک‌بار با GROUP BY می‌سازد
+- اصلاح انحراف (مثلاً بعد از ویرایش دستی دیتابیس): rebuild_status_counts، از
+  POST /admin/orders/counts/rebuild یا python -m app.status_log --rebuild
+"""
+import argparse
+import json
+import sys
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from .deps import begin_write, engine, init_db
+from .models import Order, StatusCount, StatusEvent
+
+# (کد سفارش، وضعیت قبلی یا None برای سفارش جدید، وضعیت جدید)
+StatusChange = Tuple[str, Optional[str], str]
+
+_SOURCE = "status_source"
+_events = StatusEvent.__table__
+_counts = StatusCount.__table__
+
+
+def status_source(session: Session, source: str) -> None:
+    """
+    منبع تغییرات ORM بعدی همین session در تاریخچه (set_status / manual / ingest / review).
+    """
+    session.info[_SOURCE] = source
+
+
+def record_status_changes(session: Session, changes: Iterable[StatusChange], source: str,
+                          now: Optional[datetime] = None) -> int:
+    """
+    رویداد و شمارش برای تغییرات واقعی (old != new). commit با صدا زننده است.
+    """
+    now = now or datetime.utcnow()
+    rows = [{"order_code": code, "old_status": old, "new_status": new, "source": source, "created_at": now}
+            for code, old, new in changes if old != new]
+    if not rows:
+        return 0
+    deltas: Counter = Counter()
+    for r in rows:
+        deltas[r["new_status"]] += 1
+        if r["old_status"] is not None:
+            deltas[r["old_status"]] -= 1
+    # Core روی اتصال session: داخل after_flush هم بدون flush دوباره اجرا می‌شود
+    conn = session.connection()
+    conn.execute(insert(_events), rows)
+    _apply_counts(conn, deltas)
+    return len(rows)
+
+
+def _apply_counts(conn, deltas: Dict[str, int]) -> None:
+    """
+    upsert اتمیک: اولین تغییر یک وضعیت در دو تراکنش هم‌زمان هم ردیف تکراری نمی‌سازد.
+    """
+    rows = [{"status": st, "orders": d} for st, d in deltas.items() if d]
+    if not rows:
+        return
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # بقیه‌ی دیتابیس‌ها: update-then-insert (رقابت روی اولین تغییر به IntegrityError می‌رسد)
+        for r in rows:
+            res = conn.execute(update(_counts).where(_counts.c.status == r["status"])
+                               .values(orders=_counts.c.orders + r["orders"]))
+            if res.rowcount == 0:
+                conn.execute(insert(_counts).values(**r))
+        return
+    stmt = dialect_insert(_counts)
+    conn.execute(stmt.on_conflict_do_update(index_elements=["status"],
+                                            set_={"orders": _counts.c.orders + stmt.excluded.orders}), rows)
+
+
+def ensure_status_counts(engine: Engine) -> None:
+    """
+    اگر جدول شمارش خالی است (اولین اجرا)، یک‌بار از وضعیت فعلی سفارش‌ها ساخته می‌شود.
+    """
+    with Session(engine) as session:
+        if session.exec(select(StatusCount).limit(1)).first() is not None:
+            return
+        rows = session.exec(select(Order.status, func.count()).group_by(Order.status)).all()
+        if not rows:
+            return
+        session.execute(insert(_counts), [{"status": st, "orders": n} for st, n in rows])
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()      # worker دیگری هم‌زمان ساخت
+
+
+def rebuild_status_counts(session: Session) -> Dict[str, int]:
+    """
+    شمارش‌ها را از نو با GROUP BY روی سفارش‌ها می‌سازد (در یک تراکنش نوشتن، تا تغییر هم‌زمان
+    بین GROUP BY و جایگزینی گم نشود). commit با صدا زننده است.
+    """
+    begin_write(session)
+    rows = session.exec(select(Order.status, func.count()).group_by(Order.status)).all()
+    conn = session.connection()
+    conn.execute(delete(_counts))
+    if rows:
+        conn.execute(insert(_counts), [{"status": st, "orders": n} for st, n in rows])
+    return {st: n for st, n in rows}
+
+
+def status_counts(session: Session) -> Dict[str, int]:
+    return {st: n for st, n in session.exec(select(StatusCount.status, StatusCount.orders))}
+
+
+# ---------- ثبت خودکار تغییرات ORM ----------
+@event.listens_for(Order.status, "set", active_history=True)
+def _load_old_status(target, value, oldvalue, initiator):
+    """
+    active_history: وضعیت قبلی حتی اگر هنوز لود نشده باشد خوانده می‌شود.
+    """
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _record_flushed(session, flush_context):
+    changes: List[StatusChange] = []
+    for obj in session.new:
+        if isinstance(obj, Order):
+            changes.append((obj.code, None, obj.status))
+    created = len(changes)
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        hist = inspect(obj).attrs.status.history
+        if hist.added and hist.deleted:
+            changes.append((obj.code, hist.deleted[0], hist.added[0]))
+    removed = Counter(obj.status for obj in session.deleted if isinstance(obj, Order))
+    if not changes and not removed:
+        return
+    record_status_changes(session, changes[:created], "create")
+    record_status_changes(session, changes[created:], session.info.get(_SOURCE, "update"))
+    if removed:
+        _apply_counts(session.connection(), {st: -n for st, n in removed.items()})
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.status_log", description="Order status counts")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild StatusCount from orders (GROUP BY)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    with Session(engine) as session:
+        if args.rebuild:
+            counts = rebuild_status_counts(session)
+            session.commit()
+        else:
+            counts = status_counts(session)
+    json.dump(counts, sys.stdout, ensure_ascii=False)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
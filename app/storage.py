@@ -0,0 +1,160 @@
+# app/storage.py
+"""
+ذخیره‌ی عکس‌ها بر اساس هش محتوا (content-addressed).
+
+- مسیر: uploads/<دو حرف اول هش>/<sha256><ext> → آپلود تکراری فقط یک بار ذخیره می‌شود
+- در زمان ingest نسخه‌های کوچک‌شده‌ی WebP و JPEG در عرض‌های IMAGE_WIDTHS و یک thumbnail
+  کنار اصل ساخته می‌شوند؛ فایل <sha256>.json عرض‌های ساخته‌شده و ابعاد را نگه می‌دارد
+- track.html با image_variants از روی همین فایل srcset می‌سازد
+- فایل اصلی دست‌نخورده می‌ماند (ورودی OCR و لینک «عکس کامل»)
+"""
+import hashlib
+import json
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from .deps import settings
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+UPLOAD_DIR = Path("app/static/uploads")
+UPLOAD_URL = "/static/uploads"
+
+_RX_STORED = re.compile(r"^/static/uploads/([0-9a-f]{2})/([0-9a-f]{64})\.[A-Za-z0-9]+$")
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class StoredImage:
+    path: str              # مسیر روی دیسک
+    url: str               # مسیر عمومی (image_path سفارش)
+    content_hash: str
+    deduped: bool          # از قبل موجود بود
+
+
+def _base(content_hash: str) -> Path:
+    return UPLOAD_DIR / content_hash[:2] / content_hash
+
+
+def store_file(tmp_path: str, ext: str, content_hash: Optional[str] = None) -> StoredImage:
+    """
+    فایل موقت را به مسیر هش منتقل می‌کند (یا اگر تکراری بود حذفش می‌کند) و derivativeها را می‌سازد.
+    """
+    h = content_hash or file_sha256(tmp_path)
+    base = _base(h)
+    dest = base.with_name(base.name + ext)
+    deduped = dest.exists()
+    if deduped:
+        os.unlink(tmp_path)
+    else:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, dest)
+    if not base.with_suffix(".json").exists():
+        make_derivatives(str(dest), h)
+    return StoredImage(path=str(dest), url=f"{UPLOAD_URL}/{h[:2]}/{dest.name}", content_hash=h, deduped=deduped)
+
+
+def _save_atomic(img: "Image.Image", path: Path, **params) -> None:
+    # دو آپلود هم‌زمان از یک عکس نباید فایل نیمه‌کاره ببینند
+    tmp = path.with_name(f".{uuid.uuid4().hex}{path.suffix}")
+    img.save(tmp, **params)
+    os.replace(tmp, path)
+
+
+def make_derivatives(src: str, content_hash: str) -> bool:
+    """
+    نسخه‌های WebP/JPEG در IMAGE_WIDTHS (بدون بزرگ‌کردن) + thumbnail. اگر فایل عکس نبود False.
+    """
+    # Pillow فقط در مسیر ingest لازم است (صفحه‌ی پیگیری فقط sidecar را می‌خواند)
+    from PIL import Image, ImageOps
+
+    widths = sorted(set(settings.IMAGE_WIDTHS))
+    try:
+        with Image.open(src) as im:
+            # ابعاد واقعی (با چرخش EXIF) قبل از draft که اندازه را کوچک می‌کند
+            width, height = im.size
+            if im.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            # برای JPEG دیکد مستقیم با مقیاس کوچک‌تر (عکس موبایل ۴ تا ۸ مگابایت)
+            im.draft("RGB", (max(widths), max(widths)))
+            im = ImageOps.exif_transpose(im).convert("RGB")
+    except Exception:
+        return False
+
+    base = _base(content_hash)
+    made = []
+    for w in widths:
+        v = im.copy()
+        v.thumbnail((w, w * 10), Image.LANCZOS)
+        if made and v.width <= made[-1]:
+            break
+        # نام فایل با عرض واقعی (اگر عکس از w کوچک‌تر بود، همان اندازه‌ی اصلی و توقف)
+        _save_atomic(v, base.with_name(f"{base.name}_{v.width}.webp"), format="WEBP", quality=settings.IMAGE_WEBP_QUALITY, method=4)
+        _save_atomic(v, base.with_name(f"{base.name}_{v.width}.jpg"), format="JPEG", quality=settings.IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+        made.append(v.width)
+        if v.width < w:
+            break
+    thumb = im.copy()
+    thumb.thumbnail((settings.IMAGE_THUMB_SIZE, settings.IMAGE_THUMB_SIZE), Image.LANCZOS)
+    _save_atomic(thumb, base.with_name(f"{base.name}_thumb.webp"), format="WEBP", quality=settings.IMAGE_WEBP_QUALITY)
+
+    meta = {"widths": made, "width": width, "height": height}
+    tmp = base.with_name(f".{uuid.uuid4().hex}.json")
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, base.with_suffix(".json"))
+    return True
+
+
+class _NoVariants(Exception):
+    pass
+
+
+def image_variants(image_path: Optional[str]) -> Optional[dict]:
+    """
+    برای template: srcsetهای WebP/JPEG، src پیش‌فرض، thumbnail و ابعاد.
+    عکس‌های قدیمی (نام uuid) یا بدون derivative → None. فقط نتیجه‌ی موجود کش می‌شود؛
+    نبودِ sidecar (مثلاً derivativeها هنوز در حال ساخت) دفعه‌ی بعد دوباره بررسی می‌شود.
+    """
+    m = _RX_STORED.match(image_path or "")
+    if not m:
+        return None
+    try:
+        return _stored_variants(*m.groups())
+    except _NoVariants:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _stored_variants(prefix: str, h: str) -> dict:
+    # lru_cache استثنا را کش نمی‌کند: miss با _NoVariants
+    try:
+        meta = json.loads(_base(h).with_suffix(".json").read_text())
+    except (OSError, ValueError):
+        raise _NoVariants(h)
+    widths = meta["widths"]
+    if not widths:
+        raise _NoVariants(h)
+    url = f"{UPLOAD_URL}/{prefix}/{h}"
+    # ابعاد نمایش بزرگ‌ترین derivative (برای width/height و جلوگیری از layout shift)
+    scale = min(1.0, widths[-1] / meta["width"])
+    return {
+        "webp_srcset": ", ".join(f"{url}_{w}.webp {w}w" for w in widths),
+        "jpeg_srcset": ", ".join(f"{url}_{w}.jpg {w}w" for w in widths),
+        "src": f"{url}_{widths[0]}.jpg",
+        "thumb": f"{url}_thumb.webp",
+        "width": round(meta["width"] * scale),
+        "height": round(meta["height"] * scale),
+    }
@@ -0,0 +1,216 @@
+# app/uploads.py
+"""
+دریافت مشترک فایل‌های آپلودی برای همه‌ی endpointهای عکس.
+
+- بدنه‌ی هر فایل (که parser multipart قبلاً spool کرده) chunk به chunk خوانده و در thread pool
+  جداگانه‌ی I/O (نه threadpool اصلی که /track را هم سرویس می‌دهد) روی دیسک نوشته می‌شود
+- سقف حجم و نوع مجاز (از روی magic bytes، نه پسوند) حین همین کپی بررسی می‌شوند؛ فایل رد‌شده
+  به storage و هش نمی‌رسد ولی دریافتش را متوقف نمی‌کند. سقف واقعی دریافت، سقف کل درخواست در
+  MaxUploadRequestSize است که بایت‌های بدنه را حین دریافت می‌شمارد (بدنه‌ی chunked هم)
+- هش sha256 و ابعاد عکس حین کپی حساب می‌شوند و هش به storage و کش OCR پاس داده می‌شود
+- نوشتن در فایل موقت و سپس rename اتمیک به مسیر هش (app/storage.py)
+"""
+import asyncio
+import hashlib
+import io
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+from fastapi import File, HTTPException, UploadFile
+from starlette.responses import PlainTextResponse
+
+from .deps import settings
+from .metrics import observe_stage, stage
+from .storage import UPLOAD_DIR, store_file
+
+# نوع → پسوند ذخیره
+IMAGE_TYPES = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _io() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=settings.UPLOAD_IO_WORKERS, thread_name_prefix="upload-io")
+    return _io_pool
+
+
+def shutdown_upload_io() -> None:
+    global _io_pool
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=True)
+        _io_pool = None
+
+
+@dataclass
+class SavedUpload:
+    filename: str
+    dest: str                  # مسیر روی دیسک
+    url: str                   # مسیر عمومی (image_path سفارش)
+    content_hash: str
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+@dataclass
+class UploadError:
+    filename: str
+    error: str
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _probe_size(head: bytes) -> Optional[Tuple[int, int]]:
+    # Image.open فقط header را می‌خواند (بدون دیکد پیکسل‌ها)
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(head)) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+def _write(f, h, chunk: bytes) -> None:
+    # sha256 روی chunkهای بزرگ GIL را آزاد می‌کند
+    h.update(chunk)
+    f.write(chunk)
+
+
+async def receive_upload(upload: UploadFile) -> SavedUpload:
+    """
+    فایل را chunk به chunk در فایل موقت می‌نویسد و به storage می‌سپارد.
+    خطاها: 413 (حجم/ابعاد)، 415 (نوع)، 400 (فایل خالی).
+    """
+    max_bytes = settings.UPLOAD_MAX_BYTES
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(413, f"File larger than {max_bytes} bytes")
+
+    loop = asyncio.get_running_loop()
+    pool = _io()
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    h = hashlib.sha256()
+    size = 0
+    kind = dims = None
+    t0 = time.perf_counter()
+    f = await loop.run_in_executor(pool, open, tmp, "wb")
+    try:
+        while True:
+            chunk = await upload.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if kind is None:
+                kind = sniff_image_type(chunk)
+                if kind not in settings.UPLOAD_ALLOWED_TYPES:
+                    raise HTTPException(415, "Unsupported image type")
+                dims = _probe_size(chunk)
+                if dims and dims[0] * dims[1] > settings.UPLOAD_MAX_PIXELS:
+                    raise HTTPException(413, "Image dimensions too large")
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(413, f"File larger than {max_bytes} bytes")
+            await loop.run_in_executor(pool, _write, f, h, chunk)
+        if kind is None:
+            raise HTTPException(400, "Empty file")
+        await loop.run_in_executor(pool, f.close)
+        observe_stage("upload_copy", time.perf_counter() - t0)
+        # rename اتمیک به مسیر هش + derivativeها
+        with stage("upload_store"):
+            stored = await loop.run_in_executor(pool, store_file, str(tmp), IMAGE_TYPES[kind], h.hexdigest())
+    finally:
+        # خطا یا لغو درخواست: فایل موقت نمی‌ماند (بعد از store_file دیگر وجود ندارد)
+        f.close()
+        tmp.unlink(missing_ok=True)
+    return SavedUpload(
+        filename=upload.filename or "", dest=stored.path, url=stored.url, content_hash=stored.content_hash,
+        size=size, width=dims[0] if dims else None, height=dims[1] if dims else None,
+    )
+
+
+# ---------- FastAPI dependencies ----------
+async def received_image(image: UploadFile = File(...)) -> SavedUpload:
+    return await receive_upload(image)
+
+
+async def received_images(images: List[UploadFile] = File(...)) -> List[Union[SavedUpload, UploadError]]:
+    """
+    هر فایل جدا: خطای یک فایل بقیه را رد نمی‌کند.
+    """
+    async def one(img: UploadFile) -> Union[SavedUpload, UploadError]:
+        try:
+            return await receive_upload(img)
+        except HTTPException as e:
+            return UploadError(img.filename or "?", e.detail)
+        except Exception as e:
+            return UploadError(img.filename or "?", str(e))
+
+    return list(await asyncio.gather(*(one(img) for img in images)))
+
+
+class MaxUploadRequestSize:
+    """
+    middleware خام ASGI برای سقف کل بدنه‌ی درخواست multipart:
+    - Content-Length بیش از سقف: 413 قبل از خواندن بدنه
+    - بدون Content-Length (chunked) یا Content-Length نادرست: بایت‌ها حین دریافت شمرده می‌شوند و
+      با عبور از سقف دریافت متوقف و 413 برگردانده می‌شود
+    """
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        try:
+            length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            length = 0
+        if length > self.max_bytes:
+            await PlainTextResponse("Request body too large", status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # parse فرم (و هر خواننده‌ی بدنه) همین‌جا متوقف می‌شود؛ FastAPI آن را 413 برمی‌گرداند
+                    raise HTTPException(413, "Request body too large")
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, tracked_send)
+        except HTTPException as e:
+            # اگر بدنه بیرون از handler خوانده شد و کسی 413 را پاسخ نکرد
+            if e.status_code != 413 or started:
+                raise
+            await PlainTextResponse("Request body too large", status_code=413)(scope, receive, send)
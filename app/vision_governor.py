@@ -0,0 +1,264 @@
+# app/vision_governor.py
+"""
+کنترل همه‌ی ترافیک Google Vision در هر worker.
+
+- سقف درخواست هم‌زمان (OCR_VISION_MAX_INFLIGHT) و token bucket هم‌اندازه‌ی سهمیه
+  (OCR_VISION_RATE_PER_SEC / OCR_VISION_RATE_BURST)
+- retry خطاهای گذرا (UNAVAILABLE، RESOURCE_EXHAUSTED، DEADLINE_EXCEEDED، INTERNAL، timeout)
+  با backoff نمایی و jitter کامل؛ خطای دائمی (مثلاً عکس نامعتبر) retry نمی‌شود
+- بودجه‌ی زمانی هر عکس (vision_budget): timeout هر RPC، انتظار rate limit و backoff از
+  باقی‌مانده‌ی همان بودجه کم می‌شوند
+- circuit breaker: بعد از OCR_VISION_BREAKER_FAILURES خطای پشت‌سرهم، به مدت
+  OCR_VISION_BREAKER_COOLDOWN ثانیه هیچ درخواستی فرستاده نمی‌شود؛ بعد یک درخواست آزمایشی
+
+وقتی Vision قابل استفاده نیست VisionUnavailable بالا می‌رود (نه متن خالی) تا نتیجه
+OCR_UNAVAILABLE شود و با CODE_NOT_FOUND اشتباه نشود.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+from .metrics import vision_calls
+
+T = TypeVar("T")
+
+MAX_INFLIGHT = int(os.getenv("OCR_VISION_MAX_INFLIGHT", "16"))
+RATE_PER_SEC = float(os.getenv("OCR_VISION_RATE_PER_SEC", "30"))     # سهمیه‌ی پیش‌فرض Vision: ۱۸۰۰ در دقیقه
+RATE_BURST = float(os.getenv("OCR_VISION_RATE_BURST", "30"))
+RETRIES = int(os.getenv("OCR_VISION_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("OCR_VISION_BACKOFF_BASE", "0.2"))
+BACKOFF_MAX = float(os.getenv("OCR_VISION_BACKOFF_MAX", "5"))
+RPC_TIMEOUT = float(os.getenv("OCR_VISION_RPC_TIMEOUT", "10"))
+IMAGE_BUDGET = float(os.getenv("OCR_VISION_IMAGE_BUDGET", "30"))
+BREAKER_FAILURES = int(os.getenv("OCR_VISION_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("OCR_VISION_BREAKER_COOLDOWN", "30"))
+
+# نام کلاس‌های google.api_core.exceptions (بدون import کتابخانه) و کدهای gRPC گذرا
+TRANSIENT_ERRORS = {
+    "ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "DeadlineExceeded",
+    "InternalServerError", "BadGateway", "GatewayTimeout", "Aborted", "RetryError",
+}
+TRANSIENT_CODES = {4, 8, 10, 13, 14}   # DEADLINE_EXCEEDED، RESOURCE_EXHAUSTED، ABORTED، INTERNAL، UNAVAILABLE
+# خطاهای کانال gRPC (اتصال قطع/reset): فقط این‌ها دلیل ساخت دوباره‌ی کلاینت‌اند، نه سهمیه یا timeout
+CHANNEL_ERRORS = {"ServiceUnavailable"}
+
+
+class VisionUnavailable(Exception):
+    """
+    reason: circuit_open / deadline / rate_limited / vision_error
+    """
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+class TransientVisionError(Exception):
+    """
+    پاسخ Vision با کد خطای گذرا (resp.error.code) که باید retry شود.
+    """
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (TransientVisionError, TimeoutError, ConnectionError)):
+        return True
+    return any(c.__name__ in TRANSIENT_ERRORS for c in type(exc).__mro__)
+
+
+def is_channel_error(exc: BaseException) -> bool:
+    if isinstance(exc, ConnectionError):
+        return True
+    return any(c.__name__ in CHANNEL_ERRORS for c in type(exc).__mro__)
+
+
+# ---------- بودجه‌ی زمانی هر عکس ----------
+_deadline: ContextVar[Optional[float]] = ContextVar("vision_deadline", default=None)
+
+
+@contextmanager
+def vision_budget(seconds: Optional[float] = None) -> Iterator[None]:
+    """
+    همه‌ی RPCهای Vision داخل این بلوک (همه‌ی variantهای یک عکس) با هم حداکثر seconds ثانیه.
+    بلوک‌های تو در تو بودجه‌ی بیرونی را بزرگ نمی‌کنند.
+    """
+    deadline = time.monotonic() + (IMAGE_BUDGET if seconds is None else seconds)
+    outer = _deadline.get()
+    token = _deadline.set(min(deadline, outer) if outer is not None else deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _remaining() -> Optional[float]:
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        یک توکن رزرو می‌کند و زمان انتظار لازم را برمی‌گرداند (0 = فوری).
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+            self._at = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._probe = False
+            if self.state == self.HALF_OPEN and not self._probe:
+                self._probe = True      # فقط یک درخواست آزمایشی
+                return True
+            return False
+
+    def release(self) -> None:
+        """
+        درخواست اجازه‌گرفته قبل از RPC کنار رفت (rate limit / بودجه): probe آزاد می‌شود.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe = False
+
+    def success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self.state = self.CLOSED
+
+    def failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class VisionGovernor:
+    def __init__(self):
+        self._inflight = threading.BoundedSemaphore(max(1, MAX_INFLIGHT))
+        self.bucket = TokenBucket(RATE_PER_SEC, RATE_BURST)
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+    def call(self, fn: Callable[[float], T], on_channel_error: Optional[Callable[[], None]] = None) -> T:
+        """
+        fn(timeout) یک RPC است. خطای دائمی همان‌طور بالا می‌رود؛ خطای گذرا تا RETRIES بار
+        تکرار و بعد (یا با تمام شدن بودجه/باز بودن breaker) VisionUnavailable می‌شود.
+        on_channel_error: فقط برای خطای کانال (UNAVAILABLE / اتصال reset)، مثلاً ساخت دوباره‌ی کلاینت؛
+        سهمیه و timeout فقط به breaker و retry می‌رسند
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                vision_calls.inc(result="circuit_open")
+                raise VisionUnavailable("circuit_open")
+            try:
+                timeout = self._reserve_slot()
+                with self._inflight_slot(timeout):
+                    t_left = _remaining()
+                    timeout = RPC_TIMEOUT if t_left is None else min(RPC_TIMEOUT, t_left)
+                    result = fn(timeout)
+            except VisionUnavailable:
+                # RPC فرستاده نشد؛ نه موفقیت است نه خطا، ولی probe نیمه‌باز نباید قفل بماند
+                self.breaker.release()
+                raise
+            except BaseException as e:
+                if not isinstance(e, Exception):   # لغو / KeyboardInterrupt
+                    self.breaker.release()
+                    raise
+                if not is_transient(e):
+                    self.breaker.success()      # سرویس جواب داد؛ مشکل از درخواست است
+                    vision_calls.inc(result="error")
+                    raise
+                self.breaker.failure()
+                if on_channel_error is not None and is_channel_error(e):
+                    on_channel_error()
+                attempt += 1
+                if attempt > RETRIES:
+                    vision_calls.inc(result="failed")
+                    raise VisionUnavailable("vision_error", type(e).__name__) from e
+                vision_calls.inc(result="retry")
+                self._sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))))
+                continue
+            self.breaker.success()
+            vision_calls.inc(result="ok")
+            return result
+
+    def _reserve_slot(self) -> Optional[float]:
+        t_left = _remaining()
+        if t_left is not None and t_left <= 0:
+            vision_calls.inc(result="deadline")
+            raise VisionUnavailable("deadline")
+        wait = self.bucket.reserve()
+        if t_left is not None and wait >= t_left:
+            self.bucket.refund()
+            vision_calls.inc(result="rate_limited")
+            raise VisionUnavailable("rate_limited")
+        if wait:
+            time.sleep(wait)
+        return _remaining()
+
+    @contextmanager
+    def _inflight_slot(self, timeout: Optional[float]) -> Iterator[None]:
+        if timeout is not None and timeout <= 0:
+            vision_calls.inc(result="deadline")
+            raise VisionUnavailable("deadline")
+        if not self._inflight.acquire(timeout=timeout if timeout is not None else -1):
+            vision_calls.inc(result="deadline")
+            raise VisionUnavailable("deadline")
+        try:
+            yield
+        finally:
+            self._inflight.release()
+
+    def _sleep(self, seconds: float) -> None:
+        t_left = _remaining()
+        if t_left is not None and seconds >= t_left:
+            vision_calls.inc(result="deadline")
+            raise VisionUnavailable("deadline")
+        time.sleep(seconds)
+
+    def stats(self) -> Dict[str, object]:
+        return {"breaker": self.breaker.state, "breaker_opens": self.breaker.opens,
+                "max_inflight": MAX_INFLIGHT, "rate_per_sec": RATE_PER_SEC}
+
+
+vision_governor = VisionGovernor()
@@ -0,0 +1,128 @@
+# app/vision_stub.py
+"""
+کلاینت جعلی Google Vision برای اجرای آفلاین و اندازه‌گیری throughput.
+
+همان بخشی از API را پیاده می‌کند که ocr_google استفاده می‌کند:
+document_text_detection و batch_annotate_images.
+با OCR_VISION_STUB=1 به‌جای کلاینت واقعی ساخته می‌شود.
+
+تزریق خطا برای آزمودن vision_governor (retry، breaker، بودجه):
+- OCR_STUB_FAIL_RATE: احتمال خطای هر RPC (0..1)، OCR_STUB_FAIL_FIRST: N RPC اول خطا (قطعی و بعد بازگشت)
+- OCR_STUB_FAIL_KIND: unavailable / quota / deadline (استثنا با نام کلاس‌های google.api_core)
+  یا response (پاسخ با error.code=8 برای هر تصویر)
+- timeout هر RPC رعایت می‌شود: اگر latency بیشتر باشد، بعد از timeout خطای DeadlineExceeded
+- OCR_STUB_SEED: ترتیب تکرارپذیر خطاهای تصادفی
+"""
+from __future__ import annotations
+
+import importlib
+import itertools
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+# responder: بایت‌های تصویر را می‌گیرد و متن OCR را برمی‌گرداند
+Responder = Callable[[bytes], str]
+
+
+def _response(text: str, error: str = "", code: int = 0) -> SimpleNamespace:
+    return SimpleNamespace(
+        error=SimpleNamespace(message=error, code=code),
+        full_text_annotation=SimpleNamespace(text=text),
+    )
+
+
+# هم‌نام google.api_core.exceptions تا طبقه‌بندی governor مثل کلاینت واقعی باشد
+class ServiceUnavailable(Exception):
+    pass
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+FAULTS = {"unavailable": ServiceUnavailable, "quota": ResourceExhausted, "deadline": DeadlineExceeded}
+
+# شمارنده‌ی کل پروسه: ساخت دوباره‌ی کلاینت (VisionClientManager) قطعی FAIL_FIRST را از نو شروع نکند
+_process_calls = itertools.count(1)
+
+
+class FakeVisionClient:
+    def __init__(self, latency: float = 0.0, responder: Optional[Responder] = None,
+                 fail_rate: float = 0.0, fail_first: int = 0, fail_kind: str = "unavailable",
+                 seed: Optional[int] = None):
+        self.latency = latency          # تاخیر هر RPC (ثانیه)
+        self.responder = responder
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.fail_kind = fail_kind
+        self.calls = 0                  # تعداد RPCها
+        self.images = 0                 # تعداد تصاویر پردازش‌شده
+        self.faults = 0                 # تعداد RPCهای خطادار
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeVisionClient":
+        """
+        OCR_STUB_RESPONDER="module:func" یک responder دلخواه (مثلاً bench.labels:qr_oracle)
+        و در غیر این صورت متن ثابت OCR_STUB_TEXT.
+        """
+        seed = os.getenv("OCR_STUB_SEED", "")
+        kw = dict(
+            latency=float(os.getenv("OCR_STUB_LATENCY_MS", "0")) / 1000.0,
+            fail_rate=float(os.getenv("OCR_STUB_FAIL_RATE", "0")),
+            fail_first=int(os.getenv("OCR_STUB_FAIL_FIRST", "0")),
+            fail_kind=os.getenv("OCR_STUB_FAIL_KIND", "unavailable"),
+            seed=int(seed) if seed else None,
+        )
+        target = os.getenv("OCR_STUB_RESPONDER", "")
+        if target:
+            module, _, attr = target.partition(":")
+            return cls(responder=getattr(importlib.import_module(module), attr), **kw)
+        text = os.getenv("OCR_STUB_TEXT", "")
+        return cls(responder=lambda _content: text, **kw)
+
+    def _text(self, image) -> str:
+        if self.responder is None:
+            return ""
+        return self.responder(getattr(image, "content", b"") or b"")
+
+    def _rpc(self, n_images: int, timeout: Optional[float] = None) -> bool:
+        """
+        True: این RPC باید پاسخ خطادار (FAIL_KIND=response) بدهد.
+        """
+        with self._lock:
+            self.calls += 1
+            self.images += n_images
+            fail = next(_process_calls) <= self.fail_first or (self.fail_rate > 0 and self._rng.random() < self.fail_rate)
+            self.faults += fail
+        if self.latency:
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise DeadlineExceeded(f"stub latency {self.latency:.3f}s > timeout {timeout:.3f}s")
+            time.sleep(self.latency)
+        if fail and self.fail_kind in FAULTS:
+            raise FAULTS[self.fail_kind]("injected fault")
+        return fail
+
+    def _annotate(self, image, fail: bool) -> SimpleNamespace:
+        if fail:
+            return _response("", "Quota exceeded (injected)", code=8)
+        return _response(self._text(image))
+
+    def document_text_detection(self, image=None, timeout: Optional[float] = None, **kwargs) -> SimpleNamespace:
+        return self._annotate(image, self._rpc(1, timeout))
+
+    def batch_annotate_images(self, requests=None, timeout: Optional[float] = None, **kwargs) -> SimpleNamespace:
+        requests = list(requests or [])
+        fail = self._rpc(len(requests), timeout)
+        responses: List[SimpleNamespace] = [self._annotate(r.image, fail) for r in requests]
+        return SimpleNamespace(responses=responses)
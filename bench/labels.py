@@ -0,0 +1,114 @@
+# bench/labels.py
+"""
+تولید عکس لیبل مصنوعی (J&T / AJEX / اینویس) با چرخش و نویز، و responder شبیه‌ساز Vision.
+
+هر لیبل علاوه بر متن، کد را در یک QR داخل بلوک متن دارد. qr_oracle (responder
+FakeVisionClient) QR را می‌خواند ولی فقط وقتی تصویر تقریباً صاف باشد (±45°) متن را
+«می‌خواند» — مثل OCR واقعی روی متن چرخیده. پس دقت و تعداد variantهای امتحان‌شده به ترتیب
+چرخش/فیلترها و کیفیت عکس بستگی دارد، بدون شبکه و به‌صورت تکرارپذیر.
+
+موتور barcode در بنچمارک‌هایی که این oracle را می‌سنجند باید خاموش باشد (OCR_ENGINES=vision).
+"""
+import math
+import random
+import threading
+from typing import Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+CARRIERS = ("J&T EXPRESS", "AJEX", "INVOICE")
+
+
+def make_code(rng: random.Random, kind: str) -> str:
+    if kind == "J&T EXPRESS":
+        return "JTE" + "".join(rng.choices("0123456789", k=12))
+    if kind == "AJEX":
+        return "AJA" + "".join(rng.choices("0123456789", k=10))
+    return "".join(rng.choices("0123456789", k=14))
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:              # Pillow قدیمی
+        return ImageFont.load_default()
+
+
+def _qr(code: str, side: int) -> Image.Image:
+    m = cv2.QRCodeEncoder.create().encode(code)
+    m = cv2.copyMakeBorder(m, 4, 4, 4, 4, cv2.BORDER_CONSTANT, value=255)
+    return Image.fromarray(m).resize((side, side), Image.NEAREST).convert("RGB")
+
+
+def make_label(code: str, carrier: str, angle: float, noise: float, rng: random.Random) -> Image.Image:
+    """
+    عکس «موبایلی» از یک لیبل روی بسته: angle درجه چرخش، noise انحراف معیار نویز گاوسی (0..40).
+    """
+    label = Image.new("RGB", (900, 560), "white")
+    d = ImageDraw.Draw(label)
+    big, small = _font(46), _font(28)
+    d.rectangle((8, 8, 891, 551), outline="black", width=4)
+    d.text((40, 30), carrier, fill="black", font=big)
+    d.text((40, 110), f"Waybill: {code}", fill="black", font=big)
+    lines = ["To: " + rng.choice(("Dubai Warehouse", "Deira, Dubai", "Al Quoz 3")),
+             "Tel: +971 5" + "".join(rng.choices("0123456789", k=8)),
+             "Weight: %.1f kg   Pcs: %d" % (rng.uniform(0.2, 12), rng.randint(1, 3)),
+             "Ref: " + "".join(rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ", k=6))]
+    for i, line in enumerate(lines):
+        d.text((250, 200 + i * 42), line, fill="black", font=small)
+    # QR داخل بلوک متن تا برش لیبل (_analyze_layout) آن را حذف نکند
+    label.paste(_qr(code, 180), (40, 195))
+
+    # بسته (پس‌زمینه‌ی قهوه‌ای) با لیبل کمی جابه‌جا
+    bg = tuple(rng.randint(150, 200) for _ in range(3))
+    photo = Image.new("RGB", (1400, 1100), bg)
+    photo.paste(label, (rng.randint(60, 440), rng.randint(60, 480)))
+    photo = photo.rotate(angle, expand=True, fillcolor=bg, resample=Image.BICUBIC)
+
+    arr = np.asarray(photo).astype(np.float32)
+    if noise:
+        arr += np.random.default_rng(rng.randint(0, 2**31)).normal(0, noise, arr.shape)
+    arr = np.clip(arr, 0, 255).astype(np.uint8)
+    if noise > 20:
+        arr = cv2.GaussianBlur(arr, (3, 3), 0)
+    return Image.fromarray(arr)
+
+
+def random_label(rng: random.Random, code: str = None) -> Tuple[Image.Image, str, float, float]:
+    """
+    لیبل با کارِیر، چرخش (۰/۹۰/۱۸۰/۲۷۰ ± ۸ درجه) و نویز تصادفی. خروجی: (عکس، کد، زاویه، نویز)
+    """
+    carrier = rng.choice(CARRIERS)
+    code = code or make_code(rng, carrier)
+    angle = rng.choice((0, 0, 90, 180, 270)) + rng.uniform(-8, 8)
+    noise = rng.choice((0, 8, 16, 28))
+    return make_label(code, carrier, angle, noise, rng), code, angle, noise
+
+
+_local = threading.local()
+
+
+def qr_oracle(content: bytes) -> str:
+    """
+    responder برای FakeVisionClient (OCR_STUB_RESPONDER=bench.labels:qr_oracle).
+    """
+    # دیتکتور OpenCV thread-safe نیست
+    if not hasattr(_local, "qr"):
+        _local.qr = cv2.QRCodeDetector()
+    img = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return ""
+    try:
+        data, pts, _ = _local.qr.detectAndDecode(img)
+    except cv2.error:
+        return ""
+    if not data or pts is None:
+        return ""
+    p = pts.reshape(-1, 2)
+    # گوشه‌ی بالا-چپ → بالا-راست خود QR؛ متن فقط وقتی خوانا است که تقریباً افقی باشد
+    angle = math.degrees(math.atan2(p[1][1] - p[0][1], p[1][0] - p[0][0]))
+    if abs(angle) > 45:
+        return ""
+    return f"EXPRESS\nWaybill: {data}\nTo: Dubai"
@@ -0,0 +1,319 @@
+# bench/run.py
+"""
+بنچمارک تکرارپذیر مسیرهای داغ: /track، /upload-many، bulk-update-status و دقت OCR.
+
+    pip install -r requirements-dev.txt    # httpx (کلاینت بنچمارک) و pytest
+    python -m bench.run                    # ۱M سفارش / ۲M alias
+    python -m bench.run --quick            # ۲۰k / ۴۰k برای اجرای سریع
+    python -m bench.run --only track,ocr --out results.json
+
+- دیتابیس با bench/seed.py ساخته و کش می‌شود؛ هر اجرا روی یک کپی کار می‌کند
+- سرور واقعی (uvicorn) در یک پوشه‌ی موقت اجرا می‌شود تا آپلودها درخت repo را کثیف نکنند
+- Vision با FakeVisionClient و responder شبیه‌ساز bench.labels:qr_oracle جایگزین می‌شود
+  (تاخیر با --stub-latency-ms)
+- خروجی: یک JSON (stdout یا --out) برای مقایسه‌ی بین commitها
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from .labels import random_label
+from .seed import SEED_EPOCH, alias_for, order_code, seeded_db
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCHES = ("track", "upload", "bulk", "ocr")
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return {"p50_ms": round(pick(0.50) * 1000, 3), "p95_ms": round(pick(0.95) * 1000, 3),
+            "p99_ms": round(pick(0.99) * 1000, 3), "max_ms": round(s[-1] * 1000, 3),
+            "mean_ms": round(statistics.fmean(s) * 1000, 3)}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _stub_env(workdir: Path, db: Path, args) -> Dict[str, str]:
+    return {
+        "DATABASE_URL": f"sqlite:///{db}",
+        "OCR_VISION_STUB": "1",
+        "OCR_STUB_RESPONDER": "bench.labels:qr_oracle",
+        "OCR_STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "OCR_ENGINES": args.engines,
+        "OCR_VARIANT_STATS_PATH": str(workdir / "variant_stats.json"),
+    }
+
+
+class Server:
+    """
+    uvicorn در پوشه‌ی موقت: app/templates به repo لینک می‌شود و app/static خالی است
+    (مسیرهای app در کد نسبی‌اند)؛ پکیج app از ROOT با PYTHONPATH لود می‌شود.
+    """
+    def __init__(self, workdir: Path, env: Dict[str, str]):
+        (workdir / "app" / "static" / "uploads").mkdir(parents=True, exist_ok=True)
+        (workdir / "app" / "templates").symlink_to(ROOT / "app" / "templates")
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **env, "PYTHONPATH": str(ROOT)}
+        self.workdir = workdir
+        self.proc = None
+
+    def __enter__(self) -> "Server":
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=self.workdir, env=self.env,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(self.url + "/metrics", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            if self.proc.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.2)
+        raise RuntimeError("server did not start")
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# ---------- /track ----------
+def bench_track(url: str, n_orders: int, n_aliases: int, duration: float, concurrency: int, hot: int = 0) -> dict:
+    """
+    hot=0: کدهای تصادفی از کل دیتابیس (اغلب miss کش)؛ hot>0: فقط hot کد پرتکرار.
+    ترکیب: ۶۰٪ کد مستقیم، ۳۰٪ alias، ۱۰٪ ناموجود.
+    """
+    rng = random.Random(7)
+    population = hot or n_orders
+
+    def pick(r: random.Random) -> str:
+        x = r.random()
+        i = r.randrange(population)
+        if x < 0.6:
+            return order_code(i)
+        if x < 0.9 and n_aliases:
+            return alias_for(i % n_aliases, n_orders)[0]
+        return f"MISSING{i}"
+
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop = time.monotonic() + duration
+
+    def worker(w: int, seed: int):
+        r = random.Random(seed)
+        with httpx.Client(base_url=url, timeout=30) as c:
+            while time.monotonic() < stop:
+                t0 = time.perf_counter()
+                try:
+                    ok = c.get("/track", params={"code": pick(r)}).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies[w].append(time.perf_counter() - t0)
+                errors[w] += not ok
+
+    threads = [threading.Thread(target=worker, args=(w, rng.random())) for w in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    flat = [x for lst in latencies for x in lst]
+    return {"requests": len(flat), "errors": sum(errors), "seconds": round(elapsed, 2),
+            "qps": round(len(flat) / elapsed, 1), "concurrency": concurrency, "hot_set": hot or None,
+            **_percentiles(flat)}
+
+
+# ---------- /upload-many ----------
+def _jpeg(img) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def bench_upload(url: str, n_orders: int, n_aliases: int, n_labels: int, batch: int) -> dict:
+    """
+    لیبل‌ها کد alias سفارش‌های seed را دارند (نام فایل بی‌معنی تا OCR لازم شود).
+    """
+    rng = random.Random(11)
+    labels = []
+    for j in range(n_labels):
+        alias, i = alias_for(rng.randrange(max(1, n_aliases)), n_orders)
+        img, code, _, _ = random_label(rng, code=alias)
+        labels.append((f"img_{j}.jpg", _jpeg(img), order_code(i)))
+    payload_bytes = sum(len(b) for _, b, _ in labels)
+
+    results, batch_seconds = [], []
+    t0 = time.perf_counter()
+    with httpx.Client(base_url=url, timeout=600) as c:
+        for start in range(0, n_labels, batch):
+            part = labels[start:start + batch]
+            tb = time.perf_counter()
+            r = c.post("/upload-many", files=[("images", (name, data, "image/jpeg")) for name, data, _ in part],
+                       data={"default_status": "ARRIVED_DXB", "async_job": "false"})
+            batch_seconds.append(time.perf_counter() - tb)
+            r.raise_for_status()
+            results += r.json()["results"]
+    elapsed = time.perf_counter() - t0
+    correct = sum(1 for (_, _, expected), res in zip(labels, results) if res.get("ok") and res.get("code") == expected)
+    return {"images": n_labels, "batch_size": batch, "seconds": round(elapsed, 2),
+            "images_per_sec": round(n_labels / elapsed, 2), "payload_mb": round(payload_bytes / 1e6, 2),
+            "succeeded": sum(1 for res in results if res.get("ok")),
+            "needs_review": sum(1 for res in results if res.get("needs_review")),
+            "accuracy": round(correct / max(1, n_labels), 4),
+            "engines": dict(Counter(res.get("engine") or "none" for res in results)),
+            "batch": _percentiles(batch_seconds)}
+
+
+# ---------- bulk-update-status ----------
+def bench_bulk(url: str, n_orders: int) -> dict:
+    """
+    بازه‌ی ۳۶ روز (~۱۰٪ سفارش‌ها): اول dry_run، بعد به‌روزرسانی واقعی.
+    """
+    start = (SEED_EPOCH - timedelta(days=100)).date()
+    end = (SEED_EPOCH - timedelta(days=65)).date()
+    body = {"start_date": str(start), "end_date": str(end), "new_status": "IN_TRANSIT_IR",
+            "exclude_codes": [order_code(i) for i in range(0, n_orders, max(1, n_orders // 100))]}
+    out = {}
+    with httpx.Client(base_url=url, timeout=600) as c:
+        for name, extra in (("dry_run", {"dry_run": True}), ("update", {})):
+            t0 = time.perf_counter()
+            r = c.post("/admin/bulk-update-status", json={**body, **extra})
+            r.raise_for_status()
+            data = r.json()
+            out[name] = {"seconds": round(time.perf_counter() - t0, 4),
+                         "rows": data.get("would_update_count", data.get("updated_count"))}
+    return out
+
+
+# ---------- دقت OCR ----------
+def bench_ocr(workdir: Path, n_labels: int) -> dict:
+    """
+    درون پروسه: detect_code_cascade روی لیبل‌های مصنوعی (env قبل از import app تنظیم شده).
+    """
+    from app.ocr_engines import detect_code_cascade
+
+    rng = random.Random(23)
+    rows = []
+    for j in range(n_labels):
+        img, code, angle, noise = random_label(rng)
+        path = workdir / f"ocr_{j}.jpg"
+        img.save(path, format="JPEG", quality=85)
+        t0 = time.perf_counter()
+        r = detect_code_cascade(str(path))
+        rows.append((r.code == code, r.variants_tried, time.perf_counter() - t0, round(angle / 90) % 4 * 90, noise))
+
+    def summary(sel) -> dict:
+        sel = list(sel)
+        return {"n": len(sel), "accuracy": round(sum(ok for ok, *_ in sel) / max(1, len(sel)), 4),
+                "mean_variants_tried": round(statistics.fmean(v for _, v, *_ in sel), 2) if sel else None}
+
+    return {
+        **summary(rows),
+        "variants_tried_histogram": dict(sorted(Counter(v for _, v, *_ in rows).items())),
+        "accuracy_at_variants": {k: round(sum(1 for ok, v, *_ in rows if ok and v <= k) / max(1, len(rows)), 4)
+                                 for k in (1, 2, 4, 8, 16)},
+        "by_rotation": {a: summary(r for r in rows if r[3] == a) for a in (0, 90, 180, 270)},
+        "by_noise": {n: summary(r for r in rows if r[4] == n) for n in sorted({r[4] for r in rows})},
+        "latency": _percentiles([t for _, _, t, *_ in rows]),
+    }
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m bench.run", description="Tracking/ingest benchmarks (JSON output)")
+    p.add_argument("--quick", action="store_true", help="small dataset and short runs")
+    p.add_argument("--orders", type=int)
+    p.add_argument("--aliases", type=int)
+    p.add_argument("--duration", type=float, help="seconds per /track scenario")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--labels", type=int, help="images for /upload-many")
+    p.add_argument("--ocr-labels", type=int, help="images for OCR accuracy")
+    p.add_argument("--batch", type=int, default=8, help="files per /upload-many request")
+    p.add_argument("--stub-latency-ms", type=float, default=150.0, help="simulated Vision RPC latency")
+    p.add_argument("--engines", default="vision", help="OCR_ENGINES for the benchmark (barcode would read the QR)")
+    p.add_argument("--only", default=",".join(BENCHES))
+    p.add_argument("--out", help="write JSON here as well as stdout")
+    args = p.parse_args(argv)
+
+    quick = args.quick
+    n_orders = args.orders or (20_000 if quick else 1_000_000)
+    n_aliases = args.aliases if args.aliases is not None else 2 * n_orders
+    duration = args.duration or (5.0 if quick else 20.0)
+    n_labels = args.labels or (48 if quick else 200)
+    n_ocr = args.ocr_labels or (48 if quick else 200)
+    only = [b for b in args.only.split(",") if b in BENCHES]
+
+    result = {
+        "meta": {
+            "commit": _git_commit(), "started_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "params": {"orders": n_orders, "aliases": n_aliases, "duration": duration, "concurrency": args.concurrency,
+                       "labels": n_labels, "ocr_labels": n_ocr, "batch": args.batch,
+                       "stub_latency_ms": args.stub_latency_ms, "engines": args.engines, "benches": only},
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        workdir = Path(tmp)
+        db = workdir / "bench.db"
+        env = _stub_env(workdir, db, args)
+        if {"track", "upload", "bulk"} & set(only):
+            result["results"]["seed"] = seeded_db(n_orders, n_aliases, db)
+            with Server(workdir / "server", env) as srv:
+                if "track" in only:
+                    result["results"]["track"] = bench_track(srv.url, n_orders, n_aliases, duration, args.concurrency)
+                    result["results"]["track_hot"] = bench_track(srv.url, n_orders, n_aliases, duration, args.concurrency, hot=1000)
+                if "upload" in only:
+                    result["results"]["upload_many"] = bench_upload(srv.url, n_orders, n_aliases, n_labels, args.batch)
+                if "bulk" in only:
+                    result["results"]["bulk_update_status"] = bench_bulk(srv.url, n_orders)
+        if "ocr" in only:
+            # OCR درون پروسه بدون تاخیر شبکه‌ی شبیه‌سازی‌شده
+            os.environ.update({**env, "OCR_STUB_LATENCY_MS": "0"})
+            result["results"]["ocr_accuracy"] = bench_ocr(workdir, n_ocr)
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
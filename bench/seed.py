@@ -0,0 +1,102 @@
+# bench/seed.py
+"""
+ساخت دیتابیس SQLite بنچمارک با حجم واقعی (پیش‌فرض ۱M سفارش و ۲M alias).
+
+کدها قطعی (deterministic) از اندیس ساخته می‌شوند تا بنچمارک‌ها بدون کوئری کد معتبر بسازند:
+- سفارش i:            order_code(i)   = C00000042
+- alias نوع J&T:      jte_code(i)     = JTE + 12 رقم (نگاشت یک‌به‌یک از i)
+- alias نوع اینویس:    invoice_code(i) = 14 رقم
+created_at سفارش‌ها یکنواخت در ۳۶۵ روز قبل از SEED_EPOCH پخش است.
+
+فایل ساخته‌شده در bench/.data کش می‌شود و برای هر اجرا یک کپی استفاده می‌شود.
+"""
+import os
+import random
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlmodel import SQLModel, create_engine
+
+from app import models  # noqa: F401  (ثبت جدول‌ها در metadata)
+from app.models import OrderStatus
+
+DATA_DIR = Path(__file__).resolve().parent / ".data"
+SEED_EPOCH = datetime(2025, 1, 1)
+STATUSES = (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB, OrderStatus.IN_TRANSIT_IR, OrderStatus.ARRIVED_TEH)
+CHUNK = 50_000
+TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"      # همان فرمت DateTime در SQLAlchemy/SQLite
+
+
+def order_code(i: int) -> str:
+    return f"C{i:08d}"
+
+
+def jte_code(i: int) -> str:
+    # 7919 نسبت به 10^12 اول است → نگاشت یک‌به‌یک
+    return f"JTE{(i * 7919 + 100_000_000_000) % 10**12:012d}"
+
+
+def invoice_code(i: int) -> str:
+    return f"{(i * 104729 + 10**13) % 10**14:014d}"
+
+
+def alias_for(k: int, n_orders: int) -> tuple:
+    """
+    alias شماره‌ی k → (alias_code، اندیس سفارش). k < n: J&T، بعد اینویس.
+    """
+    if k < n_orders:
+        return jte_code(k), k
+    return invoice_code(k - n_orders), k - n_orders
+
+
+def created_at(i: int, n_orders: int) -> datetime:
+    return SEED_EPOCH - timedelta(days=365) + timedelta(seconds=int(i * 365 * 86400 / max(1, n_orders)))
+
+
+def seed(path: Path, n_orders: int, n_aliases: int) -> None:
+    n_aliases = min(n_aliases, 2 * n_orders)
+    tmp = path.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    engine = create_engine(f"sqlite:///{tmp}")
+    SQLModel.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(42)
+    con = sqlite3.connect(tmp)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    with con:
+        for start in range(0, n_orders, CHUNK):
+            rows = []
+            for i in range(start, min(start + CHUNK, n_orders)):
+                ts = created_at(i, n_orders).strftime(TS_FORMAT)
+                rows.append((order_code(i), rng.choice(STATUSES), None, ts, ts))
+            con.executemany('INSERT INTO "order" (code, status, image_path, created_at, updated_at) VALUES (?,?,?,?,?)', rows)
+        for start in range(0, n_aliases, CHUNK):
+            rows = []
+            for k in range(start, min(start + CHUNK, n_aliases)):
+                alias, i = alias_for(k, n_orders)
+                rows.append((order_code(i), alias, "J&T" if k < n_orders else "INVOICE", SEED_EPOCH.strftime(TS_FORMAT)))
+            con.executemany("INSERT INTO orderalias (order_code, alias_code, carrier, created_at) VALUES (?,?,?,?)", rows)
+    con.execute("ANALYZE")
+    con.close()
+    os.replace(tmp, path)
+
+
+def seeded_db(n_orders: int, n_aliases: int, dest: Path) -> dict:
+    """
+    دیتابیس کش‌شده را (در صورت نبود می‌سازد و) در dest کپی می‌کند.
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    cached = DATA_DIR / f"seed_{n_orders}_{n_aliases}.db"
+    t0 = time.perf_counter()
+    built = not cached.exists()
+    if built:
+        seed(cached, n_orders, n_aliases)
+    seed_seconds = time.perf_counter() - t0
+    shutil.copyfile(cached, dest)
+    return {"orders": n_orders, "aliases": min(n_aliases, 2 * n_orders), "built": built,
+            "seed_seconds": round(seed_seconds, 2), "db_bytes": dest.stat().st_size}
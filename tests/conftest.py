@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+# قبل از import ماژول‌های app: دیتابیس و پوشه‌ی آپلود موقت، Vision ساختگی
+_TMP = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP}/test.db")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_TMP, "uploads"))
+os.environ.setdefault("OCR_VISION_STUB", "1")
+os.environ.setdefault("OCR_VARIANT_STATS_PATH", os.path.join(_TMP, "variant_stats.json"))
+
+import pytest
+from sqlmodel import SQLModel
+
+
+@pytest.fixture
+def db():
+    """
+    جدول‌های خالی روی دیتابیس موقت؛ engine نویسنده را برمی‌گرداند.
+    """
+    from app import models  # noqa: F401  (ثبت جدول‌ها در metadata)
+    from app.deps import engine, init_db
+
+    init_db()
+    yield engine
+    with engine.begin() as conn:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+
+    from app.order_cache import order_cache
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+    order_cache.clear()
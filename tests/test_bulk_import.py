@@ -0,0 +1,66 @@
+import io
+
+from sqlmodel import Session, select
+
+from app.bulk_import import _insert_ignore, import_manifest
+from app.models import Order, OrderAlias, StatusEvent
+
+
+def _import(text, fmt="csv", chunk_size=None):
+    return import_manifest(io.BytesIO(text.encode()), fmt, chunk_size)
+
+
+def test_insert_ignore_returns_only_inserted_keys(db):
+    with Session(db) as s:
+        s.add(Order(code="OLD0000001")); s.commit()
+        inserted = _insert_ignore(s, Order, [{"code": "OLD0000001"}, {"code": "NEW0000001"}], "code")
+        s.commit()
+        assert inserted == {"NEW0000001"}
+        assert _insert_ignore(s, Order, [], "code") == set()
+
+
+def test_duplicate_rows_in_one_file(db):
+    r = _import(
+        "order_code,alias_code,carrier\n"
+        "JTE600000001,AJA600000001,AJEX\n"
+        "jte600000001,aja600000001,AJEX\n"
+        "JTE600000001,AJA600000002,\n",
+    )
+    assert r["rows"] == 3 and r["error_count"] == 0
+    assert r["orders_created"] == 1
+    assert r["aliases_created"] == 2 and r["aliases_existing"] == 0 and r["conflict_count"] == 0
+    with Session(db) as s:
+        assert len(s.exec(select(Order)).all()) == 1
+        assert len(s.exec(select(StatusEvent)).all()) == 1
+
+
+def test_existing_codes_are_not_counted(db):
+    _import("order_code,alias_code\nJTE700000001,AJA700000001\n")
+    r = _import("order_code,alias_code\nJTE700000001,AJA700000001\nJTE700000002,\n", chunk_size=1)
+    assert r["orders_created"] == 1
+    assert r["aliases_created"] == 0 and r["aliases_existing"] == 1
+    with Session(db) as s:
+        # تاریخچه فقط برای سفارش‌های واقعاً درج‌شده
+        assert sorted(e.order_code for e in s.exec(select(StatusEvent))) == ["JTE700000001", "JTE700000002"]
+
+
+def test_conflicts_are_reported_not_inserted(db):
+    _import('{"order_code": "JTE800000001", "alias_code": "AJA800000001"}\n', "jsonl")
+    r = _import(
+        '{"order_code": "JTE800000002", "alias_code": "AJA800000001"}\n'    # alias سفارش دیگری است
+        '{"order_code": "JTE800000002", "alias_code": "AJA800000002"}\n'
+        '{"order_code": "JTE800000003", "alias_code": "AJA800000002"}\n'    # همان فایل، سفارش دیگر
+        'not json\n',
+        "jsonl",
+    )
+    assert r["orders_created"] == 2
+    assert r["aliases_created"] == 1
+    assert r["conflict_count"] == 2
+    assert {(c["alias_code"], c["order_code"], c["existing_order_code"]) for c in r["conflicts"]} == {
+        ("AJA800000001", "JTE800000002", "JTE800000001"),
+        ("AJA800000002", "JTE800000003", "JTE800000002"),
+    }
+    assert r["error_count"] == 1
+    with Session(db) as s:
+        aliases = dict(s.exec(select(OrderAlias.alias_code, OrderAlias.order_code)).all())
+    assert aliases == {"AJA800000001": "JTE800000001", "AJA800000002": "JTE800000002"}
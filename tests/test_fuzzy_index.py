@@ -0,0 +1,86 @@
+import pytest
+from sqlmodel import Session, select
+
+from app import fuzzy_index as fuzzy_module
+from app.deps import settings
+from app.fuzzy_index import FuzzyCodeIndex, normalize
+from app.ingest import ALIAS_NOT_MAPPED, _apply_code
+from app.models import Order, OrderAlias
+
+
+@pytest.fixture
+def index(db, monkeypatch):
+    idx = FuzzyCodeIndex()
+    monkeypatch.setattr(fuzzy_module, "fuzzy_index", idx)
+    monkeypatch.setattr(settings, "FUZZY_MATCH_ENABLED", True)
+    monkeypatch.setattr(settings, "FUZZY_MAX_DISTANCE", 0)
+    monkeypatch.setattr(settings, "FUZZY_CANDIDATE_DISTANCE", 1)
+    monkeypatch.setattr(settings, "FUZZY_MIN_LENGTH", 8)
+    monkeypatch.setattr(settings, "FUZZY_REFRESH_SECONDS", 0.0)
+    return idx
+
+
+def _orders(engine, *codes):
+    with Session(engine) as s:
+        for c in codes:
+            s.add(Order(code=c))
+        s.commit()
+
+
+def test_normalize_folds_ocr_confusions():
+    assert normalize(" jte-0O1Il5S ") == "JTE0011155"
+    assert normalize("B8Z2G6") == "882266"
+
+
+def test_confusion_only_match_is_applied(db, index):
+    _orders(db, "JTE1234500")
+    index.load(db)
+    with Session(db) as s:
+        r = _apply_code(s, "JTEI2345OO", "x.jpg", None)
+        assert r["ok"] and r["code"] == "JTE1234500"
+        assert r["fuzzy_distance"] == 0 and r["detected_code"] == "JTEI2345OO"
+
+
+def test_neighbouring_code_is_only_a_candidate(db, index):
+    _orders(db, "JTE1234501", "JTE1234599")
+    index.load(db)
+    with Session(db) as s:
+        # کد خوانده‌شده ...502 وجود ندارد؛ ...501 همسایه است ولی نباید عکس را بگیرد
+        r = _apply_code(s, "JTE1234502", "x.jpg", None)
+        assert not r["ok"] and r["reason"] == ALIAS_NOT_MAPPED
+        assert r["candidates"] == ["JTE1234501"]
+        assert all(o.image_path is None for o in s.exec(select(Order)).all())
+
+
+def test_ambiguous_match_is_not_unique(index):
+    index.add("JTE1234501", "JTE1234501")
+    index.add("JTE1234503", "JTE1234503")
+    m = index.match("JTE1234502")
+    assert m is not None and not m.unique and not m.auto_apply
+    assert m.distance == 1 and m.candidates == ["JTE1234501", "JTE1234503"]
+
+
+def test_same_key_for_two_orders_is_ambiguous(index):
+    index.add("JTE12345O0", "A-ORDER")
+    index.add("JTE1234500", "B-ORDER")
+    m = index.match("JTE1234500")
+    assert m.distance == 0 and not m.unique and m.candidates == ["A-ORDER", "B-ORDER"]
+
+
+def test_short_codes_are_not_matched(index):
+    index.add("AB1234", "AB1234")
+    assert index.match("AB123A") is None
+    assert index.match("ABI234") is None          # حتی فاصله‌ی ۰ زیر FUZZY_MIN_LENGTH
+    settings.FUZZY_MIN_LENGTH = 6                 # monkeypatch fixture مقدار قبلی را برمی‌گرداند
+    assert index.match("ABI234").order_code == "AB1234"
+
+
+def test_refresh_picks_up_new_aliases(db, index):
+    _orders(db, "CUST000001")
+    index.load(db)
+    assert index.match("AJA7777777O") is None
+    with Session(db) as s:
+        s.add(OrderAlias(order_code="CUST000001", alias_code="AJA77777770"))
+        s.commit()
+    assert fuzzy_module.fuzzy_resolve("AJA7777777O", db).order_code == "CUST000001"
+    assert index.match("AJA7777777O").auto_apply
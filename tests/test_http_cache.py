@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from sqlmodel import Session, select
+
+from app import http_cache
+from app.deps import settings
+from app.models import Order, OrderStatus
+
+CODE = "JTE900000001"
+
+
+def _etag(client, path):
+    r = client.get(path)
+    assert r.status_code == 200
+    return r.headers["ETag"]
+
+
+def test_if_none_match_returns_304(client):
+    client.post("/orders", data={"code": CODE})
+    for path in (f"/track?code={CODE}", f"/u/{CODE}", "/track?code=NOPE000000"):
+        etag = _etag(client, path)
+        r = client.get(path, headers={"If-None-Match": etag})
+        assert r.status_code == 304 and r.headers["ETag"] == etag and not r.content
+        assert client.get(path, headers={"If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+        assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_etag_changes_with_status_and_image(client, db):
+    client.post("/orders", data={"code": CODE})
+    paths = (f"/track?code={CODE}", f"/u/{CODE}")
+    before = [_etag(client, p) for p in paths]
+
+    client.post(f"/orders/{CODE}/set-status", json={"new_status": OrderStatus.ARRIVED_DXB})
+    after_status = [_etag(client, p) for p in paths]
+    assert all(a != b for a, b in zip(before, after_status))
+    assert client.get(paths[0], headers={"If-None-Match": before[0]}).status_code == 200
+
+    with Session(db) as s:
+        o = s.exec(select(Order).where(Order.code == CODE)).one()
+        o.image_path = "/static/uploads/ab/abcdef.jpg"
+        o.updated_at = datetime.utcnow()
+        s.add(o); s.commit()
+    after_image = [_etag(client, p) for p in paths]
+    assert all(a != b for a, b in zip(after_status, after_image))
+
+
+def test_page_etag_versioned_by_live_mode_and_widths(client, monkeypatch):
+    client.post("/orders", data={"code": CODE})
+    path = f"/u/{CODE}"
+
+    def etag_with(**overrides):
+        for k, v in overrides.items():
+            monkeypatch.setattr(settings, k, v)
+        monkeypatch.setitem(http_cache._VERSIONS, "page", http_cache._page_version())
+        return _etag(client, path)
+
+    live = etag_with(LIVE_ENABLED=True, IMAGE_WIDTHS=[320, 640])
+    static = etag_with(LIVE_ENABLED=False)
+    assert live != static
+    assert etag_with(IMAGE_WIDTHS=[320, 640, 1280]) != static
+    # فقط ترتیب/تکرار عرض‌ها: همان نسخه
+    assert etag_with(IMAGE_WIDTHS=[640, 320, 320]) == static
+    # ETag نسخه‌ی JSON به تنظیمات صفحه وابسته نیست
+    json_etag = _etag(client, f"/track?code={CODE}")
+    etag_with(LIVE_ENABLED=True)
+    assert _etag(client, f"/track?code={CODE}") == json_etag
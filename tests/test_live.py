@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.deps import settings
+from app.live import _event, live_hub, ws_stream
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+async def _until(cond):
+    for _ in range(100):
+        if cond():
+            return
+        await asyncio.sleep(0)
+    raise AssertionError("timed out")
+
+
+def test_ws_event_not_lost_when_client_message_arrives_together(monkeypatch):
+    monkeypatch.setattr(settings, "LIVE_POLL_SECONDS", 0)
+    snapshot = SimpleNamespace(code="JTE990000001", status="NOT_ARRIVED_DXB", image_path=None, updated_at=None)
+
+    async def run():
+        ws = FakeWebSocket()
+        task = asyncio.ensure_future(ws_stream(ws, snapshot))
+        await _until(lambda: len(ws.sent) == 1)
+        # پیام کلاینت و تغییر وضعیت در یک دور event loop
+        ws.incoming.put_nowait({"type": "websocket.receive", "text": "ping"})
+        live_hub._dispatch([_event(snapshot.code, "ARRIVED_DXB", None, None)])
+        await _until(lambda: len(ws.sent) == 2)
+        ws.incoming.put_nowait({"type": "websocket.disconnect"})
+        await asyncio.wait_for(task, 1)
+        return ws.sent
+
+    sent = asyncio.run(run())
+    assert [e["status"] for e in sent] == ["NOT_ARRIVED_DXB", "ARRIVED_DXB"]
+    assert snapshot.code not in live_hub._subs
@@ -0,0 +1,104 @@
+import io
+from datetime import date
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.bulk_import import import_manifest
+from app.models import Order, OrderStatus, StatusCount, StatusEvent
+from app.review import enqueue_review
+from app.status_log import _apply_counts, rebuild_status_counts, status_counts
+
+
+def _counts(engine):
+    with Session(engine) as s:
+        return {st: n for st, n in status_counts(s).items() if n}
+
+
+def _group_by(engine):
+    with Session(engine) as s:
+        return dict(s.exec(select(Order.status, func.count()).group_by(Order.status)).all())
+
+
+def _events(engine, code):
+    with Session(engine) as s:
+        return [(e.old_status, e.new_status, e.source) for e in
+                s.exec(select(StatusEvent).where(StatusEvent.order_code == code).order_by(StatusEvent.id))]
+
+
+def test_create_and_set_status(client, db):
+    assert client.post("/orders", data={"code": "JTE100000001"}).status_code == 200
+    assert client.post("/orders", data={"code": "JTE100000002"}).status_code == 200
+    r = client.post("/orders/JTE100000001/set-status", json={"new_status": OrderStatus.ARRIVED_DXB})
+    assert r.status_code == 200
+    # همان وضعیت دوباره: رویداد و تغییر شمارش ندارد
+    client.post("/orders/JTE100000001/set-status", json={"new_status": OrderStatus.ARRIVED_DXB})
+
+    assert _counts(db) == {OrderStatus.NOT_ARRIVED_DXB: 1, OrderStatus.ARRIVED_DXB: 1} == _group_by(db)
+    assert _events(db, "JTE100000001") == [
+        (None, OrderStatus.NOT_ARRIVED_DXB, "create"),
+        (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB, "set_status"),
+    ]
+
+
+def test_bulk_update(client, db):
+    for c in ("JTE200000001", "JTE200000002", "JTE200000003"):
+        client.post("/orders", data={"code": c})
+    today = date.today().isoformat()
+    r = client.post("/admin/bulk-update-status", json={
+        "start_date": today, "end_date": today, "new_status": OrderStatus.IN_TRANSIT_IR,
+        "exclude_codes": ["jte200000003"],
+    })
+    assert r.json()["updated_count"] == 2
+    assert _counts(db) == {OrderStatus.IN_TRANSIT_IR: 2, OrderStatus.NOT_ARRIVED_DXB: 1} == _group_by(db)
+    assert _events(db, "JTE200000002")[-1] == (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.IN_TRANSIT_IR, "bulk")
+    assert len(_events(db, "JTE200000003")) == 1
+
+
+def test_import(client, db):
+    client.post("/orders", data={"code": "JTE300000001"})
+    manifest = (
+        '{"order_code": "JTE300000001", "status": "ARRIVED_TEH"}\n'
+        '{"order_code": "JTE300000002"}\n'
+        '{"order_code": "JTE300000003", "status": "ARRIVED_DXB"}\n'
+    )
+    report = import_manifest(io.BytesIO(manifest.encode()), "jsonl")
+    assert report["orders_created"] == 2
+    assert _counts(db) == {OrderStatus.ARRIVED_TEH: 1, OrderStatus.NOT_ARRIVED_DXB: 1,
+                           OrderStatus.ARRIVED_DXB: 1} == _group_by(db)
+    assert _events(db, "JTE300000001")[-1] == (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_TEH, "import")
+    assert _events(db, "JTE300000003") == [
+        (None, OrderStatus.NOT_ARRIVED_DXB, "import"),
+        (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB, "import"),
+    ]
+
+
+def test_review_resolve(client, db):
+    client.post("/orders", data={"code": "JTE400000001"})
+    with Session(db) as s:
+        item = enqueue_review(s, {"image": "/static/uploads/a.jpg", "reason": "ALIAS_NOT_MAPPED",
+                                  "detected_code": "AJA400000009"}, status=OrderStatus.ARRIVED_DXB)
+        s.commit()
+        item_id = item.id
+    r = client.post(f"/admin/review/{item_id}/resolve", json={"order_code": "JTE400000001"})
+    assert r.status_code == 200 and r.json()["status"] == OrderStatus.ARRIVED_DXB
+    assert _counts(db) == {OrderStatus.ARRIVED_DXB: 1} == _group_by(db)
+    assert _events(db, "JTE400000001")[-1] == (OrderStatus.NOT_ARRIVED_DXB, OrderStatus.ARRIVED_DXB, "review")
+
+
+def test_first_change_upserts_and_rebuild_matches_group_by(client, db):
+    for c in ("JTE500000001", "JTE500000002"):
+        client.post("/orders", data={"code": c})
+    with Session(db) as s:
+        # وضعیتی که هنوز ردیف شمارش ندارد، دو بار در یک دسته
+        _apply_counts(s.connection(), {OrderStatus.ARRIVED_TEH: 2, OrderStatus.NOT_ARRIVED_DXB: 0})
+        _apply_counts(s.connection(), {OrderStatus.ARRIVED_TEH: -1})
+        s.commit()
+        assert s.get(StatusCount, OrderStatus.ARRIVED_TEH).orders == 1
+
+    r = client.post("/admin/orders/counts/rebuild").json()
+    assert r["counts"] == _group_by(db) == {OrderStatus.NOT_ARRIVED_DXB: 2}
+    assert r["drift"] == {OrderStatus.ARRIVED_TEH: -1}
+    assert _counts(db) == _group_by(db)
+    with Session(db) as s:
+        assert rebuild_status_counts(s) == _group_by(db)
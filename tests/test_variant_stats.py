@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from app import ocr_google
+from app.ocr_google import flush_variant_stats, record_variant_result, variant_order
+
+
+@pytest.fixture
+def stats(tmp_path, monkeypatch):
+    path = tmp_path / "stats.json"
+    monkeypatch.setattr(ocr_google, "STATS_PATH", str(path))
+    monkeypatch.setattr(ocr_google, "_variant_stats", None)
+    monkeypatch.setattr(ocr_google, "_pending_stats", {})
+    return path
+
+
+def test_stats_are_kept_per_engine(stats):
+    default = variant_order()
+    for _ in range(5):
+        record_variant_result(("invert", 270), True, "tesseract")
+    assert variant_order() == default
+    assert variant_order("tesseract")[0] == ("invert", 270)
+
+    flush_variant_stats()
+    saved = json.loads(stats.read_text())
+    assert saved == {"tesseract:invert:270": {"s": 5, "a": 5}}
+
+
+def test_legacy_keys_are_vision_stats(stats):
+    stats.write_text(json.dumps({"contrast:90": {"s": 9, "a": 9}, "invert:0": 3}))
+    assert variant_order()[0] == ("contrast", 90)
+    assert variant_order("tesseract")[0] != ("contrast", 90)
+
+
+def test_collected_results_are_returned_not_recorded(stats):
+    from app.ocr_google import collect_variant_results
+
+    with collect_variant_results() as outcomes:
+        record_variant_result(("adaptive", 0), False, "tesseract")
+    assert outcomes == [("tesseract", ("adaptive", 0), False)]
+    assert ocr_google._pending_stats == {}
+
+    for engine, key, ok in outcomes:          # همان کاری که parent انجام می‌دهد
+        record_variant_result(key, ok, engine)
+    assert ocr_google._pending_stats == {"tesseract:adaptive:0": {"s": 0, "a": 1}}
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from app.vision_governor import CircuitBreaker, TokenBucket, VisionGovernor, VisionUnavailable, vision_budget
+
+
+def _half_open(gov: VisionGovernor) -> None:
+    gov.breaker = CircuitBreaker(failures=1, cooldown=0.0)
+    gov.breaker.failure()
+    assert gov.breaker.state == CircuitBreaker.OPEN
+
+
+def test_probe_released_when_rate_limited_before_rpc():
+    gov = VisionGovernor()
+    _half_open(gov)
+    gov.bucket = TokenBucket(rate=1.0, burst=1.0)
+    gov.bucket.reserve()                    # سطل خالی: انتظار ۱ ثانیه > بودجه
+    calls = []
+    with vision_budget(0.05), pytest.raises(VisionUnavailable) as exc:
+        gov.call(lambda timeout: calls.append(timeout))
+    assert exc.value.reason == "rate_limited"
+    assert calls == []
+    assert gov.breaker.state == CircuitBreaker.HALF_OPEN
+
+    # probe بعدی اجازه دارد و موفقیتش breaker را می‌بندد
+    gov.bucket = TokenBucket(rate=0.0, burst=1.0)
+    assert gov.call(lambda timeout: "ok") == "ok"
+    assert gov.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_probe_released_when_budget_exhausted_before_rpc():
+    gov = VisionGovernor()
+    _half_open(gov)
+    gov.bucket = TokenBucket(rate=0.0, burst=1.0)
+    with vision_budget(0.0), pytest.raises(VisionUnavailable) as exc:
+        time.sleep(0.001)
+        gov.call(lambda timeout: "never")
+    assert exc.value.reason == "deadline"
+    assert gov.call(lambda timeout: "ok") == "ok"
+    assert gov.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_breaker():
+    gov = VisionGovernor()
+    _half_open(gov)
+    gov.bucket = TokenBucket(rate=0.0, burst=1.0)
+    gov.breaker.cooldown = 60.0
+
+    def rpc(timeout):
+        raise ConnectionError("reset")
+
+    with pytest.raises(VisionUnavailable) as exc:
+        gov.call(rpc)
+    assert exc.value.reason == "circuit_open"
+    assert gov.breaker.state == CircuitBreaker.OPEN
+
+
+def test_only_channel_errors_reach_client_rebuild(monkeypatch):
+    from app import vision_governor as vg
+    from app.vision_stub import ResourceExhausted, ServiceUnavailable
+
+    monkeypatch.setattr(vg, "RETRIES", 1)
+    monkeypatch.setattr(vg, "BACKOFF_BASE", 0.0)
+    gov = VisionGovernor()
+    gov.bucket = TokenBucket(rate=0.0, burst=1.0)
+    rebuilt = []
+
+    for exc, expected in ((ResourceExhausted, 0), (TimeoutError, 0), (ServiceUnavailable, 2), (ConnectionResetError, 2)):
+        rebuilt.clear()
+        gov.breaker = CircuitBreaker(failures=100, cooldown=0.0)
+
+        def rpc(timeout):
+            raise exc("injected")
+
+        with pytest.raises(VisionUnavailable):
+            gov.call(rpc, on_channel_error=lambda: rebuilt.append(1))
+        assert len(rebuilt) == expected, exc
+
+
+def test_budget_starts_at_vision_not_at_local_engines(monkeypatch):
+    from PIL import Image
+
+    from app import vision_governor
+    from app.ocr_engines import OcrEngine, VisionEngine, _run_engines
+    from app.ocr_result import OcrResult
+
+    class SlowLocal(OcrEngine):
+        name = "slow"
+        local = True
+
+        def available(self):
+            return True
+
+        def detect(self, original, cache):
+            time.sleep(0.2)                 # barcode/Tesseract کند
+            return OcrResult(variants_tried=1)
+
+    remaining = []
+
+    class FakeVision(VisionEngine):
+        def available(self):
+            return True
+
+        def variant_keys(self):
+            return super().variant_keys()[:1]
+
+        def ocr(self, pil_img):
+            remaining.append(vision_governor._remaining())
+            return ""
+
+    monkeypatch.setattr(vision_governor, "IMAGE_BUDGET", 0.15)
+    _run_engines(Image.new("RGB", (200, 100), "white"), [SlowLocal(), FakeVision()])
+    assert len(remaining) == 1 and remaining[0] > 0.1